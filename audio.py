@@ -1,21 +1,104 @@
+import hashlib
 import librosa
 import librosa.filters
 import math
 import numpy as np
+import os
+from os.path import abspath, exists, join
 from scipy import signal
 from hparams import hparams
 from scipy.io import wavfile
 
-import lws
+# Hyper parameters features depend on
+_feature_hparams = ["sample_rate", "fft_size", "hop_size", "num_mels",
+                    "preemphasis", "min_level_db", "ref_level_db",
+                    "resample_type", "trim_silence", "trim_top_db", "trim_margin",
+                    "feature_dtype"]
 
+# Storage dtypes of features, with the scale of [0, 1] if quantized
+_feature_dtypes = {"float32": (np.float32, None), "float16": (np.float16, None),
+                   "uint16": (np.uint16, 65535), "uint8": (np.uint8, 255)}
 
-def load_wav(path):
-    return librosa.core.load(path, sr=hparams.sample_rate)[0]
+
+def feature_hparams():
+    return {name: getattr(hparams, name) for name in _feature_hparams}
 
 
-def save_wav(wav, path):
+def load_wav(path):
+    '''Loads a mono waveform at ``hparams.sample_rate``.
+
+    Files are read by soundfile (librosa for formats it can't decode), and
+    resampled by ``hparams.resample_type`` only if their sample rate differs.
+    Resampled waveforms are cached in ``hparams.resample_cache_dir``, if set.
+    '''
+    import soundfile
+    try:
+        wav, sr = soundfile.read(path, dtype="float32", always_2d=True)
+    except RuntimeError:
+        # e.g., formats libsndfile can't decode
+        return librosa.core.load(path, sr=hparams.sample_rate,
+                                 res_type=hparams.resample_type)[0]
+    # (T, C) -> (T,), as librosa
+    wav = wav.mean(axis=1) if wav.shape[1] > 1 else wav[:, 0]
+    if sr == hparams.sample_rate:
+        return wav
+
+    cache_path = None
+    if hparams.resample_cache_dir:
+        st = os.stat(path)
+        key = "{}:{}:{}:{}:{}".format(abspath(path), st.st_size, st.st_mtime_ns,
+                                      hparams.sample_rate, hparams.resample_type)
+        cache_path = join(hparams.resample_cache_dir,
+                          hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy")
+        if exists(cache_path):
+            return np.load(cache_path)
+
+    wav = librosa.resample(wav, orig_sr=sr, target_sr=hparams.sample_rate,
+                           res_type=hparams.resample_type).astype(np.float32)
+    if cache_path is not None:
+        os.makedirs(hparams.resample_cache_dir, exist_ok=True)
+        # Workers may write the same file; never leave a partial one
+        tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.save(f, wav, allow_pickle=False)
+        os.replace(tmp_path, cache_path)
+    return wav
+
+
+def trim_silence(wav):
+    '''Trims leading and trailing silence of a waveform, if
+    ``hparams.trim_silence``. See hparams for the threshold and margin.'''
+    if not hparams.trim_silence:
+        return wav
+    _, (start, end) = librosa.effects.trim(
+        wav, top_db=hparams.trim_top_db, frame_length=hparams.fft_size,
+        hop_length=hparams.hop_size)
+    margin = int(hparams.trim_margin * hparams.sample_rate)
+    return wav[max(0, start - margin):end + margin]
+
+
+def quantize(S):
+    '''Converts normalized features to ``hparams.feature_dtype`` for storage'''
+    if hparams.feature_dtype not in _feature_dtypes:
+        raise ValueError("Unknown feature_dtype: {}".format(hparams.feature_dtype))
+    dtype, scale = _feature_dtypes[hparams.feature_dtype]
+    if scale is not None:
+        S = np.round(np.clip(S, 0, 1) * scale)
+    return S.astype(dtype)
+
+
+def dequantize(S):
+    '''Converts stored features of any feature dtype back to float32'''
+    for dtype, scale in _feature_dtypes.values():
+        if S.dtype == dtype and scale is not None:
+            return S.astype(np.float32) / scale
+    return S.astype(np.float32)
+
+
+def save_wav(wav, path, sr=None):
+    sr = hparams.sample_rate if sr is None else sr
     wav *= 32767 / max(0.01, np.max(np.abs(wav)))
-    wavfile.write(path, hparams.sample_rate, wav.astype(np.int16))
+    wavfile.write(path, sr, wav.astype(np.int16))
 
 
 def preemphasis(x):
@@ -35,7 +118,11 @@ def spectrogram(y):
 
 
 def inv_spectrogram(spectrogram):
-    '''Converts spectrogram to waveform using librosa'''
+    '''Converts spectrogram to waveform using lws or Griffin-Lim'''
+    if hparams.vocoder == "griffin_lim":
+        return inv_spectrograms([spectrogram])[0]
+    elif hparams.vocoder != "lws":
+        raise ValueError("Unknown vocoder: {}".format(hparams.vocoder))
     S = _db_to_amp(_denormalize(spectrogram) + hparams.ref_level_db)  # Convert back to linear
     processor = _lws_processor()
     D = processor.run_lws(S.astype(np.float64).T ** hparams.power)
@@ -43,6 +130,70 @@ def inv_spectrogram(spectrogram):
     return inv_preemphasis(y)
 
 
+def inv_spectrograms(spectrograms, n_iter=None, momentum=None):
+    '''Converts a batch of spectrograms to waveforms using torch Griffin-Lim
+
+    Spectrograms may have different number of frames. They are zero-padded and
+    processed at once, then each waveform is trimmed to its own length.
+
+    Args:
+      spectrograms: List of (linear_dim, T) normalized spectrograms
+      n_iter: Number of iterations. Default is ``hparams.griffin_lim_iters``.
+      momentum: Momentum of the fast Griffin-Lim algorithm; 0 gives the
+        original algorithm. Default is ``hparams.griffin_lim_momentum``.
+
+    Returns:
+      List of waveforms
+    '''
+    import torch
+    n_iter = hparams.griffin_lim_iters if n_iter is None else n_iter
+    momentum = hparams.griffin_lim_momentum if momentum is None else momentum
+
+    lengths = [s.shape[1] for s in spectrograms]
+    S = np.zeros((len(spectrograms), spectrograms[0].shape[0], max(lengths)),
+                 dtype=np.float32)
+    for idx, spectrogram in enumerate(spectrograms):
+        S[idx, :, :lengths[idx]] = _db_to_amp(
+            _denormalize(spectrogram) + hparams.ref_level_db) ** hparams.power
+
+    y = _griffin_lim(torch.from_numpy(S), n_iter, momentum).numpy()
+    return [inv_preemphasis(y[idx, :(T - 1) * hparams.hop_size])
+            for idx, T in enumerate(lengths)]
+
+
+def _griffin_lim(S, n_iter, momentum):
+    '''Batched (fast) Griffin-Lim: https://arxiv.org/abs/1311.0913
+
+    Args:
+      S: (B, linear_dim, T) magnitude spectrograms (torch.FloatTensor)
+
+    Returns:
+      (B, (T - 1) * hop_size) waveforms
+    '''
+    import torch
+    n_fft, hop_size = hparams.fft_size, hparams.hop_size
+    window = torch.hann_window(n_fft)
+    length = (S.size(-1) - 1) * hop_size
+
+    def _stft(y):
+        return torch.stft(y, n_fft, hop_size, window=window, return_complex=True)
+
+    def _istft(X):
+        return torch.istft(X, n_fft, hop_size, window=window, length=length)
+
+    # Random initial phase, fixed seed for reproducible outputs
+    generator = torch.Generator().manual_seed(1234)
+    angles = torch.polar(torch.ones_like(S), 2 * np.pi * torch.rand(
+        S.size(), generator=generator))
+    rebuilt = torch.zeros_like(angles)
+    for _ in range(n_iter):
+        tprev = rebuilt
+        rebuilt = _stft(_istft(S * angles))
+        angles = rebuilt - (momentum / (1 + momentum)) * tprev
+        angles = angles / (angles.abs() + 1e-16)
+    return _istft(S * angles)
+
+
 def melspectrogram(y):
     D = _lws_processor().stft(preemphasis(y)).T
     S = _amp_to_db(_linear_to_mel(np.abs(D)))
@@ -50,6 +201,7 @@ def melspectrogram(y):
 
 
 def _lws_processor():
+    import lws
     return lws.lws(hparams.fft_size, hparams.hop_size, mode="speech")
 
 
@@ -67,7 +219,8 @@ def _linear_to_mel(spectrogram):
 
 
 def _build_mel_basis():
-    return librosa.filters.mel(hparams.sample_rate, hparams.fft_size, n_mels=hparams.num_mels)
+    return librosa.filters.mel(sr=hparams.sample_rate, n_fft=hparams.fft_size,
+                               n_mels=hparams.num_mels)
 
 
 def _amp_to_db(x):
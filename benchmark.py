@@ -0,0 +1,803 @@
+# coding: utf-8
+"""
+Benchmarks for performance sensitive parts of training and synthesis.
+
+usage: benchmark.py [options] <name>
+
+options:
+    --hparams=<parmas>        Hyper parameters [default: ].
+    --data-root=<dir>         Directory contains preprocessed features.
+    --num-utterances=<N>      Number of utterances [default: 16].
+    --batch-size=<N>          Batch size [default: 8].
+    --checkpoint=<path>       Model checkpoint. Random weights are used if not given.
+    --text-list=<path>        Text list file for synthesis benchmarks.
+    --max-decoder-steps=<N>   Max decoder steps [default: 200].
+    --num-replicas=<list>     Comma separated replica counts [default: 1,2,4].
+    --num-workers=<N>         Number of worker processes for preprocessing [default: 2].
+    --downsample-steps=<ds>   Comma separated downsample steps [default: 1,2,4].
+    --batch-sizes=<list>      Comma separated batch sizes [default: 4,8,16].
+    -h, --help                Show help message.
+
+Supported <name>s:
+    griffin_lim     Wall time and spectral convergence of lws vs torch Griffin-Lim.
+    replicas        Synthesis throughput vs. number of CPU model replicas.
+    quantization    Output error, decoder step latency and size of int8 vs fp32 model.
+    cmudict         Load time, lookup time and memory of nltk vs compiled CMUDict.
+    frontend        Text frontend throughput (sentences/sec) with cold and warm caches.
+    mecab           Japanese frontend: MeCab string vs node parsing, and cached mixing.
+    preprocess      Throughput and peak RSS of dataset building on a synthetic corpus.
+    load_wav        Per-utterance audio loading time, with and without resampling.
+    feature_dtype   Disk and batch bytes, collate time and error of feature storage dtypes.
+    downsample      Decoder steps/sec and RTF of low-frame-rate decoding (random weights).
+    glu_block       Per-layer time of the gated residual conv block vs. unfused ops.
+    memory          Training peak memory and step time vs. batch size, with and
+                    without activation checkpointing (synthetic batches).
+    speakers        Multi-speaker encoder latency vs. batch size: speaker embeddings
+                    expanded over time, broadcast, and cached per speaker.
+"""
+from docopt import docopt
+
+import sys
+import time
+from os.path import join
+
+import numpy as np
+
+import audio
+import runtime
+from hparams import hparams, hparams_debug_string
+
+_texts = [
+    "Generative adversarial network or variational auto-encoder.",
+    "Once upon a time there was a dear little girl who was loved by every one who looked at her.",
+    "A text-to-speech synthesis system typically consists of multiple stages.",
+    "Printing, in the only sense with which we are at present concerned.",
+]
+
+_ja_texts = [
+    "水をマレーシアから買わなくてはならないのです。",
+    "木曜日、停戦会談は、何の進展もないまま終了しました。",
+    "上院議員は私がデータをゆがめたと告発した。",
+    "こんにちは、今日は良い天気ですね。",
+]
+
+
+def _load_texts(text_list, num_utterances, texts=_texts):
+    if text_list is not None:
+        with open(text_list, "rb") as f:
+            texts = [l.decode("utf-8")[:-1] for l in f.readlines()]
+    return [texts[idx % len(texts)] for idx in range(num_utterances)]
+
+
+def _load_transcriptions(data_root, text_list, num_utterances):
+    if data_root is None:
+        return _load_texts(text_list, num_utterances)
+    with open(join(data_root, "train.txt"), "rb") as f:
+        return [l.decode("utf-8").split("|")[-1] for l in f.readlines()]
+
+
+def _load_linear_spectrograms(data_root, num_utterances):
+    """Returns a list of (linear_dim, T) normalized spectrograms.
+
+    Features are read from ``data_root`` if given, otherwise computed from
+    synthetic chirps of various durations.
+    """
+    if data_root is not None:
+        with open(join(data_root, "train.txt"), "rb") as f:
+            lines = f.readlines()[:num_utterances]
+        paths = [join(data_root, l.decode("utf-8").split("|")[0]) for l in lines]
+        return [audio.dequantize(np.load(path)).T for path in paths]
+
+    sr = hparams.sample_rate
+    spectrograms = []
+    for idx in range(num_utterances):
+        duration = 1.0 + 4.0 * idx / max(1, num_utterances - 1)
+        t = np.arange(int(sr * duration)) / sr
+        f0 = 100 + 10 * idx
+        y = 0.5 * np.sin(2 * np.pi * (f0 + 50 * t) * t).astype(np.float32)
+        spectrograms.append(audio.spectrogram(y).astype(np.float32))
+    return spectrograms
+
+
+def spectral_convergence(spectrogram, y):
+    """||S - S_hat||_F / ||S||_F in linear magnitude domain."""
+    S = audio._db_to_amp(audio._denormalize(spectrogram))
+    S_hat = audio._db_to_amp(audio._denormalize(audio.spectrogram(y)))
+    T = min(S.shape[1], S_hat.shape[1])
+    S, S_hat = S[:, :T], S_hat[:, :T]
+    return np.linalg.norm(S - S_hat) / np.linalg.norm(S)
+
+
+def benchmark_griffin_lim(data_root, num_utterances, batch_size):
+    spectrograms = _load_linear_spectrograms(data_root, num_utterances)
+    n_frames = sum(s.shape[1] for s in spectrograms)
+    duration = n_frames * hparams.hop_size / hparams.sample_rate
+    print("{} utterances, {:.2f} sec of audio".format(len(spectrograms), duration))
+
+    def _lws(batch):
+        hparams.set_hparam("vocoder", "lws")
+        return [audio.inv_spectrogram(s) for s in batch]
+
+    def _griffin_lim(batch):
+        return audio.inv_spectrograms(batch, momentum=0.0)
+
+    def _fast_griffin_lim(batch):
+        return audio.inv_spectrograms(batch)
+
+    print("{:<20} {:>10} {:>10} {:>10}".format("vocoder", "time (s)", "RTF", "SC"))
+    for name, f in [("lws", _lws),
+                    ("griffin_lim", _griffin_lim),
+                    ("fast_griffin_lim", _fast_griffin_lim)]:
+        waveforms = []
+        start = time.time()
+        for idx in range(0, len(spectrograms), batch_size):
+            waveforms += f(spectrograms[idx:idx + batch_size])
+        elapsed = time.time() - start
+        sc = np.mean([spectral_convergence(s, y)
+                      for s, y in zip(spectrograms, waveforms)])
+        print("{:<20} {:>10.3f} {:>10.3f} {:>10.4f}".format(
+            name, elapsed, elapsed / duration, sc))
+
+
+def benchmark_replicas(checkpoint_path, text_list, num_utterances,
+                       max_decoder_steps, replica_counts, hparams_string):
+    import synthesis
+    from deepvoice3_pytorch import frontend
+    synthesis._frontend = getattr(frontend, hparams.frontend)
+    import train
+    train._frontend = synthesis._frontend
+
+    texts = _load_texts(text_list, num_utterances)
+    cores = runtime.available_cores()
+    print("{} utterances, {} cores".format(len(texts), len(cores)))
+
+    print("{:>10} {:>10} {:>10} {:>12} {:>10}".format(
+        "replicas", "threads", "time (s)", "utt/sec", "RTF"))
+    for num_replicas in replica_counts:
+        hparams.set_hparam("num_replicas", num_replicas)
+        results = synthesis.tts_texts(
+            texts, checkpoint_path, max_decoder_steps=max_decoder_steps,
+            hparams_string=hparams_string)
+        # Exclude process startup and model loading
+        start, n_samples = None, 0
+        for waveform, _ in results:
+            if start is None:
+                start = time.time()
+                continue
+            n_samples += len(waveform)
+        elapsed = time.time() - start
+        threads = hparams.num_threads if hparams.num_threads > 0 \
+            else len(cores) // num_replicas
+        print("{:>10} {:>10} {:>10.3f} {:>12.3f} {:>10.3f}".format(
+            num_replicas, threads, elapsed, (len(texts) - 1) / elapsed,
+            elapsed / (n_samples / hparams.sample_rate)))
+
+
+def _state_dict_bytes(model):
+    import io
+    import torch
+    f = io.BytesIO()
+    torch.save(model.state_dict(), f)
+    return f.tell()
+
+
+def benchmark_quantization(checkpoint_path, text_list, num_utterances,
+                           max_decoder_steps):
+    import copy
+    import torch
+    import synthesis
+    import train
+    from deepvoice3_pytorch import frontend
+    _frontend = getattr(frontend, hparams.frontend)
+    train._frontend = _frontend
+
+    model = synthesis.load_model(checkpoint_path, max_decoder_steps)
+    model.eval()
+    quantized = copy.deepcopy(model)
+    quantized.quantize_dynamic_()
+    r = hparams.outputs_per_step
+
+    # Output error vs. fp32
+    texts = _load_texts(text_list, num_utterances)
+    errors = {"mel (free-running)": [], "linear (free-running)": [],
+              "mel (teacher-forced)": [], "linear (teacher-forced)": []}
+    length_mismatch = 0
+    with torch.no_grad():
+        for text in texts:
+            sequence = torch.LongTensor(_frontend.text_to_sequence(text)).unsqueeze(0)
+            text_positions = torch.arange(1, sequence.size(-1) + 1).unsqueeze(0).long()
+            mel, linear, _, _ = model(sequence, text_positions=text_positions)
+            mel_q, linear_q, _, _ = quantized(sequence, text_positions=text_positions)
+            length_mismatch += int(mel.size(1) != mel_q.size(1))
+            T = min(mel.size(1), mel_q.size(1))
+            errors["mel (free-running)"].append(
+                (mel[:, :T] - mel_q[:, :T]).abs().mean().item())
+            errors["linear (free-running)"].append(
+                (linear[:, :T] - linear_q[:, :T]).abs().mean().item())
+
+            # Feed the same (fp32) previous frames to both models
+            inputs = torch.cat([mel.new(1, r, mel.size(-1)).zero_(), mel[:, :-r]], 1)
+            frame_positions = torch.arange(1, mel.size(1) // r + 1).unsqueeze(0).long()
+            outputs = [m(sequence, inputs, text_positions=text_positions,
+                         frame_positions=frame_positions)
+                       for m in [model, quantized]]
+            errors["mel (teacher-forced)"].append(
+                (outputs[0][0] - outputs[1][0]).abs().mean().item())
+            errors["linear (teacher-forced)"].append(
+                (outputs[0][1] - outputs[1][1]).abs().mean().item())
+
+    print("Mean absolute error vs. fp32 ({} utterances, {} with different length):".format(
+        len(texts), length_mismatch))
+    for k, v in sorted(errors.items()):
+        print("  {:<25} {:.5f}".format(k, np.mean(v)))
+
+    # Decoder step latency; decode a fixed number of steps
+    print("{:<10} {:>15} {:>15}".format("model", "ms/step", "size (MB)"))
+    sequence = torch.LongTensor(_frontend.text_to_sequence(texts[0])).unsqueeze(0)
+    text_positions = torch.arange(1, sequence.size(-1) + 1).unsqueeze(0).long()
+    for name, m in [("fp32", model), ("int8", quantized)]:
+        m.decoder.min_decoder_steps = m.decoder.max_decoder_steps
+        with torch.no_grad():
+            encoder_outputs = m.encode(sequence)
+            m.decoder(encoder_outputs, text_positions=text_positions)  # warmup
+            start = time.time()
+            m.decoder(encoder_outputs, text_positions=text_positions)
+            elapsed = time.time() - start
+        print("{:<10} {:>15.3f} {:>15.2f}".format(
+            name, elapsed * 1000 / (m.decoder.max_decoder_steps + 1),
+            _state_dict_bytes(m) / 1024 ** 2))
+
+
+def _cmudict_stats(backend):
+    import resource
+    from deepvoice3_pytorch.frontend import en
+    from deepvoice3_pytorch.frontend.text.cmudict import CompiledCMUDict
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.time()
+    if backend == "nltk":
+        import nltk
+        d = nltk.corpus.cmudict.dict()
+    else:
+        d = CompiledCMUDict(en.cmudict_path())
+    load_time = time.time() - start
+
+    words = [w for text in _texts for w in text.lower().split(" ")] * 100
+    start = time.time()
+    for word in words:
+        d.get(word)
+    lookup_time = (time.time() - start) / len(words)
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    return len(d), load_time, lookup_time, rss
+
+
+def benchmark_cmudict():
+    import multiprocessing
+    # fresh process per backend, for startup time and memory
+    ctx = multiprocessing.get_context("spawn")
+    print("{:<10} {:>10} {:>12} {:>15} {:>15}".format(
+        "cmudict", "words", "load (s)", "lookup (us)", "max RSS (MB)"))
+    for backend in ["nltk", "compiled"]:
+        with ctx.Pool(1) as pool:
+            n, load_time, lookup_time, rss = pool.apply(_cmudict_stats, (backend,))
+        print("{:<10} {:>10} {:>12.3f} {:>15.3f} {:>15.1f}".format(
+            backend, n, load_time, lookup_time * 1e6, rss / 1024))
+
+
+def _parse_string(tagger, text):
+    # previous implementation: parse textual output of MeCab
+    tokens, yomis = [], []
+    for line in tagger.parse(text).split("\n")[:-1]:
+        s = line.split("\t")
+        if len(s) == 1:
+            break
+        token, rest = s
+        rest = rest.split(",")
+        tokens.append(token)
+        yomi = rest[7] if len(rest) > 7 else None
+        yomis.append(None if yomi == "*" else yomi)
+    return tokens, yomis
+
+
+def benchmark_mecab(text_list, num_utterances, p=0.5):
+    from deepvoice3_pytorch.frontend import jp
+    texts = _load_texts(text_list, num_utterances, _ja_texts)
+    # distinct texts, so that MeCab's own caches don't help
+    texts = [text + str(idx) for idx, text in enumerate(texts)]
+    tagger = jp._get_tagger()
+
+    def _string(texts):
+        for text in texts:
+            jp._mix_pronunciation(*_parse_string(tagger, text), p)
+
+    def _node(texts):
+        for text in texts:
+            jp._mix_pronunciation(*jp._yomi(tagger.parseToNode(text)), p)
+
+    def _cached(texts):
+        jp.texts_to_sequences(texts, p=p)
+
+    jp.clear_cache()
+    print("{:<25} {:>15}".format("method", "sentences/sec"))
+    for name, f in [("parse (string)", _string), ("parse (node)", _node),
+                    ("text_to_sequence (cold)", _cached),
+                    ("text_to_sequence (warm)", _cached)]:
+        start = time.time()
+        f(texts)
+        elapsed = time.time() - start
+        print("{:<25} {:>15.1f}".format(name, len(texts) / elapsed))
+
+
+def _make_corpus(in_dir, num_utterances, duration=2.0, sample_rate=None):
+    """Synthetic corpus in the LJSpeech layout"""
+    import os
+    os.makedirs(join(in_dir, "wavs"))
+    rng = np.random.RandomState(1234)
+    sr = hparams.sample_rate if sample_rate is None else sample_rate
+    t = np.arange(int(duration * sr)) / sr
+    with open(join(in_dir, "metadata.csv"), "w", encoding="utf-8") as f:
+        for idx in range(num_utterances):
+            name = "S-{:06d}".format(idx)
+            wav = 0.3 * np.sin(2 * np.pi * rng.uniform(100, 300) * t) \
+                + 0.01 * rng.randn(len(t))
+            audio.save_wav(wav, join(in_dir, "wavs", name + ".wav"), sr=sr)
+            text = _texts[idx % len(_texts)]
+            f.write("|".join([name, text, text]) + "\n")
+
+
+def _process_all_at_once(jobs, num_workers):
+    # previous dataset builders: a future per utterance, submitted up front
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(fn) for _, _, _, fn in jobs]
+        return [future.result() for future in futures]
+
+
+def _run_preprocess(method, in_dir, out_dir, num_workers, queue):
+    import resource
+    import ljspeech
+    import pipeline
+    try:
+        start = time.time()
+        jobs = ljspeech._jobs(in_dir, out_dir)
+        if method == "futures":
+            rows = _process_all_at_once(jobs, num_workers)
+        else:
+            chunksize = int(method.split("=")[1])
+            rows = pipeline.process(jobs, num_workers, chunksize=chunksize)
+        n = 0
+        with open(join(out_dir, "train.txt"), "w", encoding="utf-8") as f:
+            for row, _ in rows:
+                f.write("|".join([str(x) for x in row]) + "\n")
+                n += 1
+        elapsed = time.time() - start
+        queue.put((n / elapsed,
+                   resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    except Exception as e:
+        queue.put(e)
+        raise
+
+
+def benchmark_preprocess(num_utterances, num_workers):
+    import multiprocessing
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        in_dir = join(root, "corpus")
+        _make_corpus(in_dir, num_utterances)
+        print("{:<22} {:>18} {:>15}".format(
+            "method", "utterances/sec", "peak RSS (MB)"))
+        for method in ["futures", "streaming chunksize=1", "streaming chunksize=8"]:
+            out_dir = tempfile.mkdtemp(dir=root)
+            # Measure in a fresh process, as peak RSS never goes down
+            queue = multiprocessing.Queue()
+            p = multiprocessing.Process(
+                target=_run_preprocess,
+                args=(method, in_dir, out_dir, num_workers, queue))
+            p.start()
+            result = queue.get()
+            p.join()
+            if isinstance(result, Exception):
+                raise result
+            throughput, rss = result
+            print("{:<22} {:>18.1f} {:>15.1f}".format(method, throughput, rss))
+            shutil.rmtree(out_dir)
+    finally:
+        shutil.rmtree(root)
+
+
+def benchmark_load_wav(num_utterances, duration=5.0):
+    import librosa
+    import os
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp()
+    try:
+        print("ms per utterance ({:.0f} sec), resample_type={}".format(
+            duration, hparams.resample_type))
+        print("{:<12} {:>15} {:>12} {:>15} {:>15}".format(
+            "sample rate", "librosa.load", "load_wav", "cache (cold)", "cache (warm)"))
+        for sr in sorted(set([hparams.sample_rate, 48000])):
+            in_dir = join(root, str(sr))
+            _make_corpus(in_dir, num_utterances, duration, sample_rate=sr)
+            paths = [join(in_dir, "wavs", name)
+                     for name in sorted(os.listdir(join(in_dir, "wavs")))]
+
+            def _time(f):
+                start = time.time()
+                for path in paths:
+                    f(path)
+                return (time.time() - start) * 1000 / len(paths)
+
+            def _librosa_load(path):
+                # previous implementation
+                return librosa.core.load(path, sr=hparams.sample_rate)
+
+            # warmup
+            _librosa_load(paths[0])
+            audio.load_wav(paths[0])
+            results = [_time(_librosa_load)]
+            results.append(_time(audio.load_wav))
+            hparams.resample_cache_dir = join(root, "cache")
+            results += [_time(audio.load_wav), _time(audio.load_wav)]
+            hparams.resample_cache_dir = ""
+            print("{:<12} {:>15.2f} {:>12.2f} {:>15.2f} {:>15.2f}".format(sr, *results))
+    finally:
+        shutil.rmtree(root)
+
+
+def benchmark_feature_dtype(batch_size, num_iterations=20, num_frames=400):
+    import torch
+    import train
+    rng = np.random.RandomState(1234)
+    linear_dim = hparams.fft_size // 2 + 1
+    features = [(rng.rand(T, hparams.num_mels).astype(np.float32),
+                 rng.rand(T, linear_dim).astype(np.float32))
+                for T in rng.randint(num_frames // 2, num_frames, size=batch_size)]
+    print("Batch size {}, downsample_step {}".format(batch_size, hparams.downsample_step))
+    print("{:<10} {:>15} {:>15} {:>15} {:>12}".format(
+        "dtype", "disk (KB/utt)", "batch (MB)", "collate (ms)", "max error"))
+    for dtype in ["float32", "float16", "uint16", "uint8"]:
+        hparams.feature_dtype = dtype
+        batch = [(np.ones(10, dtype=np.int32), audio.quantize(mel), audio.quantize(y))
+                 for mel, y in features]
+        disk = np.mean([mel.nbytes + y.nbytes for _, mel, y in batch]) / 1024
+        start = time.time()
+        for _ in range(num_iterations):
+            collated = train.collate_fn(batch)
+        elapsed = (time.time() - start) * 1000 / num_iterations
+        mel, y = collated[2], collated[3]
+        nbytes = (mel.numel() * mel.element_size() + y.numel() * y.element_size()) / 1024 ** 2
+        error = max(np.abs(audio.dequantize(b) - a).max()
+                    for a, b in [(f[1], q[2]) for f, q in zip(features, batch)])
+        print("{:<10} {:>15.1f} {:>15.2f} {:>15.2f} {:>12.2e}".format(
+            dtype, disk, nbytes, elapsed, error))
+
+
+def benchmark_downsample(text_list, num_utterances, max_decoder_steps,
+                         downsample_steps):
+    import torch
+    import synthesis
+    import train
+    from deepvoice3_pytorch import frontend
+    _frontend = getattr(frontend, hparams.frontend)
+    train._frontend = _frontend
+    r = hparams.outputs_per_step
+    frame_shift = hparams.hop_size / hparams.sample_rate
+
+    # Every model decodes the same number of output frames, so that
+    # downsample_step=k runs 1/k of the decoder steps
+    texts = _load_texts(text_list, num_utterances)
+    print("{:<10} {:>10} {:>12} {:>12} {:>15} {:>10}".format(
+        "downsample", "steps", "steps/sec", "ms/step", "converter (ms)", "RTF"))
+    for downsample_step in downsample_steps:
+        hparams.downsample_step = downsample_step
+        steps = max_decoder_steps // downsample_step
+        model = synthesis.load_model(None, steps)
+        model.decoder.min_decoder_steps = steps
+        model.eval()
+        decoder_time, converter_time, total_steps, audio_time = 0, 0, 0, 0
+        with torch.no_grad():
+            for idx, text in enumerate([texts[0]] + texts):
+                sequence = torch.LongTensor(_frontend.text_to_sequence(text)).unsqueeze(0)
+                text_positions = torch.arange(1, sequence.size(-1) + 1).unsqueeze(0).long()
+                encoder_outputs = model.encode(sequence, text_positions=text_positions)
+                start = time.time()
+                mel_outputs, _, _, decoder_states = model.decoder(
+                    encoder_outputs, text_positions=text_positions)
+                elapsed = time.time() - start
+                # (B, T', r * C) -> (B, T, C); see DeepVoice3.decode
+                n_steps = mel_outputs.size(1)
+                decoder_states = decoder_states.view(1, n_steps * r, -1)
+                start = time.time()
+                linear_outputs = model.converter(decoder_states)
+                converter_elapsed = time.time() - start
+                if idx == 0:
+                    continue  # warmup
+                decoder_time += elapsed
+                converter_time += converter_elapsed
+                total_steps += n_steps
+                audio_time += linear_outputs.size(1) * frame_shift
+        print("{:<10} {:>10} {:>12.1f} {:>12.3f} {:>15.2f} {:>10.4f}".format(
+            downsample_step, steps, total_steps / decoder_time,
+            decoder_time * 1000 / total_steps,
+            converter_time * 1000 / len(texts),
+            (decoder_time + converter_time) / audio_time))
+
+
+def _run_training_steps(batch_size, checkpoint_activations, num_steps,
+                        hparams_string, queue, text_len=100, num_frames=400):
+    import resource
+    import torch
+    import train
+    from deepvoice3_pytorch import frontend
+    try:
+        hparams.parse(hparams_string)
+        hparams.set_hparam("checkpoint_activations", checkpoint_activations)
+        train._frontend = getattr(frontend, hparams.frontend)
+        use_cuda = torch.cuda.is_available()
+        model = train.build_model()
+        model = model.cuda() if use_cuda else model
+        model.train()
+        optimizer = torch.optim.Adam(model.get_trainable_parameters(),
+                                     lr=hparams.initial_learning_rate)
+
+        r = hparams.outputs_per_step
+        ds = hparams.downsample_step
+        linear_dim = hparams.fft_size // 2 + 1
+        x = torch.LongTensor(batch_size, text_len).random_(1, train._frontend.n_vocab)
+        text_positions = torch.arange(1, text_len + 1).unsqueeze(0).expand(
+            batch_size, text_len).long().contiguous()
+        mel = torch.rand(batch_size, num_frames // ds, hparams.num_mels)
+        frame_positions = torch.arange(1, num_frames // ds // r + 1).unsqueeze(0).expand(
+            batch_size, num_frames // ds // r).long().contiguous()
+        y = torch.rand(batch_size, num_frames, linear_dim)
+        done = torch.zeros(batch_size, num_frames // ds // r, 1)
+        if use_cuda:
+            x, text_positions, mel = x.cuda(), text_positions.cuda(), mel.cuda()
+            frame_positions, y, done = frame_positions.cuda(), y.cuda(), done.cuda()
+
+        elapsed = []
+        for step in range(num_steps + 1):
+            start = time.time()
+            optimizer.zero_grad()
+            mel_outputs, linear_outputs, _, done_hat = model(
+                x, mel, text_positions=text_positions,
+                frame_positions=frame_positions)
+            loss = (mel_outputs - mel).abs().mean() + \
+                (linear_outputs - y).abs().mean() + \
+                torch.nn.functional.binary_cross_entropy(done_hat, done)
+            loss.backward()
+            optimizer.step()
+            if use_cuda:
+                torch.cuda.synchronize()
+            if step > 0:  # warmup
+                elapsed.append(time.time() - start)
+
+        if use_cuda:
+            peak = torch.cuda.max_memory_allocated() / 1024 ** 2
+        else:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        queue.put((peak, np.mean(elapsed)))
+    except Exception as e:
+        queue.put(e)
+        raise
+
+
+def benchmark_memory(batch_sizes, hparams_string, num_steps=3):
+    import multiprocessing
+    import torch
+    print("Peak {} (MB) and training step time (s) on synthetic batches".format(
+        "CUDA memory allocated" if torch.cuda.is_available() else "RSS"))
+    print("{:>10} {:>12} {:>12} {:>12} {:>12}".format(
+        "batch size", "peak", "peak (ckpt)", "time", "time (ckpt)"))
+    for batch_size in batch_sizes:
+        results = []
+        for checkpoint_activations in [False, True]:
+            # Measure in a fresh process, as peak memory never goes down
+            queue = multiprocessing.Queue()
+            p = multiprocessing.Process(
+                target=_run_training_steps,
+                args=(batch_size, checkpoint_activations, num_steps,
+                      hparams_string, queue))
+            p.start()
+            result = queue.get()
+            p.join()
+            if isinstance(result, Exception):
+                raise result
+            results.append(result)
+        print("{:>10} {:>12.1f} {:>12.1f} {:>12.3f} {:>12.3f}".format(
+            batch_size, results[0][0], results[1][0], results[0][1], results[1][1]))
+
+
+def _unfused_glu_block(conv, x, dropout, training, causal):
+    # previous implementation of the block
+    import math
+    from torch.nn import functional as F
+    residual = x
+    x = F.dropout(x, p=dropout, training=training)
+    x = conv(x)
+    if causal:
+        x = x[:, :, :residual.size(-1)]
+    a, b = x.split(x.size(1) // 2, dim=1)
+    x = a * F.sigmoid(b)
+    return (x + residual) * math.sqrt(0.5)
+
+
+def benchmark_glu_block(batch_size, num_iterations=20):
+    import torch
+    from deepvoice3_pytorch.conv import Conv1d, glu_block, residual_sum
+    k = hparams.kernel_size
+    r = hparams.outputs_per_step
+    # (name, channels, time steps, dilation, causal) of typical layers
+    layers = [
+        ("encoder", hparams.encoder_channels, 100, 1, False),
+        ("decoder", hparams.decoder_channels, 400 // r, 2, True),
+        ("converter", hparams.converter_channels, 400, 4, False),
+    ]
+    use_cuda = torch.cuda.is_available()
+    print("Batch size {}, ms per layer (forward / forward + backward)".format(batch_size))
+    print("{:<10} {:>20} {:>20}".format("layer", "unfused", "fused"))
+    for name, C, T, dilation, causal in layers:
+        padding = (k - 1) * dilation if causal else (k - 1) // 2 * dilation
+        conv = Conv1d(C, 2 * C, k, padding=padding, dilation=(dilation,))
+        x = torch.randn(batch_size, C, T, requires_grad=True)
+        if use_cuda:
+            conv, x = conv.cuda(), x.detach().cuda().requires_grad_()
+
+        def unfused():
+            return _unfused_glu_block(conv, x, hparams.dropout, True, causal)
+
+        def fused():
+            y, residual = glu_block(conv, x, dropout=hparams.dropout,
+                                    training=True, causal=causal)
+            return residual_sum(y, residual)
+
+        results = []
+        for f in [unfused, fused]:
+            times = []
+            for backward in [False, True]:
+                for i in range(num_iterations + 1):
+                    start = time.time()
+                    y = f()
+                    if backward:
+                        y.sum().backward()
+                    if use_cuda:
+                        torch.cuda.synchronize()
+                    if i > 0:  # warmup
+                        times.append(time.time() - start)
+                results.append(np.mean(times[-num_iterations:]) * 1000)
+                times = []
+        print("{:<10} {:>9.3f} / {:>8.3f} {:>9.3f} / {:>8.3f}".format(name, *results))
+
+
+def _expanded_speaker_biases(encoder, speaker_embed, T):
+    # previous implementation: speaker embeddings expanded to (B, T, N)
+    # before the projections
+    B, N = speaker_embed.size()
+    expanded = speaker_embed.unsqueeze(1).expand(B, T, N).contiguous()
+    input_bias, conv_biases, output_bias = encoder.speaker_biases(
+        expanded.view(B * T, N))
+    return (input_bias.view(B, T, -1),
+            [None if b is None else b.view(B, T, -1) for b in conv_biases],
+            output_bias.view(B, T, -1))
+
+
+def benchmark_speakers(batch_sizes, num_iterations=20, text_len=100):
+    import torch
+    import train
+    from deepvoice3_pytorch import frontend
+    train._frontend = getattr(frontend, hparams.frontend)
+    if hparams.n_speakers == 1:
+        hparams.n_speakers = 108  # VCTK
+    model = train.build_model()
+    model.eval()
+    print("{} speakers, {} input symbols, encoder ms per batch".format(
+        hparams.n_speakers, text_len))
+    print("{:<12} {:>12} {:>12} {:>12}".format(
+        "batch size", "expanded", "broadcast", "cached"))
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            x = torch.randint(1, train._frontend.n_vocab, (batch_size, text_len)).long()
+            text_positions = torch.arange(1, text_len + 1).unsqueeze(0).expand_as(x)
+            speaker_ids = torch.randint(0, hparams.n_speakers, (batch_size,)).long()
+            # as in DeepVoice3.encode
+            positions = text_positions \
+                if model.use_text_pos_embedding_in_encoder else None
+
+            def expanded():
+                return model.encoder(
+                    x, text_positions=positions,
+                    speaker_biases=_expanded_speaker_biases(
+                        model.encoder, model.embed_speakers(speaker_ids), text_len))
+
+            def broadcast():
+                return model.encoder(
+                    x, text_positions=positions,
+                    speaker_embed=model.embed_speakers(speaker_ids))
+
+            def cached():
+                return model.encode(
+                    x, speaker_ids=speaker_ids, text_positions=text_positions)
+
+            results = []
+            for f in [expanded, broadcast, cached]:
+                times = []
+                for i in range(num_iterations + 1):
+                    start = time.time()
+                    f()
+                    if i > 0:  # warmup
+                        times.append(time.time() - start)
+                results.append(np.mean(times) * 1000)
+            print("{:<12} {:>12.2f} {:>12.2f} {:>12.2f}".format(batch_size, *results))
+
+
+def benchmark_frontend(data_root, text_list, num_utterances):
+    from deepvoice3_pytorch import frontend
+    _frontend = getattr(frontend, hparams.frontend)
+    texts = _load_transcriptions(data_root, text_list, num_utterances)
+    print("{} sentences".format(len(texts)))
+
+    print("{:>6} {:>10} {:>15}".format("p", "cache", "sentences/sec"))
+    for p in sorted(set([0.0, 0.5, hparams.replace_pronunciation_prob])):
+        _frontend.clear_cache()
+        for cache in ["cold", "warm"]:
+            start = time.time()
+            _frontend.texts_to_sequences(texts, p=p)
+            elapsed = time.time() - start
+            print("{:>6.2f} {:>10} {:>15.1f}".format(p, cache, len(texts) / elapsed))
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    name = args["<name>"]
+    data_root = args["--data-root"]
+    num_utterances = int(args["--num-utterances"])
+    batch_size = int(args["--batch-size"])
+    checkpoint_path = args["--checkpoint"]
+    text_list = args["--text-list"]
+    max_decoder_steps = int(args["--max-decoder-steps"])
+    replica_counts = list(map(int, args["--num-replicas"].split(",")))
+    num_workers = int(args["--num-workers"])
+
+    # Override hyper parameters
+    hparams.parse(args["--hparams"])
+    assert hparams.name == "deepvoice3"
+    print(hparams_debug_string())
+
+    if name == "griffin_lim":
+        benchmark_griffin_lim(data_root, num_utterances, batch_size)
+    elif name == "replicas":
+        benchmark_replicas(checkpoint_path, text_list, num_utterances,
+                           max_decoder_steps, replica_counts, args["--hparams"])
+    elif name == "quantization":
+        benchmark_quantization(checkpoint_path, text_list, num_utterances,
+                               max_decoder_steps)
+    elif name == "cmudict":
+        benchmark_cmudict()
+    elif name == "frontend":
+        benchmark_frontend(data_root, text_list, num_utterances)
+    elif name == "mecab":
+        benchmark_mecab(text_list, num_utterances)
+    elif name == "preprocess":
+        benchmark_preprocess(num_utterances, num_workers)
+    elif name == "load_wav":
+        benchmark_load_wav(num_utterances)
+    elif name == "feature_dtype":
+        benchmark_feature_dtype(batch_size)
+    elif name == "glu_block":
+        benchmark_glu_block(batch_size)
+    elif name == "memory":
+        benchmark_memory(list(map(int, args["--batch-sizes"].split(","))),
+                         args["--hparams"])
+    elif name == "speakers":
+        benchmark_speakers(list(map(int, args["--batch-sizes"].split(","))))
+    elif name == "downsample":
+        benchmark_downsample(text_list, num_utterances, max_decoder_steps,
+                             list(map(int, args["--downsample-steps"].split(","))))
+    else:
+        assert False
+
+    sys.exit(0)
@@ -0,0 +1,41 @@
+# coding: utf-8
+"""
+Compile CMUDict into memory-mappable arrays for the English frontend.
+
+By default, nltk's cmudict corpus is compiled into the directory that the
+frontend loads from (see ``deepvoice3_pytorch.frontend.en.cmudict_path``).
+
+usage: compile_cmudict.py [options]
+
+options:
+    --cmudict=<path>          cmudict-0.7b style text file. nltk's cmudict is used if not given.
+    --dst-dir=<dir>           Output directory.
+    -h, --help                Show help message.
+"""
+from docopt import docopt
+
+import sys
+import os
+
+from deepvoice3_pytorch.frontend.en import cmudict_path
+from deepvoice3_pytorch.frontend.text.cmudict import CMUDict, compile_cmudict
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    src = args["--cmudict"]
+    dst_dir = args["--dst-dir"]
+    if dst_dir is None:
+        dst_dir = cmudict_path()
+
+    if src is None:
+        entries = None
+    else:
+        d = CMUDict(src)
+        entries = [(word, pron.split(" "))
+                   for word, prons in d._entries.items() for pron in prons]
+
+    os.makedirs(dst_dir, exist_ok=True)
+    n = compile_cmudict(dst_dir, entries)
+    print("{} words -> {}".format(n, dst_dir))
+    sys.exit(0)
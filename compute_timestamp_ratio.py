@@ -1,44 +1,172 @@
-"""Compute output/input timestamp ratio.
+"""Compute output/input timestamp ratio and dataset statistics.
+
+Only metadata is read: output lengths come from the n_frames column of
+train.txt (or .npy headers), input lengths from sequences.npz (see
+preprocess.py --pretokenize) or a parallel frontend pass.
+
+Besides the ratio, it reports length histograms, decoder steps per input
+symbol (to set hparams.max_decoder_steps_per_symbol), and padding efficiency
+and epoch cost (padded frames, sequential decoder steps) for a batch size
+and batching strategies:
+
+- random: shuffled, as train.py does
+- bucketed: shuffled, then sorted by length within groups of 32 batches
+- sorted: sorted by length
 
 usage: compute_timestamp_ratio.py [options] <data_root>
 
 options:
     --hparams=<parmas>        Hyper parameters [default: ].
+    --batch-size=<n>          Batch size. hparams.batch_size is used if not given.
+    --num-workers=<n>         Num workers for the frontend.
+    --bins=<n>                Number of histogram bins [default: 10].
     -h, --help                Show this help message and exit
 """
 from docopt import docopt
 import sys
+from os.path import join
+from functools import partial
+from multiprocessing import Pool, cpu_count
 import numpy as np
 from hparams import hparams, hparams_debug_string
-import train
-from train import TextDataSource, MelSpecDataSource
-from nnmnkwii.datasets import FileSourceDataset
-from tqdm import trange
 from deepvoice3_pytorch import frontend
 
+_strategies = ["random", "bucketed", "sorted"]
+_bucket_group_size = 32
+
+
+def read_metadata(data_root):
+    """Returns texts (as train.TextDataSource reads them) and mel lengths."""
+    texts, n_frames = [], []
+    with open(join(data_root, "train.txt"), "rb") as f:
+        for l in f:
+            cols = l.decode("utf-8").split("|")
+            texts.append(cols[-1])
+            try:
+                n_frames.append(int(cols[2]))
+            except (IndexError, ValueError):
+                # header only
+                mel = np.load(join(data_root, cols[1]), mmap_mode="r")
+                n_frames.append(mel.shape[0])
+    return texts, np.array(n_frames, dtype=np.int64)
+
+
+def _sequence_length(frontend_name, p, text):
+    return len(getattr(frontend, frontend_name).text_to_sequence(text, p=p))
+
+
+def sequence_lengths(data_root, texts, num_workers=1):
+    # sequences.npz holds sequences at p=0 only, as train.py
+    if hparams.replace_pronunciation_prob <= 0:
+        seqs = frontend.load_sequences(
+            join(data_root, "sequences.npz"), texts, hparams.frontend)
+        if seqs is not None:
+            return np.array([len(seq) for seq in seqs], dtype=np.int64)
+
+    f = partial(_sequence_length, hparams.frontend,
+                hparams.replace_pronunciation_prob)
+    if num_workers <= 1:
+        lengths = list(map(f, texts))
+    else:
+        with Pool(num_workers) as pool:
+            lengths = pool.map(f, texts, chunksize=256)
+    return np.array(lengths, dtype=np.int64)
+
+
+def make_batches(lengths, batch_size, strategy, seed=1234):
+    rng = np.random.RandomState(seed)
+    if strategy == "random":
+        indices = rng.permutation(len(lengths))
+    elif strategy == "bucketed":
+        indices = rng.permutation(len(lengths))
+        group_size = batch_size * _bucket_group_size
+        indices = np.concatenate([
+            g[np.argsort(lengths[g], kind="mergesort")]
+            for g in np.split(indices, range(group_size, len(indices), group_size))])
+    elif strategy == "sorted":
+        indices = np.argsort(lengths, kind="mergesort")
+    else:
+        assert False
+    return np.split(indices, range(batch_size, len(indices), batch_size))
+
+
+def padded_target_length(n_frames):
+    """Padded target length of a batch, as train.collate_fn computes it."""
+    r = hparams.outputs_per_step
+    downsample_step = hparams.downsample_step
+    max_target_len = max(n_frames)
+    if max_target_len % r != 0:
+        max_target_len += r - max_target_len % r
+    if max_target_len % downsample_step != 0:
+        max_target_len += downsample_step - max_target_len % downsample_step
+    return max_target_len + r * downsample_step
+
+
+def batch_stats(in_lengths, out_lengths, batches):
+    """Returns input and output padding efficiency, padded output frames and
+    decoder steps of the batches."""
+    padded_in, padded_out, steps = 0, 0, 0
+    for b in batches:
+        max_target_len = padded_target_length(out_lengths[b])
+        padded_in += len(b) * in_lengths[b].max()
+        padded_out += len(b) * max_target_len
+        steps += max_target_len // (hparams.outputs_per_step * hparams.downsample_step)
+    return (in_lengths.sum() / padded_in, out_lengths.sum() / padded_out,
+            padded_out, steps)
+
+
+def print_histogram(name, lengths, bins):
+    counts, edges = np.histogram(lengths, bins=bins)
+    print("{} (min {}, mean {:.1f}, max {})".format(
+        name, lengths.min(), lengths.mean(), lengths.max()))
+    for c, lo, hi in zip(counts, edges[:-1], edges[1:]):
+        print("  {:>7.0f} - {:<7.0f} {:>7d} {}".format(
+            lo, hi, c, "#" * int(round(40 * c / counts.max()))))
+
+
 if __name__ == "__main__":
     args = docopt(__doc__)
     data_root = args["<data_root>"]
+    batch_size = args["--batch-size"]
+    num_workers = args["--num-workers"]
+    bins = int(args["--bins"])
 
     # Override hyper parameters
     hparams.parse(args["--hparams"])
     assert hparams.name == "deepvoice3"
-
-    train._frontend = getattr(frontend, hparams.frontend)
+    batch_size = hparams.batch_size if batch_size is None else int(batch_size)
+    num_workers = cpu_count() if num_workers is None else int(num_workers)
 
     # Code below
-    X = FileSourceDataset(TextDataSource(data_root))
-    Mel = FileSourceDataset(MelSpecDataSource(data_root))
-
-    in_sizes = []
-    out_sizes = []
-    for i in trange(len(X)):
-        x, m = X[i], Mel[i]
-        in_sizes.append(x.shape[0])
-        out_sizes.append(m.shape[0])
-
-    in_sizes = np.array(in_sizes)
-    out_sizes = np.array(out_sizes)
+    texts, out_sizes = read_metadata(data_root)
+    in_sizes = sequence_lengths(data_root, texts, num_workers)
+
+    frame_shift_ms = hparams.hop_size / hparams.sample_rate * 1000
+    hours = out_sizes.sum() * frame_shift_ms / (3600 * 1000)
+    print("{} utterances, {:.2f} hours".format(len(texts), hours))
+    print_histogram("Input lengths", in_sizes, bins)
+    print_histogram("Output lengths (frames)", out_sizes, bins)
+
+    # Upper bound for hparams.max_decoder_steps_per_symbol
+    decoder_steps = np.ceil(
+        out_sizes / (hparams.outputs_per_step * hparams.downsample_step))
+    steps_per_symbol = decoder_steps / np.maximum(in_sizes, 1)
+    print("Decoder steps per input symbol: mean {:.3f}, 99th percentile {:.3f}, "
+          "max {:.3f}".format(steps_per_symbol.mean(),
+                              np.percentile(steps_per_symbol, 99),
+                              steps_per_symbol.max()))
+
+    print("Batch size {}:".format(batch_size))
+    print("  {:<10} {:>10} {:>10} {:>14} {:>14} {:>8}".format(
+        "strategy", "in eff.", "out eff.", "padded frames", "decoder steps",
+        "cost"))
+    base = None
+    for strategy in _strategies:
+        batches = make_batches(out_sizes, batch_size, strategy)
+        in_eff, out_eff, padded, steps = batch_stats(in_sizes, out_sizes, batches)
+        base = padded if base is None else base
+        print("  {:<10} {:>10.3f} {:>10.3f} {:>14d} {:>14d} {:>8.3f}".format(
+            strategy, in_eff, out_eff, padded, steps, padded / base))
 
     input_timestamps = np.sum(in_sizes)
     output_timestamps = np.sum(out_sizes) / hparams.outputs_per_step
@@ -1,4 +1,5 @@
 # coding: utf-8
+import math
 import torch
 from torch import nn
 from torch.autograd import Variable
@@ -15,6 +16,7 @@ class Conv1d(nn.Conv1d):
         super().__init__(*args, **kwargs)
         self.clear_buffer()
         self._linearized_weight = None
+        self.quantized_linear = None
         self.register_backward_hook(self._clear_linearized_weight)
 
     def remove_future_timesteps(self, x):
@@ -55,7 +57,10 @@ class Conv1d(nn.Conv1d):
             input = torch.autograd.Variable(self.input_buffer, volatile=True)
             if dilation > 1:
                 input = input[:, 0::dilation, :].contiguous()
-        output = F.linear(input.view(bsz, -1), weight, self.bias)
+        if self.quantized_linear is not None:
+            output = self.quantized_linear(input.view(bsz, -1))
+        else:
+            output = F.linear(input.view(bsz, -1), weight, self.bias)
         return output.view(bsz, 1, -1)
 
     def clear_buffer(self):
@@ -76,3 +81,64 @@ class Conv1d(nn.Conv1d):
 
     def _clear_linearized_weight(self, *args):
         self._linearized_weight = None
+
+    def get_linearized_linear(self):
+        """nn.Linear equivalent to incremental_forward on a flattened input buffer."""
+        if self.quantized_linear is not None:
+            return self.quantized_linear
+        weight = self._get_linearized_weight()
+        linear = nn.Linear(weight.size(1), weight.size(0))
+        linear.weight.data.copy_(weight.data)
+        linear.bias.data.copy_(self.bias.data)
+        return linear
+
+    def quantize_linearized_weight_(self, dtype=None):
+        """Dynamically quantize the linearized weight used by incremental_forward.
+
+        Requires PyTorch >= 1.3. Weight norm must have been removed.
+        """
+        dtype = torch.qint8 if dtype is None else dtype
+        self.quantized_linear = torch.quantization.quantize_dynamic(
+            nn.Sequential(self.get_linearized_linear()), {nn.Linear}, dtype=dtype)[0]
+
+
+def glu_block(conv, x, dim=1, proj=None, dropout=0, training=False,
+              bias=None, causal=False):
+    """Head of the gated residual conv blocks of Encoder, Decoder and
+    Converters: dropout -> conv -> ``(a + bias) * sigmoid(b)``, where
+    ``a, b`` are halves of the conv output along channel ``dim``.
+
+    Args:
+        conv: Conv1d (x is B x C x T, ``dim=1``) or ConvTBC (T x B x C,
+          ``dim=-1``).
+        proj: Optional projection of the residual.
+        bias: Optional (speaker dependent) bias added to ``a``.
+        causal (bool): Remove future time steps created by padding.
+
+    Returns:
+        tuple: GLU output and residual; finish the block with
+        ``residual_sum`` (after attention, if any).
+    """
+    residual = x if proj is None else proj(x)
+    if dropout > 0:
+        x = F.dropout(x, p=dropout, training=training)
+    x = conv(x)
+    if causal:
+        x = conv.remove_future_timesteps(x) if dim != 1 \
+            else x[:, :, :residual.size(-1)]
+    if bias is None:
+        # a single kernel instead of split, sigmoid and mul
+        x = F.glu(x, dim)
+    else:
+        a, b = x.split(x.size(dim) // 2, dim=dim)
+        x = (a + bias) * torch.sigmoid(b)
+    return x, residual
+
+
+def residual_sum(x, residual):
+    """``(x + residual) * sqrt(0.5)``, computed in-place on ``x``.
+
+    ``x`` must not be needed in backward by the op which produced it
+    (true for GLU, products and sums).
+    """
+    return x.add_(residual).mul_(math.sqrt(0.5))
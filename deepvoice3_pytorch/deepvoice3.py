@@ -6,11 +6,16 @@ from torch.nn import functional as F
 from torch.autograd import Variable
 import math
 import numpy as np
+from collections import Counter, OrderedDict
+from functools import lru_cache, partial
+import inspect
 
 from fairseq.models.fconv import Embedding, Linear, LinearizedConvolution
 from fairseq.modules import GradMultiply
 from fairseq.modules.conv_tbc import ConvTBC as _ConvTBC
 
+from .conv import glu_block, residual_sum
+
 
 def Conv1d(in_channels, out_channels, kernel_size, dropout=0, **kwargs):
     from .conv import Conv1d
@@ -46,6 +51,25 @@ def has_dilation(convolutions):
     return np.any(np.array(list(map(lambda x: x[2], convolutions))) > 1)
 
 
+def _maybe_checkpoint(module, function, *args):
+    """Run ``function(*args)``, with gradient checkpointing if
+    ``module.checkpoint_activations`` is set and it is training (PyTorch >=
+    0.4). Activations are recomputed in backward; the RNG state is restored
+    so that dropout masks are the same. None args are allowed."""
+    if not (module.training and module.checkpoint_activations):
+        return function(*args)
+    from torch.utils.checkpoint import checkpoint
+    kwargs = {}
+    if "use_reentrant" in inspect.signature(checkpoint).parameters:
+        kwargs["use_reentrant"] = False
+    given = [arg is not None for arg in args]
+
+    def run(*tensors):
+        tensors = iter(tensors)
+        return function(*[next(tensors) if g else None for g in given])
+    return checkpoint(run, *[arg for arg in args if arg is not None], **kwargs)
+
+
 def build_deepvoice3(n_vocab, embed_dim=256, mel_dim=80, linear_dim=4096, r=5,
                      n_speakers=1, speaker_embed_dim=16, padding_idx=None,
                      dropout=(1 - 0.95), kernel_size=5,
@@ -56,7 +80,15 @@ def build_deepvoice3(n_vocab, embed_dim=256, mel_dim=80, linear_dim=4096, r=5,
                      key_position_rate=1.29,
                      use_memory_mask=False,
                      trainable_positional_encodings=False,
+                     downsample_step=1,
+                     checkpoint_activations=False,
                      ):
+    """Build DeepVoice3.
+
+    With ``downsample_step > 1`` (a power of 2), the decoder runs at
+    ``1 / downsample_step`` of the frame rate and the converter (see
+    ``nyanko.Converter``) upsamples its states back to full resolution.
+    """
     h = encoder_channels  # hidden dim (channels)
     k = kernel_size   # kernel size
     encoder = Encoder(
@@ -82,9 +114,23 @@ def build_deepvoice3(n_vocab, embed_dim=256, mel_dim=80, linear_dim=4096, r=5,
 
     in_dim = h // r
     h = converter_channels
-    converter = Converter(
-        in_dim=in_dim, out_dim=linear_dim, dropout=dropout,
-        convolutions=[(h, k, 1), (h, k, 1), (h, k, 2), (h, k, 4), (h, k, 8)])
+    if downsample_step > 1:
+        from .nyanko import Converter as UpsamplingConverter
+        n_upsample = int(math.log2(downsample_step))
+        assert 2 ** n_upsample == downsample_step, \
+            "downsample_step must be a power of 2"
+        assert n_upsample <= 5
+        converter = UpsamplingConverter(
+            in_dim=in_dim, out_dim=linear_dim, dropout=dropout,
+            convolutions=[(h, k, 1), (h, k, 1), (h, k, 2), (h, k, 4), (h, k, 8)],
+            deconvolutions=[(h, k, 1)] * n_upsample)
+    else:
+        converter = Converter(
+            in_dim=in_dim, out_dim=linear_dim, dropout=dropout,
+            convolutions=[(h, k, 1), (h, k, 1), (h, k, 2), (h, k, 4), (h, k, 8)])
+
+    for m in [encoder, decoder, converter]:
+        m.checkpoint_activations = checkpoint_activations
 
     model = DeepVoice3(
         encoder, decoder, converter, padding_idx=padding_idx,
@@ -113,13 +159,29 @@ class DeepVoice3(nn.Module):
 
         # Speaker embedding
         if n_speakers > 1:
+            # No padding: speaker ID 0 is a speaker, not padding
             self.embed_speakers = Embedding(
-                n_speakers, speaker_embed_dim, padding_idx)
+                n_speakers, speaker_embed_dim, padding_idx=None)
         self.n_speakers = n_speakers
         self.speaker_embed_dim = speaker_embed_dim
 
         self.use_text_pos_embedding_in_encoder = False
 
+        # LRU cache of encoder outputs for inference, disabled by default.
+        # Set this to a positive number to enable it.
+        self.encoder_cache_size = 0
+        self._encoder_cache = OrderedDict()
+        # Encoder speaker biases of all speakers for inference, computed on
+        # first use; see speaker_biases
+        self._speaker_bias_cache = None
+
+        # Run the converter over windows of this many time steps at
+        # inference (see converter_chunks), disabled by default.
+        self.converter_chunk_size = 0
+
+        # Set by quantize_dynamic_; quantized layers run on CPU only
+        self.quantized = False
+
     def get_trainable_parameters(self):
         if self.trainable_positional_encodings:
             return self.parameters()
@@ -132,21 +194,62 @@ class DeepVoice3(nn.Module):
 
     def forward(self, text_sequences, mel_targets=None, speaker_ids=None,
                 text_positions=None, frame_positions=None, input_lengths=None):
-        B = text_sequences.size(0)
+        # (B, T, text_embed_dim)
+        encoder_outputs = self.encode(
+            text_sequences, speaker_ids=speaker_ids,
+            text_positions=text_positions, input_lengths=input_lengths)
+
+        return self.decode(
+            encoder_outputs, mel_targets, speaker_ids=speaker_ids,
+            text_positions=text_positions, frame_positions=frame_positions,
+            input_lengths=input_lengths)
+
+    def encode(self, text_sequences, speaker_ids=None, text_positions=None,
+               input_lengths=None):
+        """Compute encoder outputs ``(keys, values)``.
+
+        In eval mode with ``encoder_cache_size > 0``, outputs are memoized by
+        token sequence and speaker ids, so repeated synthesis of the same text
+        only pays decoder and converter cost.
+        """
+        use_cache = not self.training and self.encoder_cache_size > 0
+        if use_cache:
+            key = self._encoder_cache_key(
+                text_sequences, speaker_ids, text_positions, input_lengths)
+            if key in self._encoder_cache:
+                self._encoder_cache.move_to_end(key)
+                return self._encoder_cache[key]
 
         if speaker_ids is not None:
-            speaker_embed = self.embed_speakers(speaker_ids)
+            speaker_biases = self.speaker_biases(speaker_ids)
         else:
-            speaker_embed = None
+            speaker_biases = None
 
-        # (B, T, text_embed_dim)
         if self.use_text_pos_embedding_in_encoder:
             encoder_outputs = self.encoder(
                 text_sequences, text_positions=text_positions,
-                lengths=input_lengths, speaker_embed=speaker_embed)
+                lengths=input_lengths, speaker_biases=speaker_biases)
         else:
             encoder_outputs = self.encoder(
-                text_sequences, lengths=input_lengths, speaker_embed=speaker_embed)
+                text_sequences, lengths=input_lengths,
+                speaker_biases=speaker_biases)
+
+        if use_cache:
+            self._encoder_cache[key] = encoder_outputs
+            while len(self._encoder_cache) > self.encoder_cache_size:
+                self._encoder_cache.popitem(last=False)
+
+        return encoder_outputs
+
+    def decode(self, encoder_outputs, mel_targets=None, speaker_ids=None,
+               text_positions=None, frame_positions=None, input_lengths=None):
+        """Run decoder and converter on (possibly cached) encoder outputs."""
+        B = encoder_outputs[0].size(0)
+
+        if speaker_ids is not None:
+            speaker_embed = self.embed_speakers(speaker_ids)
+        else:
+            speaker_embed = None
 
         # (B, T', mel_dim*r)
         mel_outputs, alignments, done, decoder_states = self.decoder(
@@ -160,11 +263,71 @@ class DeepVoice3(nn.Module):
         decoder_states = decoder_states.view(B, mel_outputs.size(1), -1)
 
         # (B, T, linear_dim)
-        linear_outputs = self.converter(decoder_states)
+        if not self.training and self.converter_chunk_size > 0:
+            linear_outputs = torch.cat(list(converter_chunks(
+                self.converter, decoder_states, self.converter_chunk_size)), 1)
+        else:
+            linear_outputs = self.converter(decoder_states)
 
         return mel_outputs, linear_outputs, alignments, done
 
+    def _encoder_cache_key(self, text_sequences, speaker_ids, text_positions,
+                           input_lengths):
+        def _bytes(x):
+            return None if x is None else x.data.cpu().numpy().tobytes()
+
+        key = (tuple(text_sequences.size()), _bytes(text_sequences),
+               _bytes(speaker_ids))
+        if self.use_text_pos_embedding_in_encoder:
+            key += (_bytes(text_positions),)
+        if input_lengths is not None:
+            key += (tuple(int(l) for l in input_lengths),)
+        return key
+
+    def speaker_biases(self, speaker_ids):
+        """Encoder speaker biases (see ``Encoder.speaker_biases``) for
+        ``speaker_ids``.
+
+        In eval mode, they are computed for all speakers once and looked up,
+        instead of projecting speaker embeddings every forward.
+        """
+        if self.training:
+            return self.encoder.speaker_biases(self.embed_speakers(speaker_ids))
+
+        weight = self.embed_speakers.weight
+        cache = self._speaker_bias_cache
+        if cache is None or (cache[0].dtype, cache[0].device) != (
+                weight.dtype, weight.device):
+            all_ids = torch.arange(self.n_speakers, device=weight.device)
+            biases = self.encoder.speaker_biases(self.embed_speakers(all_ids))
+            input_bias, conv_biases, output_bias = biases
+            cache = self._speaker_bias_cache = (
+                input_bias.detach(),
+                [None if b is None else b.detach() for b in conv_biases],
+                output_bias.detach())
+
+        input_bias, conv_biases, output_bias = cache
+        return (input_bias.index_select(0, speaker_ids),
+                [None if b is None else b.index_select(0, speaker_ids)
+                 for b in conv_biases],
+                output_bias.index_select(0, speaker_ids))
+
+    def clear_encoder_cache(self):
+        """Clear cached encoder outputs and speaker biases."""
+        self._encoder_cache.clear()
+        self._speaker_bias_cache = None
+
+    def train(self, mode=True):
+        if mode != self.training:
+            self.clear_encoder_cache()
+        return super(DeepVoice3, self).train(mode)
+
+    def load_state_dict(self, *args, **kwargs):
+        self.clear_encoder_cache()
+        return super(DeepVoice3, self).load_state_dict(*args, **kwargs)
+
     def make_generation_fast_(self):
+        self.clear_encoder_cache()
 
         def remove_weight_norm(m):
             try:
@@ -173,6 +336,27 @@ class DeepVoice3(nn.Module):
                 return
         self.apply(remove_weight_norm)
 
+    def quantize_dynamic_(self, dtype=None):
+        """Quantize weights to int8 for CPU inference (PyTorch >= 1.3).
+
+        Linear layers (including attention projections and the converter
+        output layer) are replaced by dynamically quantized ones, and the
+        linearized weights used for incremental decoding of dilated
+        convolutions are quantized as well. Call after
+        ``make_generation_fast_``. The model must stay on CPU afterwards.
+        """
+        dtype = torch.qint8 if dtype is None else dtype
+        for m in self.modules():
+            assert not hasattr(m, "weight_g"), \
+                "call make_generation_fast_ before quantization"
+        self.clear_encoder_cache()
+        self.quantized = True
+        torch.quantization.quantize_dynamic(
+            self, {nn.Linear}, dtype=dtype, inplace=True)
+        for conv in self.decoder.convolutions:
+            if hasattr(conv, "quantize_linearized_weight_"):
+                conv.quantize_linearized_weight_(dtype)
+
 
 class Encoder(nn.Module):
     def __init__(self, n_vocab, embed_dim, n_speakers, speaker_embed_dim,
@@ -186,10 +370,8 @@ class Encoder(nn.Module):
         self.embed_tokens = Embedding(n_vocab, embed_dim, padding_idx)
 
         # Text position embedding
-        self.embed_text_positions = Embedding(
+        self.embed_text_positions = SinusoidalEncoding(
             max_positions, embed_dim, padding_idx)
-        self.embed_text_positions.weight.data = position_encoding_init(
-            max_positions, embed_dim)
 
         # Speaker embedding
         if n_speakers > 1:
@@ -218,10 +400,23 @@ class Encoder(nn.Module):
                             dilation=dilation, dropout=dropout))
             in_channels = out_channels
         self.fc2 = Linear(in_channels, embed_dim)
+        self.checkpoint_activations = False
+
+    def speaker_biases(self, speaker_embed):
+        """Softsign projections of speaker embeddings (B, N), broadcast over
+        time: biases of the input embedding, each conv block (None for single
+        speaker models) and the output, each (B, 1, C)."""
+        speaker_embed = speaker_embed.unsqueeze(1)
+        return (F.softsign(self.speaker_fc1(speaker_embed)),
+                [None if proj is None else F.softsign(proj(speaker_embed))
+                 for proj in self.speaker_projections],
+                F.softsign(self.speaker_fc2(speaker_embed)))
 
     def forward(self, text_sequences, text_positions=None, lengths=None,
-                speaker_embed=None):
-        assert self.n_speakers == 1 or speaker_embed is not None
+                speaker_embed=None, speaker_biases=None):
+        if speaker_biases is None and speaker_embed is not None:
+            speaker_biases = self.speaker_biases(speaker_embed)
+        assert self.n_speakers == 1 or speaker_biases is not None
 
         # embed text_sequences
         x = self.embed_tokens(text_sequences)
@@ -231,15 +426,10 @@ class Encoder(nn.Module):
         x = F.dropout(x, p=self.dropout, training=self.training)
 
         # embed speakers
-        if speaker_embed is not None:
-            # expand speaker embedding for all time steps
-            # (B, N) -> (B, T, N)
-            ss = speaker_embed.size()
-            speaker_embed = speaker_embed.unsqueeze(1).expand(
-                ss[0], x.size(1), ss[-1])
-            speaker_embed_btc = speaker_embed
-            speaker_embed_tbc = speaker_embed.transpose(0, 1)
-            x += F.softsign(self.speaker_fc1(speaker_embed_btc))
+        conv_biases = [None] * len(self.convolutions)
+        if speaker_biases is not None:
+            input_bias, conv_biases, output_bias = speaker_biases
+            x = x + input_bias
 
         input_embedding = x
 
@@ -252,28 +442,20 @@ class Encoder(nn.Module):
         x = x.transpose(0, 1) if use_convtbc else x.transpose(1, 2)
 
         # １D conv blocks
-        for proj, speaker_proj, conv in zip(
-                self.projections, self.speaker_projections, self.convolutions):
-            residual = x if proj is None else proj(x)
-            x = F.dropout(x, p=self.dropout, training=self.training)
-            x = conv(x)
-            splitdim = -1 if use_convtbc else 1
-            a, b = x.split(x.size(splitdim) // 2, dim=splitdim)
-            if speaker_proj is not None:
-                softsign = F.softsign(speaker_proj(
-                    speaker_embed_tbc if use_convtbc else speaker_embed_btc))
-                softsign = softsign if use_convtbc else softsign.transpose(1, 2)
-                a = a + softsign
-            x = a * F.sigmoid(b)
-            x = (x + residual) * math.sqrt(0.5)
+        for idx, bias in enumerate(conv_biases):
+            if bias is not None:
+                # (B, 1, C) -> (1, B, C) or (B, C, 1)
+                bias = bias.transpose(0, 1) if use_convtbc else bias.transpose(1, 2)
+            x = _maybe_checkpoint(
+                self, partial(self._conv_block, idx, use_convtbc), x, bias)
 
         # Back to batch first
         x = x.transpose(0, 1) if use_convtbc else x.transpose(1, 2)
 
         # project back to size of embedding
         keys = self.fc2(x)
-        if speaker_embed is not None:
-            keys += F.softsign(self.speaker_fc2(speaker_embed_btc))
+        if speaker_biases is not None:
+            keys = keys + output_bias
 
         # scale gradients (this only affects backward, not forward)
         if self.num_attention_layers is not None:
@@ -284,6 +466,13 @@ class Encoder(nn.Module):
 
         return keys, values
 
+    def _conv_block(self, idx, use_convtbc, x, speaker_bias):
+        x, residual = glu_block(
+            self.convolutions[idx], x, dim=-1 if use_convtbc else 1,
+            proj=self.projections[idx], dropout=self.dropout,
+            training=self.training, bias=speaker_bias)
+        return residual_sum(x, residual)
+
 
 def get_mask_from_lengths(memory, memory_lengths):
     """Get mask tensor from list of length
@@ -347,17 +536,64 @@ class AttentionLayer(nn.Module):
         return x, attn_scores
 
 
+@lru_cache(maxsize=32)
+def _sinusoid_table(start, end, d_pos_vec, position_rate):
+    position = np.arange(start, end, dtype=np.float64).reshape(-1, 1)
+    table = position_rate * position / np.power(
+        10000, 2 * np.arange(d_pos_vec) / d_pos_vec)
+    table[:, 0::2] = np.sin(table[:, 0::2])  # dim 2i
+    table[:, 1::2] = np.cos(table[:, 1::2])  # dim 2i+1
+    # keep dim 0 for padding token position encoding zero vector
+    if start == 0:
+        table[0] = 0
+    return table.astype(np.float32)
+
+
 def position_encoding_init(n_position, d_pos_vec, position_rate=1.0):
     ''' Init the sinusoid position encoding table '''
+    return torch.from_numpy(
+        _sinusoid_table(0, n_position, d_pos_vec, position_rate).copy())
 
-    # keep dim 0 for padding token position encoding zero vector
-    position_enc = np.array([
-        [position_rate * pos / np.power(10000, 2 * i / d_pos_vec) for i in range(d_pos_vec)]
-        if pos != 0 else np.zeros(d_pos_vec) for pos in range(n_position)])
 
-    position_enc[1:, 0::2] = np.sin(position_enc[1:, 0::2])  # dim 2i
-    position_enc[1:, 1::2] = np.cos(position_enc[1:, 1::2])  # dim 2i+1
-    return torch.from_numpy(position_enc).type(torch.FloatTensor)
+class SinusoidalEncoding(nn.Embedding):
+    """Sinusoid position encodings for positions of any length.
+
+    The first ``num_embeddings`` rows are the weight, as with ``Embedding``
+    (and may be trained). Rows beyond are computed on demand and cached;
+    they are not part of ``state_dict``.
+    """
+
+    def __init__(self, num_embeddings, embedding_dim, padding_idx=None,
+                 position_rate=1.0):
+        super(SinusoidalEncoding, self).__init__(
+            num_embeddings, embedding_dim, padding_idx)
+        self.position_rate = position_rate
+        self.weight.data = position_encoding_init(
+            num_embeddings, embedding_dim, position_rate)
+        self._extension = None
+
+    def _extended_rows(self, n_position):
+        n = self.weight.size(0)
+        ext = self._extension
+        if ext is None or n + ext.size(0) < n_position or \
+                ext.type() != self.weight.data.type():
+            # grow geometrically to avoid recomputing every decoder step
+            end = max(n_position, 2 * (n + (0 if ext is None else ext.size(0))))
+            ext = torch.from_numpy(_sinusoid_table(
+                n, end, self.embedding_dim, self.position_rate).copy())
+            self._extension = ext = ext.type_as(self.weight.data)
+        return ext[:n_position - n]
+
+    def forward(self, positions):
+        if getattr(torch.jit, "is_tracing", lambda: False)():
+            # traced graphs (e.g., ONNX export) have the fixed table only
+            return super(SinusoidalEncoding, self).forward(positions)
+        n_position = int(positions.data.max()) + 1 if positions.numel() > 0 else 0
+        if n_position <= self.weight.size(0):
+            return super(SinusoidalEncoding, self).forward(positions)
+        weight = torch.cat(
+            [self.weight, Variable(self._extended_rows(n_position))], 0)
+        return F.embedding(positions, weight)
 
 
 class Decoder(nn.Module):
@@ -382,14 +618,12 @@ class Decoder(nn.Module):
             attention = [attention] * len(convolutions)
 
         # Position encodings for query (decoder states) and keys (encoder states)
-        self.embed_query_positions = Embedding(
-            max_positions, convolutions[0][0], padding_idx)
-        self.embed_query_positions.weight.data = position_encoding_init(
-            max_positions, convolutions[0][0], position_rate=query_position_rate)
-        self.embed_keys_positions = Embedding(
-            max_positions, embed_dim, padding_idx)
-        self.embed_keys_positions.weight.data = position_encoding_init(
-            max_positions, embed_dim, position_rate=key_position_rate)
+        self.embed_query_positions = SinusoidalEncoding(
+            max_positions, convolutions[0][0], padding_idx,
+            position_rate=query_position_rate)
+        self.embed_keys_positions = SinusoidalEncoding(
+            max_positions, embed_dim, padding_idx,
+            position_rate=key_position_rate)
 
         self.fc1 = Linear(in_channels, convolutions[0][0], dropout=dropout)
         in_channels = convolutions[0][0]
@@ -421,6 +655,12 @@ class Decoder(nn.Module):
         self._is_inference_incremental = False
         self.max_decoder_steps = 200
         self.min_decoder_steps = 10
+        # Early termination policies (disabled if <= 0); see _should_stop
+        self.attention_stop_steps = 0
+        self.max_decoder_steps_per_symbol = 0.0
+        # Number of decoded sequences each policy stopped
+        self.stop_counts = Counter()
+        self.checkpoint_activations = False
         self.use_memory_mask = use_memory_mask
         if isinstance(force_monotonic_attention, bool):
             self.force_monotonic_attention = \
@@ -428,12 +668,20 @@ class Decoder(nn.Module):
         else:
             self.force_monotonic_attention = force_monotonic_attention
 
+        # Optional (traced) single step function for incremental inference.
+        # Not registered as a submodule: it shares parameters with the decoder
+        # and must not show up in state_dict.
+        self.__dict__["_incremental_step"] = None
+
     def forward(self, encoder_out, inputs=None,
                 text_positions=None, frame_positions=None,
                 speaker_embed=None, lengths=None):
 
         if inputs is None:
             assert text_positions is not None
+            if self._incremental_step is not None:
+                return self._incremental_forward_with_step(
+                    encoder_out, text_positions)
             self._start_incremental_inference()
             outputs = self._incremental_forward(encoder_out, text_positions)
             self._stop_incremental_inference()
@@ -454,7 +702,7 @@ class Decoder(nn.Module):
         # position encodings
         if text_positions is not None:
             text_pos_embed = self.embed_keys_positions(text_positions)
-            keys += text_pos_embed
+            keys = keys + text_pos_embed
         if frame_positions is not None:
             frame_pos_embed = self.embed_query_positions(frame_positions)
 
@@ -473,34 +721,17 @@ class Decoder(nn.Module):
         x = x.transpose(0, 1) if use_convtbc else x.transpose(1, 2)
 
         # temporal convolutions
+        if frame_positions is None:
+            frame_pos_embed = None
         alignments = []
-        for idx, (proj, conv, attention) in enumerate(zip(
-                self.projections, self.convolutions, self.attention)):
-            residual = x if proj is None else proj(x)
-            if idx > 0:
-                x = F.dropout(x, p=self.dropout, training=self.training)
-            x = conv(x)
-            splitdim = -1 if use_convtbc else 1
-            if use_convtbc:
-                x = conv.remove_future_timesteps(x)
-            else:
-                x = x[:, :, :residual.size(-1)]
-            a, b = x.split(x.size(splitdim) // 2, dim=splitdim)
-            x = a * F.sigmoid(b)
-
-            # Feed conv output to attention layer as query
+        for idx, attention in enumerate(self.attention):
+            x = _maybe_checkpoint(
+                self, partial(self._conv_block, idx, use_convtbc),
+                x, keys, values, frame_pos_embed, mask)
             if attention is not None:
-                # (B x T x C)
-                x = x.transpose(1, 0) if use_convtbc else x.transpose(1, 2)
-                x = x if frame_positions is None else x + frame_pos_embed
-                x, alignment = attention(x, (keys, values), mask=mask)
-                # (T x B x C)
-                x = x.transpose(1, 0) if use_convtbc else x.transpose(1, 2)
+                x, alignment = x
                 alignments += [alignment]
 
-            # residual
-            x = (x + residual) * math.sqrt(0.5)
-
         # Back to batch first
         x = x.transpose(0, 1) if use_convtbc else x.transpose(1, 2)
 
@@ -515,6 +746,25 @@ class Decoder(nn.Module):
 
         return x, torch.stack(alignments), done, decoder_states
 
+    def _conv_block(self, idx, use_convtbc, x, keys, values, frame_pos_embed, mask):
+        attention = self.attention[idx]
+        x, residual = glu_block(
+            self.convolutions[idx], x, dim=-1 if use_convtbc else 1,
+            proj=self.projections[idx], dropout=self.dropout if idx > 0 else 0,
+            training=self.training, causal=True)
+
+        # Feed conv output to attention layer as query
+        if attention is not None:
+            # (B x T x C)
+            x = x.transpose(1, 0) if use_convtbc else x.transpose(1, 2)
+            x = x if frame_pos_embed is None else x + frame_pos_embed
+            x, alignment = attention(x, (keys, values), mask=mask)
+            # (T x B x C)
+            x = x.transpose(1, 0) if use_convtbc else x.transpose(1, 2)
+
+        x = residual_sum(x, residual)
+        return x if attention is None else (x, alignment)
+
     def incremental_inference(self, beam_size=None):
         """Context manager for incremental inference.
         This provides an optimized forward pass for incremental inference
@@ -574,7 +824,7 @@ class Decoder(nn.Module):
 
         # position encodings
         text_pos_embed = self.embed_keys_positions(text_positions)
-        keys += text_pos_embed
+        keys = keys + text_pos_embed
 
         # transpose only once to speed up attention layers
         keys = keys.transpose(1, 2).contiguous()
@@ -589,6 +839,7 @@ class Decoder(nn.Module):
             last_attended[idx] = 0 if v else None
 
         num_attention_layers = sum([layer is not None for layer in self.attention])
+        stop_state = self._start_stopping(keys, text_positions)
         t = 0
         if initial_input is None:
             initial_input = Variable(
@@ -618,24 +869,21 @@ class Decoder(nn.Module):
                 residual = x if proj is None else proj(x)
                 if idx > 0:
                     x = F.dropout(x, p=self.dropout, training=self.training)
-                x = conv.incremental_forward(x)
-                a, b = x.split(x.size(-1) // 2, dim=-1)
-                x = a * F.sigmoid(b)
+                x = F.glu(conv.incremental_forward(x), -1)
 
                 # attention
                 if attention is not None:
                     x = x + frame_pos_embed
                     x, alignment = attention(x, (keys, values),
                                              last_attended=last_attended[idx])
-                    if self.force_monotonic_attention:
+                    if self.force_monotonic_attention[idx]:
                         last_attended[idx] = alignment.max(-1)[1].view(-1).data[0]
                     if ave_alignment is None:
                         ave_alignment = alignment
                     else:
-                        ave_alignment = ave_alignment + ave_alignment
+                        ave_alignment = ave_alignment + alignment
 
-                # residual
-                x = (x + residual) * math.sqrt(0.5)
+                x = residual_sum(x, residual)
 
             ave_alignment = ave_alignment.div_(num_attention_layers)
             decoder_state = x
@@ -651,10 +899,11 @@ class Decoder(nn.Module):
             dones += [done]
 
             t += 1
-            if (done > 0.5).all() and t > self.min_decoder_steps:
-                break
-            elif t > self.max_decoder_steps:
-                print("Warning! doesn't seems to be converged")
+            reason = self._should_stop(t, done, ave_alignment, stop_state)
+            if reason is not None:
+                self.stop_counts[reason] += 1
+                if reason == "max_steps":
+                    print("Warning! doesn't seems to be converged")
                 break
 
         # Remove 1-element time axis
@@ -669,6 +918,56 @@ class Decoder(nn.Module):
 
         return outputs, alignments, dones, decoder_states
 
+    def _start_stopping(self, keys, text_positions):
+        """State of termination policies for a batch; ``keys`` is (B, C, T)."""
+        B, T = keys.size(0), keys.size(-1)
+        if text_positions is not None:
+            # positions of padding are zero
+            lengths = (text_positions.data > 0).long().sum(-1).view(B)
+        else:
+            lengths = keys.data.new(B).fill_(T).long()
+        state = {"last_position": lengths - 1,
+                 "reached": lengths.new(B).fill_(-1)}
+        if self.max_decoder_steps_per_symbol > 0:
+            state["budget"] = (
+                lengths.float() * self.max_decoder_steps_per_symbol).ceil().long()
+        return state
+
+    def _should_stop(self, t, done, alignment, state):
+        """Returns the policy to stop decoding by after ``t`` steps, or None.
+
+        - ``done``: all done flags are > 0.5
+        - ``attention``: the attended position reached the last input symbol
+          ``attention_stop_steps`` steps ago
+        - ``budget``: ``max_decoder_steps_per_symbol`` steps per input symbol
+          were decoded (see compute_timestamp_ratio.py)
+        - ``max_steps``: more than ``max_decoder_steps`` steps were decoded
+
+        Policies apply per sequence; decoding stops once every sequence in
+        the batch is finished, but not before ``min_decoder_steps``.
+        """
+        B = done.size(0)
+        finished = done.data.view(B) > 0.5
+        can_stop = t > self.min_decoder_steps
+        if can_stop and finished.all():
+            return "done"
+        if self.attention_stop_steps > 0:
+            position = alignment.data.view(B, -1).max(-1)[1]
+            reached = state["reached"]
+            reached.masked_fill_(
+                (reached < 0) & (position >= state["last_position"]), t)
+            finished = finished | (
+                (reached >= 0) & (t - reached >= self.attention_stop_steps))
+            if can_stop and finished.all():
+                return "attention"
+        if "budget" in state:
+            finished = finished | (state["budget"] <= t)
+            if can_stop and finished.all():
+                return "budget"
+        if t > self.max_decoder_steps:
+            return "max_steps"
+        return None
+
     def start_fresh_sequence(self):
         """Clear all state used for incremental generation.
         **For incremental inference only**
@@ -680,8 +979,242 @@ class Decoder(nn.Module):
             for conv in self.convolutions:
                 conv.clear_buffer()
 
+    def make_incremental_step(self, trace=False):
+        """Build a single decoding step function with explicit state.
+
+        The step is a snapshot of the current convolution weights, so build
+        it after loading weights (and ``make_generation_fast_``).
+
+        Args:
+            trace (bool): Trace the step by ``torch.jit.trace`` if True.
+
+        Returns:
+            IncrementalDecoderStep or its traced module.
+        """
+        assert not self.training, "incremental step only supports eval mode"
+        step = IncrementalDecoderStep(self)
+        if trace:
+            # example inputs; the number of encoder time steps is dynamic
+            embed_dim = self.embed_keys_positions.embedding_dim
+            keys = self.embed_keys_positions.weight.data.new(1, embed_dim, 8).zero_()
+            values = self.embed_keys_positions.weight.data.new(1, 8, embed_dim).zero_()
+            step = torch.jit.trace(step, self._initial_step_inputs(keys, values))
+        return step
+
+    def set_incremental_step(self, step):
+        """Use ``step`` (e.g., from ``make_incremental_step``) for inference.
+        Pass None to go back to ``_incremental_forward``."""
+        self.__dict__["_incremental_step"] = step
+
+    def _prepare_step_keys_values(self, encoder_out, text_positions):
+        keys, values = encoder_out
+        if text_positions is not None:
+            keys = keys + self.embed_keys_positions(text_positions)
+        keys = keys.transpose(1, 2).contiguous()
+
+        # Pre-scale values once instead of scaling attention outputs every step
+        s = values.size(1)
+        values = values * (s * math.sqrt(1.0 / s))
+        return keys, values
+
+    def _initial_step_inputs(self, keys, values):
+        B = keys.size(0)
+        current_input = keys.new(B, 1, self.in_dim * self.r).zero_()
+        frame_pos_embed = keys.new(
+            B, 1, self.embed_query_positions.embedding_dim).zero_()
+        num_attention_layers = sum([layer is not None for layer in self.attention])
+        last_attended = keys.new(B, max(1, num_attention_layers)).zero_().long()
+        conv_buffers = []
+        for conv in self.convolutions:
+            kw = conv.kernel_size[0]
+            dilation = getattr(conv, "dilation", (1,))[0]
+            conv_buffers.append(
+                keys.new(B, kw + (kw - 1) * (dilation - 1), conv.in_channels).zero_())
+        return (current_input, frame_pos_embed, keys, values, last_attended) \
+            + tuple(conv_buffers)
+
+    def _incremental_forward_with_step(self, encoder_out, text_positions):
+        step = self._incremental_step
+        keys, values = self._prepare_step_keys_values(encoder_out, text_positions)
+        B = keys.size(0)
+
+        inputs = list(self._initial_step_inputs(keys, values))
+        stop_state = self._start_stopping(keys, text_positions)
+        decoder_states = []
+        outputs = []
+        alignments = []
+        dones = []
+        t = 0
+        while True:
+            frame_pos = keys.new(B, 1).zero_().add_(t + 1).long()
+            inputs[1] = self.embed_query_positions(frame_pos)
+
+            step_outputs = step(*inputs)
+            output, done, decoder_state, alignment = step_outputs[:4]
+
+            # feed back states
+            inputs[0] = output
+            inputs[4:] = step_outputs[4:]
+
+            outputs += [output]
+            decoder_states += [decoder_state]
+            alignments += [alignment]
+            dones += [done]
+
+            t += 1
+            reason = self._should_stop(t, done, alignment, stop_state)
+            if reason is not None:
+                self.stop_counts[reason] += 1
+                if reason == "max_steps":
+                    print("Warning! doesn't seems to be converged")
+                break
+
+        alignments = torch.cat(alignments, dim=1)
+        decoder_states = torch.cat(decoder_states, dim=1)
+        outputs = torch.cat(outputs, dim=1)
+
+        return outputs, alignments, dones, decoder_states
+
+
+class IncrementalDecoderStep(nn.Module):
+    """A single step of incremental decoding with explicit state.
+
+    Convolution input buffers and attended positions are passed in and
+    returned instead of being kept in module attributes, so that the step can
+    be traced (``torch.jit.trace``) or exported, and the decode loop only
+    needs to feed states back.
+
+    Inputs:
+        current_input: (B, 1, in_dim * r) previous output frames
+        frame_pos_embed: (B, 1, C) query position encoding for this step
+        keys: (B, embed_dim, T) position-encoded, transposed keys
+        values: (B, T, embed_dim) values scaled by sqrt(T)
+        last_attended: (B, num_attention_layers) last attended positions
+        conv_buffers: (B, kw + (kw - 1) * (dilation - 1), C_in) per conv layer
+
+    Outputs:
+        output, done, decoder_state, alignment, last_attended, conv_buffers...
+    """
+
+    def __init__(self, decoder, window_size=3):
+        super(IncrementalDecoderStep, self).__init__()
+        self.window_size = window_size
+        self.fc1 = decoder.fc1
+        self.fc2 = decoder.fc2
+        self.fc3 = decoder.fc3
+        self.projections = decoder.projections
+        self.attention = decoder.attention
+        self.force_monotonic_attention = decoder.force_monotonic_attention
+
+        # Linearized convolutions as Linear layers over flattened buffers
+        self.conv_linears = nn.ModuleList()
+        self.dilations = []
+        for conv in decoder.convolutions:
+            # run forward pre hooks (e.g., weight norm)
+            for hook in conv._forward_pre_hooks.values():
+                hook(conv, None)
+            if hasattr(conv, "get_linearized_linear"):
+                linear = conv.get_linearized_linear()
+            else:
+                weight = conv._get_linearized_weight()
+                linear = nn.Linear(weight.size(1), weight.size(0))
+                linear.weight.data.copy_(weight.data)
+                linear.bias.data.copy_(conv.bias.data)
+            conv._linearized_weight = None
+            self.conv_linears.append(linear)
+            self.dilations.append(getattr(conv, "dilation", (1,))[0])
+
+    def forward(self, current_input, frame_pos_embed, keys, values,
+                last_attended, *conv_buffers):
+        B = current_input.size(0)
+        x = F.relu(self.fc1(current_input), inplace=False)
+
+        new_conv_buffers = []
+        new_last_attended = []
+        alignments = []
+        attention_idx = 0
+        for idx, (proj, attention) in enumerate(zip(self.projections, self.attention)):
+            residual = x if proj is None else proj(x)
+
+            # shift buffer and append the next input
+            buffer = torch.cat([conv_buffers[idx][:, 1:, :], x], dim=1)
+            new_conv_buffers.append(buffer)
+            dilation = self.dilations[idx]
+            x = buffer[:, 0::dilation, :] if dilation > 1 else buffer
+            x = self.conv_linears[idx](x.contiguous().view(B, -1)).view(B, 1, -1)
+            a, b = x.split(x.size(-1) // 2, dim=-1)
+            x = a * torch.sigmoid(b)
+
+            if attention is not None:
+                x = x + frame_pos_embed
+                monotonic = self.force_monotonic_attention[idx]
+                x, alignment = self._attention(
+                    attention, x, keys, values,
+                    last_attended[:, attention_idx] if monotonic else None)
+                if monotonic:
+                    new_last_attended.append(alignment.max(-1)[1].view(B))
+                else:
+                    new_last_attended.append(last_attended[:, attention_idx])
+                alignments.append(alignment)
+                attention_idx += 1
+
+            # residual
+            x = (x + residual) * math.sqrt(0.5)
+
+        decoder_state = x
+        output = torch.sigmoid(self.fc2(decoder_state))
+        done = torch.sigmoid(self.fc3(decoder_state))
+        alignment = torch.stack(alignments).mean(0)
+        last_attended = torch.stack(new_last_attended, dim=1)
+
+        return (output, done, decoder_state, alignment, last_attended) \
+            + tuple(new_conv_buffers)
+
+    def _attention(self, attention, query, keys, values, last_attended):
+        residual = query
+        x = attention.in_projection(query)
+        x = torch.bmm(x, keys)
+
+        # attend only to [last_attended, last_attended + window_size)
+        if last_attended is not None:
+            positions = torch.arange(x.size(-1), device=x.device).unsqueeze(0)
+            last_attended = last_attended.unsqueeze(1)
+            mask = (positions < last_attended) | \
+                (positions >= last_attended + self.window_size)
+            x = x.masked_fill(mask.unsqueeze(1), -float("inf"))
+
+        # (B, 1, src_len)
+        x = F.softmax(x, dim=-1)
+        attn_scores = x
+
+        x = torch.bmm(x, values)
+
+        # project back
+        x = (attention.out_projection(x) + residual) * math.sqrt(0.5)
+        return x, attn_scores
+
+
+def converter_chunks(converter, x, chunk_size):
+    """Run a converter on ``x`` (B, T, C) in windows of ``chunk_size`` time
+    steps, with ``converter.halo()`` steps of context on both sides.
+
+    Yields outputs for consecutive windows (upsampled by
+    ``converter.upsample``), which concatenated over time are equal to
+    ``converter(x)``; peak memory is bounded by the window size instead of
+    the utterance length. Use it directly to stream outputs.
+    """
+    halo, upsample = converter.halo(), converter.upsample
+    T = x.size(1)
+    for start in range(0, T, chunk_size):
+        end = min(start + chunk_size, T)
+        lo, hi = max(0, start - halo), min(T, end + halo)
+        y = converter(x[:, lo:hi])
+        yield y[:, (start - lo) * upsample:(end - lo) * upsample]
+
 
 class Converter(nn.Module):
+    upsample = 1
+
     def __init__(self, in_dim, out_dim, convolutions=((256, 5, 1),) * 4, dropout=0.1):
         super(Converter, self).__init__()
         self.dropout = dropout
@@ -705,6 +1238,7 @@ class Converter(nn.Module):
                             padding=pad, dilation=dilation, dropout=dropout))
             in_channels = out_channels
         self.fc2 = Linear(in_channels, out_dim)
+        self.checkpoint_activations = False
 
     def forward(self, x):
         # project to size of convolution
@@ -716,17 +1250,22 @@ class Converter(nn.Module):
         x = x.transpose(0, 1) if use_convtbc else x.transpose(1, 2)
 
         # １D conv blocks
-        for idx, (proj, conv) in enumerate(zip(self.projections, self.convolutions)):
-            residual = x if proj is None else proj(x)
-            if idx > 0:
-                x = F.dropout(x, p=self.dropout, training=self.training)
-            x = conv(x)
-            splitdim = -1 if use_convtbc else 1
-            a, b = x.split(x.size(splitdim) // 2, dim=splitdim)
-            x = a * F.sigmoid(b)
-            x = (x + residual) * math.sqrt(0.5)
+        for idx in range(len(self.convolutions)):
+            x = _maybe_checkpoint(
+                self, partial(self._conv_block, idx, use_convtbc), x)
 
         # Back to batch first
         x = x.transpose(0, 1) if use_convtbc else x.transpose(1, 2)
 
         return F.sigmoid(self.fc2(x))
+
+    def halo(self):
+        """Number of time steps of context on each side an output depends on."""
+        return sum(conv.padding[0] for conv in self.convolutions)
+
+    def _conv_block(self, idx, use_convtbc, x):
+        x, residual = glu_block(
+            self.convolutions[idx], x, dim=-1 if use_convtbc else 1,
+            proj=self.projections[idx], dropout=self.dropout if idx > 0 else 0,
+            training=self.training)
+        return residual_sum(x, residual)
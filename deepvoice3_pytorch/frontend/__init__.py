@@ -5,12 +5,16 @@
 All frontend module should have the following functions:
 
 - text_to_sequence(text, p)
+- texts_to_sequences(texts, p)
 - sequence_to_text(sequence)
+- clear_cache()
 
 and the property:
 
 - n_vocab
 
+Sequences can be pre-computed at preprocessing time with ``save_sequences``
+and read back with ``load_sequences``.
 """
 from deepvoice3_pytorch.frontend import en
 
@@ -19,3 +23,52 @@ try:
     from deepvoice3_pytorch.frontend import jp
 except ImportError:
     jp = None
+
+
+def _texts_digest(texts):
+    import hashlib
+    m = hashlib.sha1()
+    for text in texts:
+        m.update(text.encode("utf-8"))
+        m.update(b"\0")
+    return m.hexdigest()
+
+
+def save_sequences(path, texts, frontend_name):
+    """Pre-compute symbol ID sequences (``p=0``) of texts and save them packed
+    into a single ``.npz`` file.
+
+    Returns:
+        numpy.ndarray: Sequence lengths.
+    """
+    import numpy as np
+    f = globals()[frontend_name]
+    seqs = f.texts_to_sequences(texts, p=0.0)
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    sequences = np.concatenate(
+        [np.asarray(seq, dtype=np.int32) for seq in seqs]) if seqs \
+        else np.zeros(0, dtype=np.int32)
+    np.savez(path, sequences=sequences, offsets=offsets,
+             frontend=np.array(frontend_name),
+             digest=np.array(_texts_digest(texts)))
+    return lengths
+
+
+def load_sequences(path, texts, frontend_name):
+    """Load sequences saved by ``save_sequences``.
+
+    Returns:
+        list: int32 sequences for ``texts``, or None if the file doesn't exist
+        or was computed for different texts or frontend.
+    """
+    import os
+    import numpy as np
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if str(data["frontend"]) != frontend_name or \
+                str(data["digest"]) != _texts_digest(texts):
+            return None
+        sequences, offsets = data["sequences"], data["offsets"]
+    return [sequences[s:e] for s, e in zip(offsets[:-1], offsets[1:])]
@@ -1,17 +1,45 @@
 # coding: utf-8
 from deepvoice3_pytorch.frontend.text.symbols import symbols
 
-import nltk
+import os
+from os.path import dirname, join, exists
 from random import random
+from functools import lru_cache
+
+from deepvoice3_pytorch.frontend import text as _text
+from deepvoice3_pytorch.frontend.text import cleaners
 
 n_vocab = len(symbols)
 
-_arphabet = nltk.corpus.cmudict.dict()
+# Max number of texts to memoize
+_cache_size = 2 ** 16
+
+# Loaded on first use. See compile_cmudict.py.
+_arphabet = None
+
+
+def cmudict_path():
+    """Directory of the compiled CMUDict, which can be overridden by
+    the DEEPVOICE3_CMUDICT environment variable."""
+    return os.environ.get("DEEPVOICE3_CMUDICT", join(dirname(__file__), "cmudict"))
+
+
+def _get_arphabet():
+    global _arphabet
+    if _arphabet is None:
+        path = cmudict_path()
+        if exists(join(path, "words.npy")):
+            from deepvoice3_pytorch.frontend.text.cmudict import CompiledCMUDict
+            _arphabet = CompiledCMUDict(path)
+        else:
+            import nltk
+            _arphabet = nltk.corpus.cmudict.dict()
+    return _arphabet
 
 
 def _maybe_get_arpabet(word, p):
     try:
-        phonemes = _arphabet[word][0]
+        phonemes = _get_arphabet()[word][0]
         phonemes = " ".join(phonemes)
     except KeyError:
         return word
@@ -24,12 +52,96 @@ def mix_pronunciation(text, p):
     return text
 
 
+@lru_cache(maxsize=_cache_size)
+def _text_to_sequence(text):
+    return tuple(_text.text_to_sequence(text, ["english_cleaners"]))
+
+
+@lru_cache(maxsize=_cache_size)
+def _prepare_mixing(text):
+    """Symbol IDs of each word and of its ARPAbet (None if not in the
+    dictionary), or None if the sequence of ``text`` can't be composed word by
+    word."""
+    if "{" in text or "}" in text:
+        return None
+    words = text.split(" ")
+    arphabet = _get_arphabet()
+    sequences, candidates = [], []
+    for idx, word in enumerate(words):
+        last = idx == len(words) - 1
+        # trailing whitespace (e.g., new line) is allowed in the last word
+        if len(word.strip()) == 0 or any(c.isspace() for c in word.rstrip()) or \
+                (not last and word != word.rstrip()):
+            return None
+        if last:
+            cleaned = cleaners.english_cleaners(word)
+        else:
+            cleaned = cleaners.english_word_cleaners(word)
+        if len(cleaned) == 0 or cleaned != cleaned.strip():
+            return None
+        sequences.append(tuple(_text._symbols_to_sequence(cleaned)))
+        try:
+            phonemes = " ".join(arphabet[word][0])
+            candidates.append(tuple(_text._arpabet_to_sequence(phonemes)))
+        except KeyError:
+            candidates.append(None)
+
+    # Text after curly braces is cut at a new line (see _curly_re)
+    last_after_braces = tuple(_text._symbols_to_sequence(
+        cleaners.english_cleaners(words[-1].split("\n")[0])))
+
+    prepared = tuple(sequences), tuple(candidates), last_after_braces
+    if _compose_sequence(prepared, 0.0) != list(_text_to_sequence(text)):
+        return None
+    return prepared
+
+
+def _compose_sequence(prepared, p):
+    # Same as text_to_sequence(mix_pronunciation(text, p)). Note that
+    # english_cleaners adds punctuation to each segment between curly braces,
+    # i.e., after the space before a replaced word.
+    sequences, candidates, last_after_braces = prepared
+    space, period = _text._symbol_to_id[" "], _text._symbol_to_id["."]
+    sequence = []
+    replaced = False
+    for idx, (word_sequence, candidate) in enumerate(zip(sequences, candidates)):
+        replace = candidate is not None and p > 0 and random() < p
+        if idx > 0:
+            sequence += [space, period] if replace else [space]
+        if replace:
+            sequence += candidate
+            replaced = True
+        elif replaced and idx == len(sequences) - 1:
+            sequence += last_after_braces
+        else:
+            sequence += word_sequence
+    sequence.append(_text._symbol_to_id["~"])
+    return sequence
+
+
 def text_to_sequence(text, p=0.0):
-    if p >= 0:
-        text = mix_pronunciation(text, p)
-    from deepvoice3_pytorch.frontend.text import text_to_sequence
-    text = text_to_sequence(text, ["english_cleaners"])
-    return text
+    """Text to a list of symbol IDs, where each word in the dictionary is
+    replaced by its ARPAbet with probability ``p``.
+
+    Results are memoized: sequences for ``p <= 0``, and symbol IDs of words and
+    pronunciation candidates for ``p > 0``, so that only the random mixing
+    runs for texts seen before.
+    """
+    if p <= 0:
+        return list(_text_to_sequence(text))
+    prepared = _prepare_mixing(text)
+    if prepared is None:
+        return _text.text_to_sequence(mix_pronunciation(text, p), ["english_cleaners"])
+    return _compose_sequence(prepared, p)
+
+
+def texts_to_sequences(texts, p=0.0):
+    return [text_to_sequence(text, p) for text in texts]
+
+
+def clear_cache():
+    _text_to_sequence.cache_clear()
+    _prepare_mixing.cache_clear()
 
 
 from deepvoice3_pytorch.frontend.text import sequence_to_text
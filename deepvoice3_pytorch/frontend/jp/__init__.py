@@ -4,6 +4,7 @@
 import MeCab
 import jaconv
 from random import random
+from functools import lru_cache
 
 n_vocab = 0xffff
 
@@ -11,24 +12,44 @@ _eos = 1
 _pad = 0
 _tagger = None
 
+# Max number of texts to memoize
+_cache_size = 2 ** 16
 
-def _yomi(mecab_result):
+
+def _get_tagger():
+    global _tagger
+    if _tagger is None:
+        _tagger = MeCab.Tagger("")
+        # workaround for broken surfaces of the first parseToNode call in
+        # some versions of mecab-python
+        _tagger.parse("")
+    return _tagger
+
+
+def _yomi(node):
     tokens = []
     yomis = []
-    for line in mecab_result.split("\n")[:-1]:
-        s = line.split("\t")
-        if len(s) == 1:
-            break
-        token, rest = s
-        rest = rest.split(",")
-        tokens.append(token)
-        yomi = rest[7] if len(rest) > 7 else None
-        yomi = None if yomi == "*" else yomi
-        yomis.append(yomi)
+    while node is not None:
+        if node.stat not in (MeCab.MECAB_BOS_NODE, MeCab.MECAB_EOS_NODE):
+            feature = node.feature.split(",")
+            tokens.append(node.surface)
+            yomi = feature[7] if len(feature) > 7 else None
+            yomi = None if yomi == "*" else yomi
+            yomis.append(yomi)
+        node = node.next
 
     return tokens, yomis
 
 
+@lru_cache(maxsize=_cache_size)
+def _tokenize(text):
+    """Tokens and their yomis (None if unknown) of normalized ``text``, both
+    converted to katakana."""
+    tokens, yomis = _yomi(_get_tagger().parseToNode(_normalize(text)))
+    return (tuple(jaconv.hira2kata(token) for token in tokens),
+            tuple(None if yomi is None else jaconv.hira2kata(yomi) for yomi in yomis))
+
+
 def _mix_pronunciation(tokens, yomis, p):
     return "".join(
         yomis[idx] if yomis[idx] is not None and random() < p else tokens[idx]
@@ -36,10 +57,7 @@ def _mix_pronunciation(tokens, yomis, p):
 
 
 def mix_pronunciation(text, p):
-    global _tagger
-    if _tagger is None:
-        _tagger = MeCab.Tagger("")
-    tokens, yomis = _yomi(_tagger.parse(text))
+    tokens, yomis = _yomi(_get_tagger().parseToNode(text))
     return _mix_pronunciation(tokens, yomis, p)
 
 
@@ -58,7 +76,7 @@ def normalize_delimitor(text):
     return text
 
 
-def text_to_sequence(text, p=0.0):
+def _normalize(text):
     for c in [" ", "　", "「", "」", "『", "』", "・", "【", "】",
               "（", "）", "(", ")"]:
         text = text.replace(c, "")
@@ -67,13 +85,40 @@ def text_to_sequence(text, p=0.0):
 
     text = normalize_delimitor(text)
     text = jaconv.normalize(text)
-    if p > 0:
-        text = mix_pronunciation(text, p)
-    text = jaconv.hira2kata(text)
+    return text
+
+
+@lru_cache(maxsize=_cache_size)
+def _text_to_sequence(text):
+    text = jaconv.hira2kata(_normalize(text))
+    text = add_punctuation(text)
+    return tuple(ord(c) for c in text) + (_eos,)
+
+
+def text_to_sequence(text, p=0.0):
+    """Text to a list of code points, where each token is replaced by its yomi
+    with probability ``p``.
+
+    Results are memoized: sequences for ``p <= 0``, and MeCab tokens and yomis
+    for ``p > 0``, so that only the random mixing runs for texts seen before.
+    """
+    if p <= 0:
+        return list(_text_to_sequence(text))
+    tokens, yomis = _tokenize(text)
+    text = _mix_pronunciation(tokens, yomis, p)
     text = add_punctuation(text)
 
     return [ord(c) for c in text] + [_eos]  # EOS
 
 
+def texts_to_sequences(texts, p=0.0):
+    return [text_to_sequence(text, p) for text in texts]
+
+
+def clear_cache():
+    _text_to_sequence.cache_clear()
+    _tokenize.cache_clear()
+
+
 def sequence_to_text(seq):
     return "".join(chr(n) for n in seq)
@@ -18,8 +18,8 @@ from .numbers import normalize_numbers
 # Regular expression matching whitespace:
 _whitespace_re = re.compile(r'\s+')
 
-# List of (regular expression, replacement) pairs for abbreviations:
-_abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in [
+# List of (abbreviation, replacement) pairs:
+_abbreviation_pairs = [
     ('mrs', 'misess'),
     ('mr', 'mister'),
     ('dr', 'doctor'),
@@ -38,13 +38,34 @@ _abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1]) for x in
     ('ltd', 'limited'),
     ('col', 'colonel'),
     ('ft', 'fort'),
-]]
+]
+_abbreviations = [(re.compile('\\b%s\\.' % x[0], re.IGNORECASE), x[1])
+                  for x in _abbreviation_pairs]
+
+
+# All abbreviations in a single regex, to expand them in one pass
+_abbreviation_re = re.compile(
+    '\\b(%s)\\.' % '|'.join(x[0] for x in _abbreviation_pairs), re.IGNORECASE)
+_abbreviation_index = {x[0]: idx for idx, x in enumerate(_abbreviation_pairs)}
 
 
 def expand_abbreviations(text):
-    for regex, replacement in _abbreviations:
-        text = re.sub(regex, replacement, text)
-    return text
+    if '.' not in text:
+        return text
+
+    # Same as applying the regexes in _abbreviations one by one, where an
+    # abbreviation right after an expanded one (e.g., "mr.dr.") is kept if it
+    # comes later in the list, since the expansion removes the word boundary.
+    last = [-1, -1]  # end and index of the last expanded abbreviation
+
+    def _expand(m):
+        idx = _abbreviation_index[m.group(1).lower()]
+        if m.start() == last[0] and idx > last[1]:
+            return m.group(0)
+        last[0], last[1] = m.end(), idx
+        return _abbreviation_pairs[idx][1]
+
+    return re.sub(_abbreviation_re, _expand, text)
 
 
 def expand_numbers(text):
@@ -60,7 +81,11 @@ def collapse_whitespace(text):
 
 
 def convert_to_ascii(text):
-    return unidecode(text)
+    try:
+        text.encode('ascii')
+        return text
+    except UnicodeEncodeError:
+        return unidecode(text)
 
 
 def add_punctuation(text):
@@ -95,3 +120,13 @@ def english_cleaners(text):
     text = expand_abbreviations(text)
     text = collapse_whitespace(text)
     return text
+
+
+def english_word_cleaners(text):
+    '''english_cleaners without add_punctuation, for words in the middle of a text.'''
+    text = convert_to_ascii(text)
+    text = lowercase(text)
+    text = expand_numbers(text)
+    text = expand_abbreviations(text)
+    text = collapse_whitespace(text)
+    return text
@@ -1,4 +1,7 @@
 import re
+from os.path import join
+
+import numpy as np
 
 
 valid_symbols = [
@@ -59,3 +62,104 @@ def _get_pronunciation(s):
         if part not in _valid_symbol_set:
             return None
     return ' '.join(parts)
+
+
+class CompiledCMUDict:
+    '''CMUDict compiled to numpy arrays by ``compile_cmudict``.
+
+    Arrays are memory-mapped, so loading is fast and the pages are shared
+    among processes using the same dictionary. Words are stored in lower case.
+    Supports both ``CMUDict.lookup`` and ``nltk.corpus.cmudict.dict()`` style
+    (``d[word]`` returns a list of phoneme lists) access.
+    '''
+
+    def __init__(self, path, mmap_mode='r'):
+        def _load(name):
+            return np.load(join(path, name + '.npy'), mmap_mode=mmap_mode)
+        self._words = _load('words')
+        self._word_offsets = _load('word_offsets')
+        self._pron_offsets = _load('pron_offsets')
+        self._phones = _load('phones')
+        self._symbols = [s.decode('ascii') for s in np.load(join(path, 'symbols.npy'))]
+
+    def __len__(self):
+        return len(self._words)
+
+    def _index(self, word):
+        key = word.encode('utf-8')
+        if len(key) == 0 or len(key) > self._words.dtype.itemsize:
+            return -1
+        idx = int(np.searchsorted(self._words, key))
+        if idx < len(self._words) and self._words[idx] == key:
+            return idx
+        return -1
+
+    def _pronunciations(self, idx):
+        pron_offsets = self._pron_offsets
+        prons = []
+        for j in range(self._word_offsets[idx], self._word_offsets[idx + 1]):
+            phones = self._phones[pron_offsets[j]:pron_offsets[j + 1]]
+            prons.append([self._symbols[p] for p in phones])
+        return prons
+
+    def __contains__(self, word):
+        return self._index(word) >= 0
+
+    def __getitem__(self, word):
+        idx = self._index(word)
+        if idx < 0:
+            raise KeyError(word)
+        return self._pronunciations(idx)
+
+    def get(self, word, default=None):
+        idx = self._index(word)
+        return default if idx < 0 else self._pronunciations(idx)
+
+    def lookup(self, word):
+        '''Returns list of ARPAbet pronunciations of the given word.'''
+        pronunciations = self.get(word.lower())
+        if pronunciations is None:
+            return None
+        return [' '.join(p) for p in pronunciations]
+
+
+def compile_cmudict(dst_dir, entries=None):
+    '''Compiles (word, phonemes) entries into arrays for ``CompiledCMUDict``.
+
+      Args:
+        dst_dir: existing directory to write ``*.npy`` files to
+        entries: iterable of (word, list of phonemes). Defaults to
+          ``nltk.corpus.cmudict.entries()``.
+
+      Returns:
+        Number of words
+    '''
+    if entries is None:
+        import nltk
+        entries = nltk.corpus.cmudict.entries()
+
+    # word -> pronunciations, keeping the order of pronunciations
+    prons = {}
+    for word, phonemes in entries:
+        prons.setdefault(word.lower().encode('utf-8'), []).append(list(phonemes))
+
+    symbols = sorted(set(p for ps in prons.values() for phonemes in ps for p in phonemes))
+    assert len(symbols) < 256
+    symbol_to_id = {s: i for i, s in enumerate(symbols)}
+
+    words = sorted(prons.keys())
+    word_offsets = [0]
+    pron_offsets = [0]
+    phones = []
+    for word in words:
+        for phonemes in prons[word]:
+            phones.extend(symbol_to_id[p] for p in phonemes)
+            pron_offsets.append(len(phones))
+        word_offsets.append(len(pron_offsets) - 1)
+
+    np.save(join(dst_dir, 'words.npy'), np.array(words, dtype=np.bytes_))
+    np.save(join(dst_dir, 'word_offsets.npy'), np.array(word_offsets, dtype=np.int32))
+    np.save(join(dst_dir, 'pron_offsets.npy'), np.array(pron_offsets, dtype=np.int32))
+    np.save(join(dst_dir, 'phones.npy'), np.array(phones, dtype=np.uint8))
+    np.save(join(dst_dir, 'symbols.npy'), np.array(symbols, dtype=np.bytes_))
+    return len(words)
@@ -60,6 +60,8 @@ def _expand_number(m):
 
 
 def normalize_numbers(text):
+    if re.search(_number_re, text) is None:
+        return text
     text = re.sub(_comma_number_re, _remove_commas, text)
     text = re.sub(_pounds_re, r'\1 pounds', text)
     text = re.sub(_dollars_re, _expand_dollars, text)
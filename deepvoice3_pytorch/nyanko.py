@@ -6,9 +6,13 @@ from torch.nn import functional as F
 from torch.autograd import Variable
 import math
 import numpy as np
+from functools import partial
 
 from fairseq.models.fconv import Embedding, Linear
 
+from .conv import glu_block, residual_sum
+from .deepvoice3 import _maybe_checkpoint
+
 
 def Conv1d(in_channels, out_channels, kernel_size, dropout=0, **kwargs):
     from .conv import Conv1d
@@ -57,6 +61,9 @@ class Converter(nn.Module):
             in_channels = out_channels
 
         self.fc2 = Linear(in_channels, out_dim)
+        self.checkpoint_activations = False
+        # each ConvTranspose1d upsamples by 2
+        self.upsample = 2 ** len(self.deconvolutions)
 
     def forward(self, x):
         # project to size of convolution
@@ -68,19 +75,29 @@ class Converter(nn.Module):
         x = x.transpose(0, 1) if use_convtbc else x.transpose(1, 2)
 
         # Conv blocks
-        for idx, conv in enumerate(self.convolutions):
-            # Upsampling
-            if idx < len(self.deconvolutions):
-                x = self.deconvolutions[idx](x)
-            residual = x
-            x = F.dropout(x, p=self.dropout, training=self.training)
-            x = conv(x)
-            splitdim = -1 if use_convtbc else 1
-            a, b = x.split(x.size(splitdim) // 2, dim=splitdim)
-            x = a * F.sigmoid(b)
-            x = (x + residual) * math.sqrt(0.5)
+        for idx in range(len(self.convolutions)):
+            x = _maybe_checkpoint(self, partial(self._conv_block, idx), x)
 
         # Back to batch first
         x = x.transpose(0, 1) if use_convtbc else x.transpose(1, 2)
 
         return F.sigmoid(self.fc2(x))
+
+    def halo(self):
+        """Number of input time steps of context on each side an output
+        depends on."""
+        halo = 0
+        for idx, conv in enumerate(self.convolutions):
+            # in input time steps
+            scale = 2 ** min(idx + 1, len(self.deconvolutions))
+            halo += (conv.padding[0] + scale - 1) // scale
+        return halo
+
+    def _conv_block(self, idx, x):
+        # Upsampling
+        if idx < len(self.deconvolutions):
+            x = self.deconvolutions[idx](x)
+        x, residual = glu_block(
+            self.convolutions[idx], x, dropout=self.dropout,
+            training=self.training)
+        return residual_sum(x, residual)
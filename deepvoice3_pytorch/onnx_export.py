@@ -0,0 +1,233 @@
+# coding: utf-8
+"""ONNX export of the encoder, a single decoder step and the converter.
+
+The three graphs are enough to synthesize with onnxruntime (or any ONNX
+runtime) without PyTorch. ``OnnxSynthesizer`` is a reference implementation
+of the decode loop over them in numpy. Requires PyTorch >= 1.2 for export,
+and onnxruntime for the driver.
+"""
+import inspect
+from os.path import join
+
+import numpy as np
+import torch
+from torch import nn
+
+from .deepvoice3 import _ConvTBC
+
+
+class _OnnxEncoder(nn.Module):
+    """Encoder followed by the key preparation for decoding steps.
+
+    Values are not scaled by sqrt(T) here, since the scale would be traced as
+    a constant.
+    """
+
+    def __init__(self, model):
+        super(_OnnxEncoder, self).__init__()
+        self.encoder = model.encoder
+        self.decoder = model.decoder
+        self.use_text_pos_embedding_in_encoder = \
+            model.use_text_pos_embedding_in_encoder
+
+    def forward(self, text_sequences, text_positions):
+        if self.use_text_pos_embedding_in_encoder:
+            encoder_out = self.encoder(text_sequences, text_positions=text_positions)
+        else:
+            encoder_out = self.encoder(text_sequences)
+        keys, values = encoder_out
+        keys = keys + self.decoder.embed_keys_positions(text_positions)
+        return keys.transpose(1, 2), values
+
+
+class _OnnxDecoderStep(nn.Module):
+    """IncrementalDecoderStep that takes frame positions instead of their
+    embeddings."""
+
+    def __init__(self, model):
+        super(_OnnxDecoderStep, self).__init__()
+        self.step = model.decoder.make_incremental_step()
+        self.embed_query_positions = model.decoder.embed_query_positions
+
+    def forward(self, current_input, frame_positions, keys, values,
+                last_attended, *conv_buffers):
+        frame_pos_embed = self.embed_query_positions(frame_positions)
+        return self.step(current_input, frame_pos_embed, keys, values,
+                         last_attended, *conv_buffers)
+
+
+def _export(*args, **kwargs):
+    # Recent PyTorch defaults to the dynamo based exporter; keep the
+    # TorchScript based one, which handles the dynamic axes used here.
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+    torch.onnx.export(*args, **kwargs)
+
+
+def _conv_buffer_names(model):
+    return ["conv_buffer{}".format(idx)
+            for idx in range(len(model.decoder.convolutions))]
+
+
+def export_onnx(model, dst_dir, opset_version=11):
+    """Export ``encoder.onnx``, ``decoder_step.onnx`` and ``converter.onnx``.
+
+    The model must be in eval mode, single speaker and without weight norm
+    (``make_generation_fast_``). Batch and time axes are dynamic. Models
+    built with ConvTBC (i.e., without dilation) are not supported.
+
+    Returns:
+        list: Paths of the exported graphs.
+    """
+    assert not model.training
+    assert model.n_speakers == 1, "multi-speaker models are not supported"
+    for conv in model.encoder.convolutions:
+        assert not isinstance(conv, _ConvTBC), "ConvTBC is not supported"
+
+    embed_dim = model.decoder.embed_keys_positions.embedding_dim
+    T = 8
+    text_sequences = torch.ones(1, T).long()
+    text_positions = torch.arange(1, T + 1).unsqueeze(0).long()
+    paths = []
+
+    # The gradient scaling is a no-op in eval mode, but has no ONNX symbolic
+    num_attention_layers = model.encoder.num_attention_layers
+    model.encoder.num_attention_layers = None
+    try:
+        path = join(dst_dir, "encoder.onnx")
+        _export(
+            _OnnxEncoder(model).eval(), (text_sequences, text_positions), path,
+            input_names=["text_sequences", "text_positions"],
+            output_names=["keys", "values"],
+            dynamic_axes={"text_sequences": {0: "B", 1: "T"},
+                          "text_positions": {0: "B", 1: "T"},
+                          "keys": {0: "B", 2: "T"},
+                          "values": {0: "B", 1: "T"}},
+            opset_version=opset_version)
+        paths.append(path)
+    finally:
+        model.encoder.num_attention_layers = num_attention_layers
+
+    keys = torch.zeros(1, embed_dim, T)
+    values = torch.zeros(1, T, embed_dim)
+    inputs = list(model.decoder._initial_step_inputs(keys, values))
+    inputs[1] = torch.ones(1, 1).long()
+    buffer_names = _conv_buffer_names(model)
+    input_names = ["current_input", "frame_positions", "keys", "values",
+                   "last_attended"] + buffer_names
+    output_names = ["output", "done", "decoder_state", "alignment",
+                    "next_last_attended"] + ["next_" + n for n in buffer_names]
+    dynamic_axes = {name: {0: "B"} for name in input_names + output_names}
+    dynamic_axes["keys"] = {0: "B", 2: "T"}
+    dynamic_axes["values"] = {0: "B", 1: "T"}
+    dynamic_axes["alignment"] = {0: "B", 2: "T"}
+    path = join(dst_dir, "decoder_step.onnx")
+    _export(
+        _OnnxDecoderStep(model).eval(), tuple(inputs), path,
+        input_names=input_names, output_names=output_names,
+        dynamic_axes=dynamic_axes, opset_version=opset_version)
+    paths.append(path)
+
+    in_dim = model.converter.in_dim
+    path = join(dst_dir, "converter.onnx")
+    _export(
+        model.converter, (torch.zeros(1, T, in_dim),), path,
+        input_names=["decoder_states"], output_names=["linear_outputs"],
+        dynamic_axes={"decoder_states": {0: "B", 1: "T"},
+                      "linear_outputs": {0: "B", 1: "T"}},
+        opset_version=opset_version)
+    paths.append(path)
+
+    return paths
+
+
+class OnnxSynthesizer(object):
+    """Reference decode loop over graphs exported by ``export_onnx``.
+
+    Mirrors ``DeepVoice3.forward`` in eval mode (without mel targets).
+
+    Args:
+        model_dir (str): Directory containing the exported graphs.
+        mel_dim (int): Number of mel bins.
+        max_decoder_steps (int): Max number of decoder steps.
+        min_decoder_steps (int): Min number of decoder steps.
+    """
+
+    def __init__(self, model_dir, mel_dim=80, max_decoder_steps=200,
+                 min_decoder_steps=10):
+        import onnxruntime
+        self.mel_dim = mel_dim
+        self.max_decoder_steps = max_decoder_steps
+        self.min_decoder_steps = min_decoder_steps
+        self.encoder = onnxruntime.InferenceSession(
+            join(model_dir, "encoder.onnx"), providers=["CPUExecutionProvider"])
+        self.decoder_step = onnxruntime.InferenceSession(
+            join(model_dir, "decoder_step.onnx"), providers=["CPUExecutionProvider"])
+        self.converter = onnxruntime.InferenceSession(
+            join(model_dir, "converter.onnx"), providers=["CPUExecutionProvider"])
+        self._step_inputs = {i.name: i for i in self.decoder_step.get_inputs()}
+
+    def _initial_state(self, B):
+        state = {}
+        for name, i in self._step_inputs.items():
+            if name in ["frame_positions", "keys", "values"]:
+                continue
+            # all dims but batch are static
+            shape = (B,) + tuple(i.shape[1:])
+            dtype = np.int64 if i.type == "tensor(int64)" else np.float32
+            state[name] = np.zeros(shape, dtype=dtype)
+        return state
+
+    def __call__(self, text_sequences):
+        """Synthesize from (B, T) int64 token ids.
+
+        Returns:
+            tuple: mel_outputs (B, T', mel_dim), linear_outputs
+            (B, T', linear_dim), alignments (B, T' / r, T) and done flags.
+        """
+        text_sequences = np.asarray(text_sequences, dtype=np.int64)
+        B, T = text_sequences.shape
+        text_positions = np.tile(np.arange(1, T + 1, dtype=np.int64), (B, 1))
+        keys, values = self.encoder.run(
+            None, {"text_sequences": text_sequences,
+                   "text_positions": text_positions})
+        # see Decoder._prepare_step_keys_values
+        values = values * np.sqrt(T).astype(np.float32)
+
+        state = self._initial_state(B)
+        output_names = [o.name for o in self.decoder_step.get_outputs()]
+        outputs, decoder_states, alignments, dones = [], [], [], []
+        t = 0
+        while True:
+            feed = dict(state)
+            feed["frame_positions"] = np.full((B, 1), t + 1, dtype=np.int64)
+            feed["keys"] = keys
+            feed["values"] = values
+            step_outputs = dict(zip(output_names, self.decoder_step.run(None, feed)))
+
+            # feed back states
+            state["current_input"] = step_outputs["output"]
+            for name in list(state.keys()):
+                if name != "current_input":
+                    state[name] = step_outputs["next_" + name]
+
+            outputs.append(step_outputs["output"])
+            decoder_states.append(step_outputs["decoder_state"])
+            alignments.append(step_outputs["alignment"])
+            dones.append(step_outputs["done"])
+
+            t += 1
+            if (step_outputs["done"] > 0.5).all() and t > self.min_decoder_steps:
+                break
+            elif t > self.max_decoder_steps:
+                print("Warning! doesn't seems to be converged")
+                break
+
+        mel_outputs = np.concatenate(outputs, axis=1).reshape(B, -1, self.mel_dim)
+        decoder_states = np.concatenate(decoder_states, axis=1).reshape(
+            B, mel_outputs.shape[1], -1)
+        linear_outputs = self.converter.run(
+            None, {"decoder_states": decoder_states})[0]
+        alignments = np.concatenate(alignments, axis=1)
+
+        return mel_outputs, linear_outputs, alignments, dones
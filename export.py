@@ -0,0 +1,67 @@
+# coding: utf-8
+"""
+Export a trained model for deployment.
+
+torchscript: Writes a traced single decoder step, ``decoder_step.pt``, which
+can be loaded by ``torch.jit.load`` and used by
+``model.decoder.set_incremental_step``.
+
+onnx: Writes ``encoder.onnx``, ``decoder_step.onnx`` and ``converter.onnx``.
+See ``deepvoice3_pytorch.onnx_export.OnnxSynthesizer`` for the decode loop.
+
+usage: export.py [options] <checkpoint> <dst_dir>
+
+options:
+    --hparams=<parmas>        Hyper parameters [default: ].
+    --format=<fmt>            torchscript or onnx [default: torchscript].
+    -h, --help                Show help message.
+"""
+from docopt import docopt
+
+import sys
+import os
+from os.path import join
+
+import torch
+
+from deepvoice3_pytorch import frontend
+from hparams import hparams
+
+
+def export_decoder_step(model, dst_dir):
+    step = model.decoder.make_incremental_step(trace=True)
+    path = join(dst_dir, "decoder_step.pt")
+    torch.jit.save(step, path)
+    return path
+
+
+if __name__ == "__main__":
+    args = docopt(__doc__)
+    print("Command line args:\n", args)
+    checkpoint_path = args["<checkpoint>"]
+    dst_dir = args["<dst_dir>"]
+    export_format = args["--format"]
+
+    # Override hyper parameters
+    hparams.parse(args["--hparams"])
+    assert hparams.name == "deepvoice3"
+
+    import train
+    train._frontend = getattr(frontend, hparams.frontend)
+
+    model = train.build_model()
+    checkpoint = torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
+    model.load_state_dict(checkpoint["state_dict"])
+    model.eval()
+    model.make_generation_fast_()
+
+    os.makedirs(dst_dir, exist_ok=True)
+    if export_format == "torchscript":
+        paths = [export_decoder_step(model, dst_dir)]
+    elif export_format == "onnx":
+        from deepvoice3_pytorch.onnx_export import export_onnx
+        paths = export_onnx(model, dst_dir)
+    else:
+        assert False, "Unknown format: {}".format(export_format)
+    print("Exported:", " ".join(paths))
+    sys.exit(0)
@@ -21,8 +21,36 @@ hparams = tf.contrib.training.HParams(
     preemphasis=0.97,
     min_level_db=-100,
     ref_level_db=20,
+    # Resampler of audio files whose sample rate differs from sample_rate
+    # (librosa res_type); e.g., soxr_vhq for higher quality. kaiser_best and
+    # kaiser_fast require resampy.
+    resample_type="soxr_hq",
+    # Directory to cache resampled audio in across preprocessing runs.
+    # Empty disables it.
+    resample_cache_dir="",
+
+    # Preprocessing:
+    # Trim leading/trailing silence quieter than trim_top_db below the peak,
+    # keeping trim_margin seconds on each side (HTS labels are used instead
+    # for jsut if available). Frames are fft_size/hop_size; jsut without
+    # labels and vctk used 2048/512 and no margin before.
+    trim_silence=True,
+    trim_top_db=30,
+    trim_margin=0.05,
+    # > 0 leaves utterances longer than this many frames out of train.txt.
+    max_frames=0,
+    # Storage dtype of spectrograms: [float32, float16, uint16, uint8].
+    # Features are in [0, 1]; unsigned ints quantize them uniformly. Batches
+    # keep it through the data loader and are converted on the device.
+    feature_dtype="float32",
 
     # Model:
+    # Number of speakers. > 1 requires the speaker ID column in train.txt
+    # (e.g., preprocess.py vctk).
+    n_speakers=1,
+    speaker_embed_dim=16,
+    # > 1 (a power of 2) runs the decoder at 1/downsample_step of the frame
+    # rate; the converter upsamples back to full resolution.
     downsample_step=1,
     outputs_per_step=4,
     padding_idx=0,
@@ -40,6 +68,8 @@ hparams = tf.contrib.training.HParams(
     # Data loader
     pin_memory=True,
     num_workers=2,
+    # Spread each speaker's utterances evenly over an epoch (n_speakers > 1)
+    balanced_speaker_batching=True,
 
     # Loss
     priority_freq=3000,  # heuristic: priotrize [0 ~ priotiry_freq] for linear loss
@@ -51,6 +81,9 @@ hparams = tf.contrib.training.HParams(
 
     # Training:
     batch_size=16,
+    # Recompute activations of conv blocks in backward instead of storing
+    # them, to fit larger batches (PyTorch >= 0.4)
+    checkpoint_activations=False,
     adam_beta1=0.5,
     adam_beta2=0.9,
     adam_eps=1e-6,
@@ -70,8 +103,34 @@ hparams = tf.contrib.training.HParams(
 
     # Eval:
     max_iters=200,
+    # Early termination of decoding (0 to disable):
+    # stop this many steps after attention reaches the last input symbol
+    attention_stop_steps=0,
+    # stop after this many decoder steps per input symbol; see
+    # compute_timestamp_ratio.py for the dataset's distribution
+    max_decoder_steps_per_symbol=0.0,
+    # Vocoder: [lws, griffin_lim]
+    # griffin_lim is a batched pure-torch implementation (PyTorch >= 1.7)
+    vocoder="lws",
     griffin_lim_iters=60,
+    griffin_lim_momentum=0.99,  # 0 means the original Griffin-Lim algorithm
     power=1.4,              # Power to raise magnitudes to prior to Griffin-Lim
+
+    # Inference runtime (CPU):
+    # 0 means keeping the library default
+    num_threads=0,  # torch intra-op threads (per replica)
+    num_interop_threads=0,  # torch inter-op threads
+    vocoder_num_threads=0,  # numpy/BLAS threads for the vocoder (needs threadpoolctl)
+    # > 1 runs model replicas in worker processes pinned to disjoint core subsets
+    num_replicas=1,
+    # Run the decode loop over a traced single step function (PyTorch >= 1.0)
+    trace_decoder_step=False,
+    # Dynamic int8 quantization of linear layers and decoder convolutions
+    # (CPU only, PyTorch >= 1.3)
+    quantize_dynamic=False,
+    # > 0 runs the converter over windows of this many frames (plus the
+    # receptive field on both sides) to cap memory on long utterances
+    converter_chunk_size=0,
 )
 
 
@@ -1,28 +1,34 @@
-from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 import numpy as np
 import os
 import audio
+from pipeline import process
 from nnmnkwii.datasets import jsut
 from nnmnkwii.io import hts
 from hparams import hparams
 from os.path import exists
-import librosa
 
 
-def build_from_path(in_dir, out_dir, num_workers=1, tqdm=lambda x: x):
-    executor = ProcessPoolExecutor(max_workers=num_workers)
-    futures = []
-
+def build_from_path(in_dir, out_dir, num_workers=1, tqdm=lambda x: x, manifest=None,
+                    chunksize=8):
     transcriptions = jsut.TranscriptionDataSource(
         in_dir, subsets=jsut.available_subsets).collect_files()
     wav_paths = jsut.WavFileDataSource(
         in_dir, subsets=jsut.available_subsets).collect_files()
 
-    for index, (text, wav_path) in enumerate(zip(transcriptions, wav_paths)):
-        futures.append(executor.submit(
-            partial(_process_utterance, out_dir, index + 1, wav_path, text)))
-    return [future.result() for future in tqdm(futures)]
+    def _jobs():
+        for index, (text, wav_path) in enumerate(zip(transcriptions, wav_paths)):
+            sources = [wav_path]
+            lab_path = _lab_path(wav_path)
+            if exists(lab_path):
+                sources.append(lab_path)
+            yield ('jsut-%05d' % (index + 1), sources, (text,),
+                   partial(_process_utterance, out_dir, index + 1, wav_path, text))
+    return tqdm(process(_jobs(), num_workers, manifest, chunksize))
+
+
+def _lab_path(wav_path):
+    return wav_path.replace("wav/", "lab/").replace(".wav", ".lab")
 
 
 def _process_utterance(out_dir, index, wav_path, text):
@@ -30,11 +36,12 @@ def _process_utterance(out_dir, index, wav_path, text):
 
     # Load the audio to a numpy array:
     wav = audio.load_wav(wav_path)
+    n_samples = len(wav)
 
-    lab_path = wav_path.replace("wav/", "lab/").replace(".wav", ".lab")
+    lab_path = _lab_path(wav_path)
 
     # Trim silence from hts labels if available
-    if exists(lab_path):
+    if hparams.trim_silence and exists(lab_path):
         labels = hts.load(lab_path)
         assert labels[0][-1] == "silB"
         assert labels[-1][-1] == "silE"
@@ -42,7 +49,7 @@ def _process_utterance(out_dir, index, wav_path, text):
         e = int(labels[-1][0] * 1e-7 * sr)
         wav = wav[b:e]
     else:
-        wav, _ = librosa.effects.trim(wav, top_db=30)
+        wav = audio.trim_silence(wav)
 
     # Compute the linear-scale spectrogram from the wav:
     spectrogram = audio.spectrogram(wav).astype(np.float32)
@@ -54,8 +61,11 @@ def _process_utterance(out_dir, index, wav_path, text):
     # Write the spectrograms to disk:
     spectrogram_filename = 'jsut-spec-%05d.npy' % index
     mel_filename = 'jsut-mel-%05d.npy' % index
-    np.save(os.path.join(out_dir, spectrogram_filename), spectrogram.T, allow_pickle=False)
-    np.save(os.path.join(out_dir, mel_filename), mel_spectrogram.T, allow_pickle=False)
+    np.save(os.path.join(out_dir, spectrogram_filename), audio.quantize(spectrogram.T),
+            allow_pickle=False)
+    np.save(os.path.join(out_dir, mel_filename), audio.quantize(mel_spectrogram.T),
+            allow_pickle=False)
 
     # Return a tuple describing this training example:
-    return (spectrogram_filename, mel_filename, n_frames, text)
+    return ((spectrogram_filename, mel_filename, n_frames, text),
+            {'trimmed_samples': n_samples - len(wav)})
@@ -1,11 +1,12 @@
-from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 import numpy as np
 import os
 import audio
+from pipeline import process
 
 
-def build_from_path(in_dir, out_dir, num_workers=1, tqdm=lambda x: x):
+def build_from_path(in_dir, out_dir, num_workers=1, tqdm=lambda x: x, manifest=None,
+                    chunksize=8):
     '''Preprocesses the LJ Speech dataset from a given input path into a given output directory.
 
       Args:
@@ -13,25 +14,29 @@ def build_from_path(in_dir, out_dir, num_workers=1, tqdm=lambda x: x):
         out_dir: The directory to write the output into
         num_workers: Optional number of worker processes to parallelize across
         tqdm: You can optionally pass tqdm to get a nice progress bar
+        manifest: Optional manifest.Manifest to skip utterances already processed
+        chunksize: Number of utterances sent to a worker process at once
 
       Returns:
-        A list of tuples describing the training examples. This should be written to train.txt
+        An iterator of (row, info) tuples, in order: rows describe the training examples and
+        should be written to train.txt; info are statistics (see _process_utterance)
     '''
 
-    # We use ProcessPoolExecutor to parallize across processes. This is just an optimization and you
-    # can omit it and just call _process_utterance on each input if you want.
-    executor = ProcessPoolExecutor(max_workers=num_workers)
-    futures = []
+    # We use worker processes to parallize across processes (see pipeline.process). This is just
+    # an optimization and you can omit it and just call _process_utterance on each input if you want.
+    return tqdm(process(_jobs(in_dir, out_dir), num_workers, manifest, chunksize))
+
+
+def _jobs(in_dir, out_dir):
     index = 1
     with open(os.path.join(in_dir, 'metadata.csv'), encoding='utf-8') as f:
         for line in f:
             parts = line.strip().split('|')
             wav_path = os.path.join(in_dir, 'wavs', '%s.wav' % parts[0])
             text = parts[2]
-            futures.append(executor.submit(
-                partial(_process_utterance, out_dir, index, wav_path, text)))
+            yield ('ljspeech-%05d' % index, [wav_path], (text,),
+                   partial(_process_utterance, out_dir, index, wav_path, text))
             index += 1
-    return [future.result() for future in tqdm(futures)]
 
 
 def _process_utterance(out_dir, index, wav_path, text):
@@ -47,11 +52,14 @@ def _process_utterance(out_dir, index, wav_path, text):
       text: The text spoken in the input audio file
 
     Returns:
-      A (spectrogram_filename, mel_filename, n_frames, text) tuple to write to train.txt
+      A (spectrogram_filename, mel_filename, n_frames, text) tuple to write to train.txt, and
+      a dict with the number of samples trimmed as silence (trimmed_samples)
     '''
 
-    # Load the audio to a numpy array:
+    # Load the audio to a numpy array, trimming leading/trailing silence:
     wav = audio.load_wav(wav_path)
+    n_samples = len(wav)
+    wav = audio.trim_silence(wav)
 
     # Compute the linear-scale spectrogram from the wav:
     spectrogram = audio.spectrogram(wav).astype(np.float32)
@@ -63,8 +71,11 @@ def _process_utterance(out_dir, index, wav_path, text):
     # Write the spectrograms to disk:
     spectrogram_filename = 'ljspeech-spec-%05d.npy' % index
     mel_filename = 'ljspeech-mel-%05d.npy' % index
-    np.save(os.path.join(out_dir, spectrogram_filename), spectrogram.T, allow_pickle=False)
-    np.save(os.path.join(out_dir, mel_filename), mel_spectrogram.T, allow_pickle=False)
+    np.save(os.path.join(out_dir, spectrogram_filename), audio.quantize(spectrogram.T),
+            allow_pickle=False)
+    np.save(os.path.join(out_dir, mel_filename), audio.quantize(mel_spectrogram.T),
+            allow_pickle=False)
 
     # Return a tuple describing this training example:
-    return (spectrogram_filename, mel_filename, n_frames, text)
+    return ((spectrogram_filename, mel_filename, n_frames, text),
+            {'trimmed_samples': n_samples - len(wav)})
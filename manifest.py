@@ -0,0 +1,102 @@
+# coding: utf-8
+"""Manifest of preprocessed utterances, for incremental preprocessing.
+
+``manifest.jsonl`` in the output directory gets a line per processed
+utterance: its source files (size and mtime, or sha1), the audio hparams
+features were computed with (see ``audio.feature_hparams``), output files,
+the train.txt row and statistics for the preprocessing report. On rerun, an
+utterance is recomputed only if any of these changed or an output is
+missing. The file is append-only, so an interrupted run keeps everything
+finished so far.
+"""
+import hashlib
+import json
+import os
+from os.path import exists, join
+
+
+def _sha1(path):
+    m = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            m.update(chunk)
+    return m.hexdigest()
+
+
+def source_info(sources, use_hash=False):
+    """Size and mtime (or sha1) of source files, as recorded in manifests."""
+    info = {}
+    for path in sources:
+        st = os.stat(path)
+        if use_hash:
+            info[path] = {"size": st.st_size, "sha1": _sha1(path)}
+        else:
+            info[path] = {"size": st.st_size, "mtime": st.st_mtime_ns}
+    return info
+
+
+class Manifest(object):
+    """Manifest in ``out_dir``.
+
+    Args:
+        out_dir (str): Output directory of preprocessing.
+        fingerprint (dict): Hyper parameters outputs depend on.
+        use_hash (bool): Compare sources by content hash instead of mtime.
+        rebuild (bool): Ignore (and overwrite) an existing manifest.
+    """
+
+    def __init__(self, out_dir, fingerprint, use_hash=False, rebuild=False):
+        self.out_dir = out_dir
+        self.path = join(out_dir, "manifest.jsonl")
+        self.fingerprint = fingerprint
+        self.use_hash = use_hash
+        self.entries = {}
+        if rebuild and exists(self.path):
+            os.remove(self.path)
+        if exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # truncated by an interrupted run
+                        continue
+                    self.entries[entry["key"]] = entry
+        self._f = None
+
+    def lookup(self, key, sources):
+        """Returns the recorded ``(row, info)`` for ``key`` if it is up to
+        date, otherwise None."""
+        entry = self.entries.get(key)
+        if entry is None or entry["hparams"] != self.fingerprint:
+            return None
+        for output in entry["outputs"]:
+            if not exists(join(self.out_dir, output)):
+                return None
+        # Checked last, as it may hash files
+        if entry["sources"] != source_info(sources, self.use_hash):
+            return None
+        return tuple(entry["row"]), entry.get("info", {})
+
+    def record(self, key, sources, outputs, row, info=None):
+        """Records a processed utterance. ``sources`` is its ``source_info``,
+        taken before processing."""
+        entry = {"key": key, "sources": sources,
+                 "hparams": self.fingerprint, "outputs": list(outputs),
+                 "row": list(row), "info": {} if info is None else info}
+        self.entries[key] = entry
+        if self._f is None:
+            self._f = open(self.path, "a", encoding="utf-8")
+            if self._f.tell() > 0:
+                # terminate a line truncated by an interrupted run
+                self._f.write("\n")
+        self._f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
@@ -0,0 +1,95 @@
+# coding: utf-8
+"""Bounded-memory parallel processing for dataset builders.
+
+Jobs are consumed lazily, and at most ``max_in_flight`` chunks of them are
+submitted to worker processes at a time, so memory doesn't grow with the
+size of the corpus. Rows are yielded in job order as soon as they (and all
+jobs before them) are done.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+from manifest import source_info
+
+
+def _run_chunk(fns):
+    return [fn() for fn in fns]
+
+
+def _with_source_info(fn, sources, use_hash):
+    # Taken before fn() reads the sources. Files are hashed (--hash) here in
+    # workers rather than serially in the main process.
+    sources_info = source_info(sources, use_hash)
+    return fn(), sources_info
+
+
+def _chunks(iterable, chunksize):
+    iterable = iter(iterable)
+    while True:
+        chunk = list(islice(iterable, chunksize))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def _finish(chunk, future, manifest):
+    results = iter(future.result()) if future is not None else None
+    for key, sources, result in chunk:
+        if result is None:
+            result = next(results)
+            if manifest is not None:
+                result, sources_info = result
+                row, info = result
+                manifest.record(key, sources_info, row[:2], row, info)
+        yield result
+
+
+def process(jobs, num_workers=1, manifest=None, chunksize=8, max_in_flight=None):
+    """Run jobs of a dataset builder in worker processes.
+
+    Args:
+        jobs (iterable): ``(key, sources, tail, fn)`` tuples, where ``fn()``
+          returns ``(row, info)``: a train.txt row whose first two columns
+          are output files and last columns are ``tail`` (e.g., speaker ID
+          and text, which don't change the outputs), and a dict of
+          statistics of the utterance (e.g., ``trimmed_samples``).
+        num_workers (int): Number of worker processes.
+        manifest (manifest.Manifest): Skip up to date jobs and record
+          finished ones.
+        chunksize (int): Number of jobs sent to a worker at once. Larger
+          chunks amortize inter-process overhead (see ``benchmark.py
+          preprocess``).
+        max_in_flight (int): Max number of chunks submitted but not yet
+          yielded. Defaults to ``4 * num_workers``.
+
+    Yields:
+        tuple: ``(row, info)``, in the order of ``jobs``.
+    """
+    if max_in_flight is None:
+        max_in_flight = 4 * num_workers
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for chunk in _chunks(jobs, chunksize):
+            entries, fns = [], []
+            for key, sources, tail, fn in chunk:
+                result = manifest.lookup(key, sources) if manifest is not None else None
+                if result is None:
+                    if manifest is not None:
+                        fn = partial(_with_source_info, fn, sources, manifest.use_hash)
+                    fns.append(fn)
+                else:
+                    # transcription or speaker IDs may have changed
+                    row, info = result
+                    result = (row[:len(row) - len(tail)] + tuple(tail), info)
+                entries.append((key, sources, result))
+            future = executor.submit(_run_chunk, fns) if len(fns) > 0 else None
+            in_flight.append((entries, future))
+
+            while len(in_flight) >= max_in_flight:
+                for result in _finish(*in_flight.popleft(), manifest=manifest):
+                    yield result
+        while len(in_flight) > 0:
+            for result in _finish(*in_flight.popleft(), manifest=manifest):
+                yield result
@@ -6,6 +6,11 @@ usage: preprocess.py [options] <name> <in_dir> <out_dir>
 
 options:
     --num_workers=<n>        Num workers.
+    --chunksize=<n>          Number of utterances sent to a worker at once [default: 8].
+    --hparams=<parmas>       Hyper parameters [default: ].
+    --pretokenize            Also save symbol ID sequences (sequences.npz) for training.
+    --hash                   Detect changed source files by content hash instead of mtime.
+    --rebuild                Ignore the manifest of a previous run and process everything.
     -h, --help               Show help message.
 """
 from docopt import docopt
@@ -13,32 +18,94 @@ import os
 from multiprocessing import cpu_count
 from tqdm import tqdm
 from hparams import hparams
+from manifest import Manifest
+import audio
 
 
-def preprocess_ljspeech(in_dir, out_root, num_workers):
+def preprocess_ljspeech(in_dir, out_dir, num_workers, pretokenize=False,
+                        use_hash=False, rebuild=False, chunksize=8):
     import ljspeech
     os.makedirs(out_dir, exist_ok=True)
-    metadata = ljspeech.build_from_path(in_dir, out_dir, num_workers, tqdm=tqdm)
-    write_metadata(metadata, out_dir)
+    manifest = Manifest(out_dir, audio.feature_hparams(), use_hash, rebuild)
+    metadata = ljspeech.build_from_path(in_dir, out_dir, num_workers, tqdm=tqdm,
+                                        manifest=manifest, chunksize=chunksize)
+    texts = write_metadata(metadata, out_dir)
+    manifest.close()
+    if pretokenize:
+        write_sequences(texts, out_dir)
 
 
-def preprocess_jsut(in_dir, out_root, num_workers):
+def preprocess_jsut(in_dir, out_dir, num_workers, pretokenize=False,
+                    use_hash=False, rebuild=False, chunksize=8):
     import jsut
     os.makedirs(out_dir, exist_ok=True)
-    metadata = jsut.build_from_path(in_dir, out_dir, num_workers, tqdm=tqdm)
-    write_metadata(metadata, out_dir)
+    manifest = Manifest(out_dir, audio.feature_hparams(), use_hash, rebuild)
+    metadata = jsut.build_from_path(in_dir, out_dir, num_workers, tqdm=tqdm,
+                                    manifest=manifest, chunksize=chunksize)
+    texts = write_metadata(metadata, out_dir)
+    manifest.close()
+    if pretokenize:
+        write_sequences(texts, out_dir)
+
+
+def preprocess_vctk(in_dir, out_dir, num_workers, pretokenize=False,
+                    use_hash=False, rebuild=False, chunksize=8):
+    import vctk
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = Manifest(out_dir, audio.feature_hparams(), use_hash, rebuild)
+    metadata = vctk.build_from_path(in_dir, out_dir, num_workers, tqdm=tqdm,
+                                    manifest=manifest, chunksize=chunksize)
+    texts = write_metadata(metadata, out_dir)
+    manifest.close()
+    if pretokenize:
+        write_sequences(texts, out_dir)
+
+
+def write_sequences(texts, out_dir):
+    from deepvoice3_pytorch import frontend
+    # Texts as read back from train.txt by train.TextDataSource
+    texts = [str(text) + '\n' for text in texts]
+    lengths = frontend.save_sequences(
+        os.path.join(out_dir, 'sequences.npz'), texts, hparams.frontend)
+    print('Wrote sequences (%s frontend), %d symbols' % (hparams.frontend, lengths.sum()))
 
 
 def write_metadata(metadata, out_dir):
-    with open(os.path.join(out_dir, 'train.txt'), 'w', encoding='utf-8') as f:
-        for m in metadata:
+    """Write rows to train.txt as they come, leaving out utterances longer
+    than hparams.max_frames. Returns texts."""
+    texts = []
+    frames, max_input_length, max_output_length = 0, 0, 0
+    trimmed_frames, dropped, dropped_frames = 0, 0, 0
+    path = os.path.join(out_dir, 'train.txt')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        for m, info in metadata:
+            trimmed_frames += info.get('trimmed_samples', 0) / hparams.hop_size
+            if hparams.max_frames > 0 and m[2] > hparams.max_frames:
+                dropped += 1
+                dropped_frames += m[2]
+                continue
             f.write('|'.join([str(x) for x in m]) + '\n')
-    frames = sum([m[2] for m in metadata])
+            texts.append(m[-1])
+            frames += m[2]
+            max_input_length = max(max_input_length, len(m[-1]))
+            max_output_length = max(max_output_length, m[2])
+    os.replace(path + '.tmp', path)
     frame_shift_ms = hparams.hop_size / hparams.sample_rate * 1000
     hours = frames * frame_shift_ms / (3600 * 1000)
-    print('Wrote %d utterances, %d frames (%.2f hours)' % (len(metadata), frames, hours))
-    print('Max input length:  %d' % max(len(m[3]) for m in metadata))
-    print('Max output length: %d' % max(m[2] for m in metadata))
+    print('Wrote %d utterances, %d frames (%.2f hours)' % (len(texts), frames, hours))
+    print('Max input length:  %d' % max_input_length)
+    print('Max output length: %d' % max_output_length)
+    # Decoder steps and converter compute of an epoch are proportional to frames
+    total_frames = frames + dropped_frames + trimmed_frames
+    print('Trimmed silence:   %d frames (%.1f%%)' % (
+        trimmed_frames, 100 * trimmed_frames / max(1, total_frames)))
+    if hparams.max_frames > 0:
+        print('Left out %d utterances longer than %d frames: %d frames (%.1f%%)' % (
+            dropped, hparams.max_frames, dropped_frames,
+            100 * dropped_frames / max(1, total_frames)))
+    print('Projected training time per epoch: -%.1f%%' % (
+        100 * (total_frames - frames) / max(1, total_frames)))
+    return texts
 
 
 if __name__ == "__main__":
@@ -47,11 +114,23 @@ if __name__ == "__main__":
     in_dir = args["<in_dir>"]
     out_dir = args["<out_dir>"]
     num_workers = args["--num_workers"]
-    num_workers = cpu_count() if num_workers is None else num_workers
+    num_workers = cpu_count() if num_workers is None else int(num_workers)
+    pretokenize = args["--pretokenize"]
+    use_hash = args["--hash"]
+    rebuild = args["--rebuild"]
+    chunksize = int(args["--chunksize"])
+
+    # Override hyper parameters
+    hparams.parse(args["--hparams"])
 
     if name == 'jsut':
-        preprocess_jsut(in_dir, out_dir, num_workers)
+        preprocess_jsut(in_dir, out_dir, num_workers, pretokenize, use_hash, rebuild,
+                        chunksize)
     elif name == 'ljspeech':
-        preprocess_ljspeech(in_dir, out_dir, num_workers)
+        preprocess_ljspeech(in_dir, out_dir, num_workers, pretokenize, use_hash, rebuild,
+                            chunksize)
+    elif name == 'vctk':
+        preprocess_vctk(in_dir, out_dir, num_workers, pretokenize, use_hash, rebuild,
+                        chunksize)
     else:
         assert False
@@ -0,0 +1,108 @@
+# coding: utf-8
+"""CPU inference runtime: thread settings and core-pinned model replicas."""
+import os
+import multiprocessing
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def partition_cores(num_replicas, cores=None):
+    """Split cores into ``num_replicas`` disjoint, contiguous subsets."""
+    cores = available_cores() if cores is None else cores
+    assert 0 < num_replicas <= len(cores)
+    return [list(map(int, c)) for c in np.array_split(cores, num_replicas)]
+
+
+def pin_to_cores(cores):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+
+def configure_threads(num_threads=0, num_interop_threads=0):
+    """Set torch intra/inter-op threads. 0 leaves the library default as is."""
+    import torch
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads > 0 and hasattr(torch, "set_num_interop_threads"):
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            # can only be set once, before any inter-op parallel work
+            pass
+
+
+@contextmanager
+def limit_blas_threads(num_threads=0):
+    """Limit numpy/BLAS (and OpenMP) threads within the context.
+
+    Requires threadpoolctl; it is a no-op without it or if ``num_threads`` is 0.
+    """
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        threadpool_limits = None
+    if num_threads <= 0 or threadpool_limits is None:
+        yield
+        return
+    with threadpool_limits(limits=num_threads):
+        yield
+
+
+def _init_replica(core_queue, num_threads, num_interop_threads,
+                  initializer, initargs):
+    cores = core_queue.get()
+    pin_to_cores(cores)
+    configure_threads(num_threads if num_threads > 0 else len(cores),
+                      num_interop_threads)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+class ReplicaPool(object):
+    """Process pool of model replicas, each pinned to its own core subset.
+
+    ``initializer(*initargs)`` runs once per replica (e.g., to load a model)
+    after pinning and thread setup. Unless ``num_threads`` is given, each
+    replica uses as many torch threads as cores assigned to it.
+
+    Usage:
+    ```
+    with ReplicaPool(4, load_model, (checkpoint_path,)) as pool:
+        for result in pool.imap(synthesize, texts):
+            ...
+    ```
+    """
+
+    def __init__(self, num_replicas, initializer=None, initargs=(),
+                 cores=None, num_threads=0, num_interop_threads=0):
+        # spawn, since forking a process that already used OpenMP can hang
+        ctx = multiprocessing.get_context("spawn")
+        core_queue = ctx.Queue()
+        for c in partition_cores(num_replicas, cores):
+            core_queue.put(c)
+        self.num_replicas = num_replicas
+        self.pool = ctx.Pool(
+            num_replicas, initializer=_init_replica,
+            initargs=(core_queue, num_threads, num_interop_threads,
+                      initializer, initargs))
+
+    def imap(self, func, iterable):
+        """Like ``Pool.imap``; results are yielded in input order."""
+        return self.pool.imap(func, iterable)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
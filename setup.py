@@ -47,6 +47,9 @@ setup(name='deepvoice3_pytorch',
       version=version,
       description='PyTorch implementation of Tacotron speech synthesis model.',
       packages=find_packages(),
+      package_data={
+          "deepvoice3_pytorch": ["frontend/en/cmudict/*.npy"],
+      },
       cmdclass={
           'build_py': build_py,
           'develop': develop,
@@ -56,7 +59,8 @@ setup(name='deepvoice3_pytorch',
           "scipy",
           "unidecode",
           "inflect",
-          "librosa",
+          "librosa >= 0.10",
+          "soundfile",
           "numba",
           "lws",
       ],
@@ -71,6 +75,10 @@ setup(name='deepvoice3_pytorch',
           "test": [
               "nose",
           ],
+          "onnx": [
+              "onnx",
+              "onnxruntime",
+          ],
           "jp": [
               "jaconv",
               "mecab-python3",
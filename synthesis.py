@@ -9,15 +9,18 @@ options:
     --file-name-suffix=<s>            File name suffix [default: ].
     --max-decoder-steps=<N>           Max decoder steps [default: 500].
     --replace_pronunciation_prop=<N>  Prob [default: 0.0].
+    --speaker_id=<id>                 Speaker ID (for multi-speaker model).
     -h, --help               Show help message.
 """
 from docopt import docopt
 
 import sys
 import os
+from collections import Counter
 from os.path import dirname, join, basename, splitext
 
 import audio
+import runtime
 from train import plot_alignment, build_model
 
 import torch
@@ -33,30 +36,36 @@ from tqdm import tqdm
 
 use_cuda = torch.cuda.is_available()
 _frontend = None  # to be set later
+_model = None  # model of a replica process
 
 
-def tts(model, text, p=0):
+def tts(model, text, p=0, speaker_id=None):
     """Convert text to speech waveform given a deepvoice3 model.
 
     Args:
         text (str) : Input text to be synthesized
         p (float) : Replace word to pronounciation if p > 0. Default is 0.
+        speaker_id (int) : Speaker ID, for multi-speaker models.
     """
-    if use_cuda:
+    # Dynamically quantized layers run on CPU only
+    if use_cuda and not model.quantized:
         model = model.cuda()
     model.eval()
+    device = next(model.parameters()).device
 
     sequence = np.array(_frontend.text_to_sequence(text, p=p))
     sequence = Variable(torch.from_numpy(sequence)).unsqueeze(0)
     text_positions = torch.arange(1, sequence.size(-1) + 1).unsqueeze(0).long()
     text_positions = Variable(text_positions)
-    if use_cuda:
-        sequence = sequence.cuda()
-        text_positions = text_positions.cuda()
+    speaker_ids = None if speaker_id is None else \
+        Variable(torch.LongTensor([speaker_id]))
+    sequence = sequence.to(device)
+    text_positions = text_positions.to(device)
+    speaker_ids = None if speaker_ids is None else speaker_ids.to(device)
 
     # Greedy decoding
     mel_outputs, linear_outputs, alignments, done = model(
-        sequence, text_positions=text_positions)
+        sequence, text_positions=text_positions, speaker_ids=speaker_ids)
 
     linear_output = linear_outputs[0].cpu().data.numpy()
     spectrogram = audio._denormalize(linear_output)
@@ -64,11 +73,92 @@ def tts(model, text, p=0):
     mel = mel_outputs[0].cpu().data.numpy()
 
     # Predicted audio signal
-    waveform = audio.inv_spectrogram(linear_output.T)
+    with runtime.limit_blas_threads(hparams.vocoder_num_threads):
+        waveform = audio.inv_spectrogram(linear_output.T)
 
     return waveform, alignment, spectrogram, mel
 
 
+def _checkpoint_downsample_step(state_dict):
+    # The upsampling converter has a ConvTranspose1d (x2) per octave
+    n = len(set(k.split(".")[2] for k in state_dict
+                if k.startswith("converter.deconvolutions.")))
+    return 2 ** n
+
+
+def load_model(checkpoint_path, max_decoder_steps=500):
+    """Build model for synthesis. Weights are random if checkpoint_path is None."""
+    model = build_model()
+    if checkpoint_path is not None:
+        checkpoint = torch.load(checkpoint_path)
+        downsample_step = _checkpoint_downsample_step(checkpoint["state_dict"])
+        if downsample_step != hparams.downsample_step:
+            raise ValueError(
+                "{} was trained with downsample_step={}, but hparams.downsample_step={}. "
+                "Pass --hparams=\"downsample_step={}\".".format(
+                    checkpoint_path, downsample_step, hparams.downsample_step,
+                    downsample_step))
+        model.load_state_dict(checkpoint["state_dict"])
+    model.decoder.max_decoder_steps = max_decoder_steps
+    model.decoder.attention_stop_steps = hparams.attention_stop_steps
+    model.decoder.max_decoder_steps_per_symbol = hparams.max_decoder_steps_per_symbol
+    model.converter_chunk_size = hparams.converter_chunk_size
+    model.make_generation_fast_()
+    if hparams.quantize_dynamic:
+        model.quantize_dynamic_()
+    if hparams.trace_decoder_step:
+        if use_cuda and not model.quantized:
+            model = model.cuda()
+        model.eval()
+        model.decoder.set_incremental_step(
+            model.decoder.make_incremental_step(trace=True))
+    return model
+
+
+def _init_replica(hparams_string, checkpoint_path, max_decoder_steps):
+    global _frontend, _model
+    hparams.parse(hparams_string)
+    _frontend = getattr(frontend, hparams.frontend)
+    import train
+    train._frontend = _frontend
+    _model = load_model(checkpoint_path, max_decoder_steps)
+
+
+def _tts_replica(args):
+    text, p, speaker_id = args
+    stop_counts = _model.decoder.stop_counts.copy()
+    waveform, alignment, _, _ = tts(_model, text, p=p, speaker_id=speaker_id)
+    return waveform, alignment, _model.decoder.stop_counts - stop_counts
+
+
+def tts_texts(texts, checkpoint_path, p=0, max_decoder_steps=500,
+              hparams_string="", speaker_id=None):
+    """Yield (waveform, alignment) for each text in order.
+
+    With ``hparams.num_replicas > 1``, texts are distributed over model
+    replicas running in worker processes, each pinned to its own core subset.
+    """
+    stop_counts = Counter()
+    if hparams.num_replicas > 1:
+        with runtime.ReplicaPool(
+                hparams.num_replicas, _init_replica,
+                (hparams_string, checkpoint_path, max_decoder_steps),
+                num_threads=hparams.num_threads,
+                num_interop_threads=hparams.num_interop_threads) as pool:
+            for waveform, alignment, counts in pool.imap(
+                    _tts_replica, [(text, p, speaker_id) for text in texts]):
+                stop_counts.update(counts)
+                yield waveform, alignment
+    else:
+        runtime.configure_threads(hparams.num_threads, hparams.num_interop_threads)
+        model = load_model(checkpoint_path, max_decoder_steps)
+        for text in texts:
+            waveform, alignment, _, _ = tts(model, text, p=p, speaker_id=speaker_id)
+            yield waveform, alignment
+        stop_counts = model.decoder.stop_counts
+    print("Decoding stopped by:", dict(stop_counts))
+
+
 if __name__ == "__main__":
     args = docopt(__doc__)
     print("Command line args:\n", args)
@@ -78,6 +168,8 @@ if __name__ == "__main__":
     max_decoder_steps = int(args["--max-decoder-steps"])
     file_name_suffix = args["--file-name-suffix"]
     replace_pronunciation_prob = float(args["--replace_pronunciation_prop"])
+    speaker_id = args["--speaker_id"]
+    speaker_id = None if speaker_id is None else int(speaker_id)
 
     # Override hyper parameters
     hparams.parse(args["--hparams"])
@@ -87,34 +179,28 @@ if __name__ == "__main__":
     import train
     train._frontend = _frontend
 
-    # Model
-    model = build_model()
-
-    checkpoint = torch.load(checkpoint_path)
-    model.load_state_dict(checkpoint["state_dict"])
-    model.decoder.max_decoder_steps = max_decoder_steps
-    model.make_generation_fast_()
-
     os.makedirs(dst_dir, exist_ok=True)
     checkpoint_name = splitext(basename(checkpoint_path))[0]
 
     with open(text_list_file_path, "rb") as f:
-        lines = f.readlines()
-        for idx, line in enumerate(lines):
-            text = line.decode("utf-8")[:-1]
-            words = nltk.word_tokenize(text)
-            waveform, alignment, _, _ = tts(model, text, p=replace_pronunciation_prob)
-            dst_wav_path = join(dst_dir, "{}_{}{}.wav".format(
-                idx, checkpoint_name, file_name_suffix))
-            dst_alignment_path = join(
-                dst_dir, "{}_{}{}_alignment.png".format(idx, checkpoint_name,
-                                                        file_name_suffix))
-            plot_alignment(alignment.T, dst_alignment_path,
-                           info="deepvoice3, {}".format(checkpoint_path))
-            audio.save_wav(waveform, dst_wav_path)
-            from os.path import basename, splitext
-            name = splitext(basename(text_list_file_path))[0]
-            print("""
+        texts = [line.decode("utf-8")[:-1] for line in f.readlines()]
+
+    results = tts_texts(texts, checkpoint_path, p=replace_pronunciation_prob,
+                        max_decoder_steps=max_decoder_steps,
+                        hparams_string=args["--hparams"], speaker_id=speaker_id)
+    for idx, (text, (waveform, alignment)) in enumerate(zip(texts, results)):
+        words = nltk.word_tokenize(text)
+        dst_wav_path = join(dst_dir, "{}_{}{}.wav".format(
+            idx, checkpoint_name, file_name_suffix))
+        dst_alignment_path = join(
+            dst_dir, "{}_{}{}_alignment.png".format(idx, checkpoint_name,
+                                                    file_name_suffix))
+        plot_alignment(alignment.T, dst_alignment_path,
+                       info="deepvoice3, {}".format(checkpoint_path))
+        audio.save_wav(waveform, dst_wav_path)
+        from os.path import basename, splitext
+        name = splitext(basename(text_list_file_path))[0]
+        print("""
 {}
 
 ({} chars, {} words)
@@ -125,9 +211,9 @@ Your browser does not support the audio element.
 </audio>
 
 <div align="center"><img src="/audio/deepvoice3/{}/{}{}_alignment.png" /></div>
-                  """.format(text, len(text), len(words),
-                             name, idx, file_name_suffix,
-                             name, idx, file_name_suffix))
+              """.format(text, len(text), len(words),
+                         name, idx, file_name_suffix,
+                         name, idx, file_name_suffix))
 
     print("Finished! Check out {} for generated audio samples.".format(dst_dir))
     sys.exit(0)
@@ -0,0 +1,55 @@
+# coding: utf-8
+from __future__ import with_statement, print_function, absolute_import
+
+import sys
+from os.path import dirname, join
+
+import numpy as np
+
+sys.path.insert(0, join(dirname(__file__), ".."))
+from hparams import hparams
+import audio
+
+
+def _spectrogram(duration, f0):
+    sr = hparams.sample_rate
+    t = np.arange(int(duration * sr)) / sr
+    y = 0.5 * np.sin(2 * np.pi * (f0 + 100 * t) * t).astype(np.float32)
+    return audio.spectrogram(y).astype(np.float32)
+
+
+def _spectral_convergence(spectrogram, y):
+    S = audio._db_to_amp(audio._denormalize(spectrogram))
+    S_hat = audio._db_to_amp(audio._denormalize(audio.spectrogram(y)))
+    T = min(S.shape[1], S_hat.shape[1])
+    S, S_hat = S[:, :T], S_hat[:, :T]
+    return np.linalg.norm(S - S_hat) / np.linalg.norm(S)
+
+
+def test_griffin_lim():
+    import librosa
+    if not hasattr(librosa, "griffinlim"):
+        return
+    n_iter = 30
+    spectrograms = [_spectrogram(0.5, 150), _spectrogram(0.3, 250)]
+    waveforms = audio.inv_spectrograms(spectrograms, n_iter=n_iter)
+
+    for S, y in zip(spectrograms, waveforms):
+        # trimmed to each spectrogram of the zero-padded batch
+        assert len(y) == (S.shape[1] - 1) * hparams.hop_size
+
+        # numpy (librosa) implementation on the same magnitudes
+        magnitude = audio._db_to_amp(
+            audio._denormalize(S) + hparams.ref_level_db) ** hparams.power
+        y_librosa = audio.inv_preemphasis(librosa.griffinlim(
+            magnitude, n_iter=n_iter, hop_length=hparams.hop_size,
+            win_length=hparams.fft_size, n_fft=hparams.fft_size,
+            momentum=hparams.griffin_lim_momentum, random_state=0))
+        sc = _spectral_convergence(S, y)
+        sc_librosa = _spectral_convergence(S, y_librosa)
+        assert sc < 1.0
+        assert sc <= sc_librosa * 1.1
+
+    # fixed seed of the initial phase
+    for y, y2 in zip(waveforms, audio.inv_spectrograms(spectrograms, n_iter=n_iter)):
+        assert np.array_equal(y, y2)
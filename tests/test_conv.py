@@ -6,7 +6,9 @@ from torch import nn
 from torch.autograd import Variable
 from fairseq.modules.conv_tbc import ConvTBC
 from torch.nn import functional as F
-from deepvoice3_pytorch.conv import Conv1d
+import math
+import numpy as np
+from deepvoice3_pytorch.conv import Conv1d, glu_block, residual_sum
 
 
 def test_conv1d_incremental():
@@ -64,3 +66,61 @@ def test_conv1d_incremental():
                 for kernel_size in [3, 5, 9]:
                     for dilation in [1, 2, 3, 4, 5, 6, 7, 8, 9, 27]:
                         __test, kernel_size, dilation, T, B, C
+
+
+def test_glu_block():
+    def _reference(conv, x, dim, proj, bias, causal):
+        # the block as previously written in Encoder, Decoder and Converter
+        residual = x if proj is None else proj(x)
+        x = conv(x)
+        if causal:
+            x = x[:, :, :residual.size(-1)]
+        a, b = x.split(x.size(dim) // 2, dim=dim)
+        if bias is not None:
+            a = a + bias
+        x = a * F.sigmoid(b)
+        return (x + residual) * math.sqrt(0.5)
+
+    B, C, T = 4, 8, 20
+    for use_proj in [False, True]:
+        for use_bias in [False, True]:
+            for causal in [False, True]:
+                padding = 4 if causal else 2
+                conv = Conv1d(C, C * 4 if use_proj else C * 2, 5, padding=padding)
+                proj = nn.Linear(C, C * 2) if use_proj else None
+                # Linear on B x T x C
+                proj_bct = None if proj is None else \
+                    (lambda x: proj(x.transpose(1, 2)).transpose(1, 2))
+                x = Variable(torch.randn(B, C, T), requires_grad=True)
+                out_channels = C * 2 if use_proj else C
+                bias = Variable(torch.randn(B, out_channels, 1)) if use_bias else None
+
+                outputs, grads = [], []
+                for f in [_reference, None]:
+                    if x.grad is not None:
+                        x.grad.data.zero_()
+                    conv.zero_grad()
+                    if f is None:
+                        y, residual = glu_block(
+                            conv, x, dim=1, proj=proj_bct, bias=bias, causal=causal)
+                        y = residual_sum(y, residual)
+                    else:
+                        y = f(conv, x, 1, proj_bct, bias, causal)
+                    y.sum().backward()
+                    outputs.append(y.data.clone())
+                    grads.append([x.grad.data.clone(), conv.weight.grad.data.clone()])
+
+                # vectorized and fused kernels may round differently
+                assert np.allclose(outputs[0].numpy(), outputs[1].numpy(), atol=1e-6)
+                for g0, g1 in zip(*grads):
+                    assert np.allclose(g0.numpy(), g1.numpy(), atol=1e-6)
+
+    # TBC layout
+    conv = ConvTBC(C, C * 2, 5, padding=2)
+    x = Variable(torch.randn(T, B, C))
+    y, residual = glu_block(conv, x, dim=-1)
+    y = residual_sum(y, residual)
+    a, b = conv(x).split(C, dim=-1)
+    assert np.allclose(y.data.numpy(),
+                       ((a * F.sigmoid(b) + x) * math.sqrt(0.5)).data.numpy(),
+                       atol=1e-6)
@@ -14,7 +14,7 @@ import numpy as np
 from nose.plugins.attrib import attr
 
 from deepvoice3_pytorch import Encoder, Decoder, Converter, DeepVoice3
-from deepvoice3_pytorch import build_deepvoice3
+from deepvoice3_pytorch import build_deepvoice3, converter_chunks
 
 from fairseq.modules.conv_tbc import ConvTBC
 
@@ -25,7 +25,7 @@ outputs_per_step = 4
 padding_idx = 0
 
 
-def _get_model(n_speakers=1, speaker_embed_dim=None):
+def _get_model(n_speakers=1, speaker_embed_dim=None, downsample_step=1):
     model = build_deepvoice3(n_vocab=n_vocab,
                              embed_dim=256,
                              mel_dim=num_mels,
@@ -39,6 +39,7 @@ def _get_model(n_speakers=1, speaker_embed_dim=None):
                              encoder_channels=128,
                              decoder_channels=256,
                              converter_channels=256,
+                             downsample_step=downsample_step,
                              )
     return model
 
@@ -163,6 +164,319 @@ def test_multi_speaker_deepvoice3():
     print("Alignments:", alignments.size())
     print("Done:", done.size())
 
+    # speaker ID 0 is a trainable speaker, not padding
+    speaker_ids = Variable(torch.LongTensor([0, 1, 2]))
+    mel_outputs, linear_outputs, alignments, done = model(x, y, speaker_ids=speaker_ids)
+    mel_outputs.sum().backward()
+    assert (model.embed_speakers.weight.grad[:3].abs().sum(1) > 0).all()
+
+
+def test_downsample_step():
+    x, y = _test_data()
+    model = _get_model(downsample_step=4)
+
+    # decoder runs on every 4th frame, converter upsamples back
+    mel_outputs, linear_outputs, alignments, done = model(x, y)
+    assert mel_outputs.size(1) == y.size(1)
+    assert linear_outputs.size(1) == y.size(1) * 4
+    assert linear_outputs.size(-1) == num_freq
+
+    model.eval()
+    model.make_generation_fast_()
+    model.decoder.max_decoder_steps = 5
+    text_positions = Variable(
+        torch.arange(1, x.size(-1) + 1).unsqueeze(0).long().expand_as(x))
+    mel_outputs, linear_outputs, alignments, done = model(
+        x[:1], text_positions=text_positions[:1])
+    assert linear_outputs.size(1) == mel_outputs.size(1) * 4
+
+
+def test_checkpoint_activations():
+    x, y = _test_data()
+    speaker_ids = Variable(torch.LongTensor([0, 1, 2]))
+    for downsample_step in [1, 2]:
+        model = _get_model(n_speakers=4, speaker_embed_dim=16,
+                           downsample_step=downsample_step)
+        model.train()
+        grads = []
+        for checkpoint_activations in [False, True]:
+            for m in [model.encoder, model.decoder, model.converter]:
+                m.checkpoint_activations = checkpoint_activations
+            model.zero_grad()
+            # same dropout masks in forward and recomputation
+            torch.manual_seed(1234)
+            mel_outputs, linear_outputs, alignments, done = model(
+                x, y, speaker_ids=speaker_ids)
+            (mel_outputs.sum() + linear_outputs.sum() + done.sum()).backward()
+            grads.append([p.grad.data.clone() for p in model.parameters()
+                          if p.grad is not None])
+
+        assert len(grads[0]) == len(grads[1])
+        for g0, g1 in zip(*grads):
+            assert np.allclose(g0.numpy(), g1.numpy(), atol=1e-5)
+
+
+def test_converter_chunks():
+    for downsample_step in [1, 4]:
+        model = _get_model(downsample_step=downsample_step)
+        model.eval()
+        converter = model.converter
+        x = Variable(torch.rand(2, 100, converter.in_dim))
+        y = converter(x).data.numpy()
+        for chunk_size in [1, 7, 32, 200]:
+            chunks = list(converter_chunks(converter, x, chunk_size))
+            assert len(chunks) == (100 + chunk_size - 1) // chunk_size
+            y_chunked = torch.cat(chunks, 1).data.numpy()
+            assert y.shape == y_chunked.shape
+            assert np.allclose(y, y_chunked, atol=1e-6)
+
+    # decode
+    x, y = _test_data()
+    model = _get_model()
+    model.eval()
+    _, linear_outputs, _, _ = model(x, y)
+    model.converter_chunk_size = 5
+    _, linear_outputs_chunked, _, _ = model(x, y)
+    assert np.allclose(linear_outputs.data.numpy(),
+                       linear_outputs_chunked.data.numpy(), atol=1e-6)
+
+
+def test_encoder_cache():
+    x, y = _test_data()
+    text_positions = Variable(
+        torch.arange(1, x.size(-1) + 1).unsqueeze(0).long().expand_as(x))
+    model = _get_model()
+    model.eval()
+
+    mel_outputs, linear_outputs, _, _ = model(
+        x, y, text_positions=text_positions)
+
+    model.encoder_cache_size = 1
+    encoder_outputs = model.encode(x, text_positions=text_positions)
+    assert model.encode(x, text_positions=text_positions) is encoder_outputs
+    assert model.encode(x[:1], text_positions=text_positions[:1]) \
+        is not encoder_outputs
+    assert len(model._encoder_cache) == 1
+
+    # decoding must not modify cached encoder outputs
+    for _ in range(2):
+        mel_outputs_cached, linear_outputs_cached, _, _ = model.decode(
+            model.encode(x, text_positions=text_positions), y,
+            text_positions=text_positions)
+        assert np.allclose(mel_outputs.data.numpy(),
+                           mel_outputs_cached.data.numpy(), atol=1e-6)
+        assert np.allclose(linear_outputs.data.numpy(),
+                           linear_outputs_cached.data.numpy(), atol=1e-6)
+
+    model.train()
+    assert len(model._encoder_cache) == 0
+
+
+def test_speaker_bias_cache():
+    x, y = _test_data()
+    speaker_ids = Variable(torch.LongTensor([3, 0, 3]))
+    model = _get_model(n_speakers=4, speaker_embed_dim=16)
+    model.eval()
+
+    # reference: speaker embeddings projected per forward
+    keys, values = model.encoder(
+        x, speaker_embed=model.embed_speakers(speaker_ids))
+    assert model._speaker_bias_cache is None
+
+    for _ in range(2):
+        keys_cached, values_cached = model.encode(x, speaker_ids=speaker_ids)
+        assert model._speaker_bias_cache is not None
+        assert np.allclose(keys.data.numpy(), keys_cached.data.numpy(),
+                           atol=1e-6)
+        assert np.allclose(values.data.numpy(), values_cached.data.numpy(),
+                           atol=1e-6)
+
+    model.train()
+    assert model._speaker_bias_cache is None
+
+
+def test_incremental_step():
+    x, y = _test_data()
+    x = x[:1]
+    text_positions = Variable(torch.arange(1, x.size(-1) + 1).unsqueeze(0).long())
+
+    for dilation in [1, 2]:
+        model = _build_deepvoice3(n_vocab=n_vocab,
+                                  embed_dim=256,
+                                  mel_dim=num_mels,
+                                  linear_dim=num_freq,
+                                  r=outputs_per_step,
+                                  padding_idx=padding_idx,
+                                  dilation=dilation,
+                                  )
+        model.eval()
+        model.make_generation_fast_()
+        model.decoder.max_decoder_steps = 20
+        mel_outputs, linear_outputs, alignments, _ = model(
+            x, text_positions=text_positions)
+
+        for trace in [False, True]:
+            model.decoder.set_incremental_step(
+                model.decoder.make_incremental_step(trace=trace))
+            mel_outputs_step, linear_outputs_step, alignments_step, _ = model(
+                x, text_positions=text_positions)
+            model.decoder.set_incremental_step(None)
+
+            assert mel_outputs.size() == mel_outputs_step.size()
+            assert np.allclose(mel_outputs.data.numpy(),
+                               mel_outputs_step.data.numpy(), atol=1e-5)
+            assert np.allclose(linear_outputs.data.numpy(),
+                               linear_outputs_step.data.numpy(), atol=1e-5)
+            assert np.allclose(alignments.data.numpy(),
+                               alignments_step.data.numpy(), atol=1e-5)
+
+        # the step must not be part of the model state
+        assert not any("step" in k for k in model.state_dict().keys())
+
+
+def test_early_stopping():
+    x, y = _test_data()
+    x = x[:1]
+    text_positions = Variable(torch.arange(1, x.size(-1) + 1).unsqueeze(0).long())
+    model = _get_model()
+    model.eval()
+    model.make_generation_fast_()
+    decoder = model.decoder
+    decoder.max_decoder_steps = 100
+    decoder.max_decoder_steps_per_symbol = 0.75
+    decoder.fc3.bias.data.fill_(-100)  # never done
+
+    # step budget, in both decode loops
+    budget = int(np.ceil(x.size(-1) * 0.75))
+    for step in [None, decoder.make_incremental_step()]:
+        decoder.set_incremental_step(step)
+        mel_outputs, _, _, _ = model(x, text_positions=text_positions)
+        assert mel_outputs.size(1) == budget * outputs_per_step
+    decoder.set_incremental_step(None)
+    assert decoder.stop_counts["budget"] == 2
+
+    # attention: per sequence; positions of padding are zero
+    decoder.max_decoder_steps_per_symbol = 0
+    decoder.attention_stop_steps = 3
+    decoder.min_decoder_steps = 0
+    keys = torch.zeros(2, 8, 5)
+    state = decoder._start_stopping(
+        keys, Variable(torch.LongTensor([[1, 2, 3, 4, 5], [1, 2, 3, 0, 0]])))
+    done = torch.zeros(2, 1, 1)
+    alignment = torch.zeros(2, 1, 5)
+    alignment[0, 0, 1] = alignment[1, 0, 2] = 1
+    assert decoder._should_stop(1, done, alignment, state) is None
+    alignment[0, 0, 1], alignment[0, 0, 4] = 0, 1
+    # reached at t=1 and t=2
+    for t in range(2, 5):
+        assert decoder._should_stop(t, done, alignment, state) is None
+    assert decoder._should_stop(5, done, alignment, state) == "attention"
+    done.fill_(1)
+    assert decoder._should_stop(1, done, alignment, state) == "done"
+
+
+def test_long_positions():
+    # beyond max_positions (512) of position encodings
+    x = Variable(torch.LongTensor(
+        text_to_sequence("Thank you very much. " * 30)).unsqueeze(0))
+    assert x.size(-1) > 512
+    text_positions = Variable(torch.arange(1, x.size(-1) + 1).unsqueeze(0).long())
+    model = _get_model()
+    model.eval()
+    model.make_generation_fast_()
+    model.decoder.fc3.bias.data.fill_(-100)  # never done
+    model.decoder.max_decoder_steps = 520
+    mel_outputs, linear_outputs, alignments, done = model(
+        x, text_positions=text_positions)
+    assert mel_outputs.size(1) == 521 * outputs_per_step
+
+    # extended rows are not saved
+    state_dict = model.state_dict()
+    assert state_dict["decoder.embed_query_positions.weight"].size(0) == 512
+
+
+def test_quantize_dynamic():
+    if not hasattr(torch, "quantization"):
+        return
+    x, y = _test_data()
+    x = x[:1]
+    text_positions = Variable(torch.arange(1, x.size(-1) + 1).unsqueeze(0).long())
+
+    model = _build_deepvoice3(n_vocab=n_vocab,
+                              embed_dim=256,
+                              mel_dim=num_mels,
+                              linear_dim=num_freq,
+                              r=outputs_per_step,
+                              padding_idx=padding_idx,
+                              dilation=2,
+                              )
+    model.eval()
+    model.make_generation_fast_()
+    model.decoder.max_decoder_steps = 20
+    mel_outputs, linear_outputs, _, _ = model(x, text_positions=text_positions)
+
+    model.quantize_dynamic_()
+    mel_outputs_q, linear_outputs_q, _, _ = model(x, text_positions=text_positions)
+    T = min(mel_outputs.size(1), mel_outputs_q.size(1))
+    assert np.abs(mel_outputs.data.numpy()[:, :T] -
+                  mel_outputs_q.data.numpy()[:, :T]).mean() < 0.05
+
+    # traced step over quantized layers
+    model.decoder.set_incremental_step(
+        model.decoder.make_incremental_step(trace=True))
+    mel_outputs_step, _, _, _ = model(x, text_positions=text_positions)
+    assert np.allclose(mel_outputs_q.data.numpy(),
+                       mel_outputs_step.data.numpy(), atol=1e-5)
+
+
+def test_onnx_export():
+    try:
+        import onnxruntime
+    except ImportError:
+        return
+    import tempfile
+    import shutil
+    from deepvoice3_pytorch.onnx_export import export_onnx, OnnxSynthesizer
+
+    x, y = _test_data()
+    x = x[:1]
+    text_positions = Variable(torch.arange(1, x.size(-1) + 1).unsqueeze(0).long())
+
+    model = _build_deepvoice3(n_vocab=n_vocab,
+                              embed_dim=256,
+                              mel_dim=num_mels,
+                              linear_dim=num_freq,
+                              r=outputs_per_step,
+                              padding_idx=padding_idx,
+                              dilation=2,
+                              )
+    model.eval()
+    model.make_generation_fast_()
+    model.decoder.max_decoder_steps = 20
+    mel_outputs, linear_outputs, alignments, _ = model(
+        x, text_positions=text_positions)
+
+    dst_dir = tempfile.mkdtemp()
+    try:
+        export_onnx(model, dst_dir)
+        synthesizer = OnnxSynthesizer(
+            dst_dir, mel_dim=num_mels,
+            max_decoder_steps=model.decoder.max_decoder_steps,
+            min_decoder_steps=model.decoder.min_decoder_steps)
+        mel_outputs_onnx, linear_outputs_onnx, alignments_onnx, _ = \
+            synthesizer(x.data.numpy())
+    finally:
+        shutil.rmtree(dst_dir)
+
+    assert mel_outputs.size() == mel_outputs_onnx.shape
+    assert np.allclose(mel_outputs.data.numpy(), mel_outputs_onnx, atol=1e-5)
+    assert np.allclose(linear_outputs.data.numpy(), linear_outputs_onnx, atol=1e-5)
+    assert np.allclose(alignments.data.numpy(), alignments_onnx, atol=1e-5)
+
+    # export must not change the model
+    assert not model.training
+    assert model.encoder.num_attention_layers is not None
+
 
 @attr("local_only")
 def test_incremental_forward():
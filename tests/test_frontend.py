@@ -3,6 +3,7 @@ from __future__ import with_statement, print_function, absolute_import
 
 from deepvoice3_pytorch import frontend
 from nose.plugins.attrib import attr
+import numpy as np
 
 eos = 1
 
@@ -15,6 +16,67 @@ def test_en():
     assert t == "hello world.~"
 
 
+def test_english_cleaners():
+    import re
+    from unidecode import unidecode
+    from deepvoice3_pytorch.frontend.text import cleaners
+    from deepvoice3_pytorch.frontend.text.numbers import (
+        _comma_number_re, _pounds_re, _dollars_re, _decimal_number_re,
+        _ordinal_re, _number_re, _remove_commas, _expand_dollars,
+        _expand_decimal_point, _expand_ordinal, _expand_number)
+
+    # one pass per regex
+    def _reference(text):
+        text = unidecode(text)
+        text = cleaners.add_punctuation(text)
+        text = text.lower()
+        text = re.sub(_comma_number_re, _remove_commas, text)
+        text = re.sub(_pounds_re, r'\1 pounds', text)
+        text = re.sub(_dollars_re, _expand_dollars, text)
+        text = re.sub(_decimal_number_re, _expand_decimal_point, text)
+        text = re.sub(_ordinal_re, _expand_ordinal, text)
+        text = re.sub(_number_re, _expand_number, text)
+        for regex, replacement in cleaners._abbreviations:
+            text = re.sub(regex, replacement, text)
+        text = re.sub(r'\s+', ' ', text)
+        return text
+
+    texts = [
+        "Printing, in the only sense with which we are at present concerned,",
+        "Mr. and Mrs. Oswald lived at 214 Neely St. in Dallas.",
+        "Gen. Walker, Lt. Col. Smith and Drs. Jones & Co., Ltd.",
+        "on November 22, 1963, at 12:30 p.m.",
+        "It cost $3.50, or \u00a31,250 in the 19th century; 2001 and 1,000,000.",
+        "Dr.Mr. mr.dr. mrs.drs. ft.mr.co. sgt.capt.esq. rev.hon.maj.jr.",
+        "the first. most. coast. dr.s",
+        "Caf\u00e9 na\u00efve \u00bd   spaces\tand\nnew lines",
+        "",
+        "no abbreviations or numbers here",
+    ]
+    for text in texts:
+        assert cleaners.english_cleaners(text) == _reference(text), text
+
+
+def test_en_cache():
+    import random
+    from deepvoice3_pytorch.frontend.en import mix_pronunciation
+    from deepvoice3_pytorch.frontend.text import text_to_sequence
+
+    f = getattr(frontend, "en")
+    texts = ["Hello world.", "hello world\n", "Thank you very much, Mr. Smith",
+             "It cost $5.50 in 1963.\n", "very  very", "{HH AH0 L OW1} world"]
+    f.clear_cache()
+    for p in [0.0, 0.5, 1.0]:
+        for _ in range(2):
+            for seed, text in enumerate(texts):
+                random.seed(seed)
+                expected = text_to_sequence(mix_pronunciation(text, p), ["english_cleaners"])
+                random.seed(seed)
+                assert f.text_to_sequence(text, p=p) == expected
+                random.seed(seed)
+                assert f.texts_to_sequences([text], p=p) == [expected]
+
+
 def test_ja():
     f = getattr(frontend, "jp")
     seq = f.text_to_sequence("こんにちわ")
@@ -23,6 +85,88 @@ def test_ja():
     assert t[:-1] == "コンニチワ。"
 
 
+def test_ja_cache():
+    import random
+    import jaconv
+    from deepvoice3_pytorch.frontend.jp import (
+        mix_pronunciation, add_punctuation, _normalize)
+
+    f = getattr(frontend, "jp")
+    texts = ["こんにちわ", "水をマレーシアから買わなくてはならないのです。",
+             "上院議員は私がデータをゆがめたと告発した", "Hello, 世界!"]
+    f.clear_cache()
+    for p in [0.0, 0.5, 1.0]:
+        for _ in range(2):
+            for seed, text in enumerate(texts):
+                random.seed(seed)
+                t = _normalize(text)
+                if p > 0:
+                    t = mix_pronunciation(t, p)
+                t = add_punctuation(jaconv.hira2kata(t))
+                expected = [ord(c) for c in t] + [eos]
+                random.seed(seed)
+                assert f.text_to_sequence(text, p=p) == expected
+                random.seed(seed)
+                assert f.texts_to_sequences([text], p=p) == [expected]
+
+
+def test_pretokenized_sequences():
+    import tempfile
+    import shutil
+    from os.path import join
+
+    texts = ["Hello world.\n", "It cost $5.50 in 1963.\n", "Hello world.\n"]
+    dst_dir = tempfile.mkdtemp()
+    try:
+        path = join(dst_dir, "sequences.npz")
+        assert frontend.load_sequences(path, texts, "en") is None
+        lengths = frontend.save_sequences(path, texts, "en")
+        seqs = frontend.load_sequences(path, texts, "en")
+        assert len(seqs) == len(texts)
+        for text, seq, length in zip(texts, seqs, lengths):
+            assert seq.dtype == np.int32
+            assert len(seq) == length
+            assert list(seq) == frontend.en.text_to_sequence(text, p=0.0)
+        # stale
+        assert frontend.load_sequences(path, texts[:-1], "en") is None
+        assert frontend.load_sequences(path, texts, "jp") is None
+    finally:
+        shutil.rmtree(dst_dir)
+
+
+def test_compiled_cmudict():
+    import tempfile
+    import shutil
+    from deepvoice3_pytorch.frontend.text.cmudict import (
+        CompiledCMUDict, compile_cmudict)
+
+    entries = [("hello", ["HH", "AH0", "L", "OW1"]),
+               ("hello", ["HH", "EH0", "L", "OW1"]),
+               ("world", ["W", "ER1", "L", "D"]),
+               ("a", ["AH0"]),
+               ("a", ["EY1"]),
+               ("zebra", ["Z", "IY1", "B", "R", "AH0"])]
+    d = {}
+    for word, phonemes in entries:
+        d.setdefault(word, []).append(phonemes)
+
+    dst_dir = tempfile.mkdtemp()
+    try:
+        assert compile_cmudict(dst_dir, entries) == len(d)
+        c = CompiledCMUDict(dst_dir)
+        assert len(c) == len(d)
+        for word in d:
+            assert word in c
+            assert c[word] == d[word]
+        for word in ["", "b", "hell", "hellos", "Hello", "worlds" * 10]:
+            assert word not in c
+            assert c.get(word) is None
+        assert c.lookup("Hello") == ["HH AH0 L OW1", "HH EH0 L OW1"]
+        assert c.lookup("xyz") is None
+    finally:
+        shutil.rmtree(dst_dir)
+
+
 @attr("local_only")
 def test_en_lj():
     f = getattr(frontend, "en")
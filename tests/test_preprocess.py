@@ -0,0 +1,332 @@
+# coding: utf-8
+from __future__ import with_statement, print_function, absolute_import
+
+import sys
+import os
+from os.path import dirname, join, exists
+import shutil
+import tempfile
+import time
+from functools import partial
+from io import StringIO
+
+import numpy as np
+
+sys.path.insert(0, join(dirname(__file__), ".."))
+from hparams import hparams
+import audio
+from manifest import Manifest, source_info
+
+
+def _write_wav(path, duration=0.5, sr=None, silence=0.0):
+    sr = hparams.sample_rate if sr is None else sr
+    t = np.arange(int(duration * sr)) / sr
+    wav = 0.3 * np.sin(2 * np.pi * 200 * t)
+    pad = np.zeros(int(silence * sr))
+    audio.save_wav(np.concatenate([pad, wav, pad]), path, sr=sr)
+
+
+def _make_vctk(in_dir, speakers):
+    for speaker, names in speakers.items():
+        for d in ["wav48", "txt"]:
+            if not exists(join(in_dir, d, speaker)):
+                os.makedirs(join(in_dir, d, speaker))
+        for name in names:
+            _write_wav(join(in_dir, "wav48", speaker, name + ".wav"))
+            with open(join(in_dir, "txt", speaker, name + ".txt"), "w") as f:
+                f.write("Text of {}.\n".format(name))
+
+
+def test_vctk():
+    import vctk
+    root = tempfile.mkdtemp()
+    try:
+        in_dir, out_dir = join(root, "vctk"), join(root, "out")
+        os.makedirs(out_dir)
+        _make_vctk(in_dir, {"p226": ["p226_001"], "p225": ["p225_001", "p225_002"]})
+        # wav without transcription is skipped
+        _write_wav(join(in_dir, "wav48", "p225", "p225_003.wav"))
+
+        manifest = Manifest(out_dir, audio.feature_hparams())
+        rows = [row for row, _ in vctk.build_from_path(
+            in_dir, out_dir, num_workers=2, manifest=manifest)]
+        manifest.close()
+        with open(join(out_dir, "speakers.txt")) as f:
+            assert f.read().split() == ["p225", "p226"]
+        assert [row[3] for row in rows] == [0, 0, 1]
+        assert rows[0][:2] == ("vctk-spec-p225-p225_001.npy",
+                               "vctk-mel-p225-p225_001.npy")
+        assert rows[2][-1] == "Text of p226_001."
+        for row in rows:
+            assert exists(join(out_dir, row[0])) and exists(join(out_dir, row[1]))
+
+        # A new speaker shifts speaker IDs; outputs of the others are reused,
+        # but their rows get the new IDs
+        _make_vctk(in_dir, {"p224": ["p224_001"]})
+        # so does a speaker without transcribed utterances
+        os.makedirs(join(in_dir, "wav48", "p223"))
+        _write_wav(join(in_dir, "wav48", "p223", "p223_001.wav"))
+        mtime = os.stat(join(out_dir, rows[0][0])).st_mtime_ns
+        manifest = Manifest(out_dir, audio.feature_hparams())
+        new_rows = [row for row, _ in vctk.build_from_path(
+            in_dir, out_dir, num_workers=2, manifest=manifest)]
+        manifest.close()
+        assert os.stat(join(out_dir, rows[0][0])).st_mtime_ns == mtime
+        with open(join(out_dir, "speakers.txt")) as f:
+            speakers = f.read().split()
+        assert speakers == ["p223", "p224", "p225", "p226"]
+        assert [(row[0], row[3]) for row in new_rows] == [
+            ("vctk-spec-p224-p224_001.npy", 1),
+            ("vctk-spec-p225-p225_001.npy", 2),
+            ("vctk-spec-p225-p225_002.npy", 2),
+            ("vctk-spec-p226-p226_001.npy", 3)]
+    finally:
+        shutil.rmtree(root)
+
+
+def _record(manifest, key, source, output, row):
+    with open(join(manifest.out_dir, output), "w") as f:
+        f.write("features")
+    manifest.record(key, source_info([source], manifest.use_hash), [output],
+                    row, {"trimmed_samples": 3})
+
+
+def test_manifest():
+    root = tempfile.mkdtemp()
+    try:
+        source = join(root, "a.wav")
+        with open(source, "w") as f:
+            f.write("audio")
+        fingerprint = {"sample_rate": 22050}
+        manifest = Manifest(root, fingerprint)
+        assert manifest.lookup("a", [source]) is None
+        _record(manifest, "a", source, "a.npy", ("a.npy", "a.npy", 10, "text"))
+        manifest.close()
+
+        # hit
+        manifest = Manifest(root, fingerprint)
+        assert manifest.lookup("a", [source]) == (
+            ("a.npy", "a.npy", 10, "text"), {"trimmed_samples": 3})
+        # changed hyper parameters
+        assert Manifest(root, {"sample_rate": 16000}).lookup("a", [source]) is None
+        # changed mtime
+        st = os.stat(source)
+        os.utime(source, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        assert manifest.lookup("a", [source]) is None
+        os.utime(source, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert manifest.lookup("a", [source]) is not None
+        # changed size
+        with open(source, "a") as f:
+            f.write("more")
+        assert manifest.lookup("a", [source]) is None
+        # missing output
+        manifest = Manifest(root, fingerprint, rebuild=True)
+        _record(manifest, "a", source, "a.npy", ("a.npy", "a.npy", 10, "text"))
+        os.remove(join(root, "a.npy"))
+        assert manifest.lookup("a", [source]) is None
+        manifest.close()
+    finally:
+        shutil.rmtree(root)
+
+
+def test_manifest_hash():
+    root = tempfile.mkdtemp()
+    try:
+        source = join(root, "a.wav")
+        with open(source, "w") as f:
+            f.write("audio")
+        manifest = Manifest(root, {}, use_hash=True)
+        _record(manifest, "a", source, "a.npy", ("a.npy", "a.npy", 10, "text"))
+        manifest.close()
+        manifest = Manifest(root, {}, use_hash=True)
+
+        # touched, but same content
+        st = os.stat(source)
+        os.utime(source, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        assert manifest.lookup("a", [source]) is not None
+        # same size and mtime, changed content
+        with open(source, "w") as f:
+            f.write("AUDIO")
+        os.utime(source, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert manifest.lookup("a", [source]) is None
+    finally:
+        shutil.rmtree(root)
+
+
+def test_manifest_truncated():
+    root = tempfile.mkdtemp()
+    try:
+        source = join(root, "a.wav")
+        with open(source, "w") as f:
+            f.write("audio")
+        manifest = Manifest(root, {})
+        _record(manifest, "a", source, "a.npy", ("a.npy", "a.npy", 10, "a"))
+        _record(manifest, "b", source, "b.npy", ("b.npy", "b.npy", 10, "b"))
+        manifest.close()
+        # interrupted while writing the last line
+        with open(manifest.path, "rb+") as f:
+            f.truncate(os.path.getsize(manifest.path) - 10)
+
+        manifest = Manifest(root, {})
+        assert manifest.lookup("a", [source]) is not None
+        assert manifest.lookup("b", [source]) is None
+        _record(manifest, "b", source, "b.npy", ("b.npy", "b.npy", 10, "b"))
+        manifest.close()
+        manifest = Manifest(root, {})
+        assert manifest.lookup("a", [source]) is not None
+        assert manifest.lookup("b", [source]) is not None
+    finally:
+        shutil.rmtree(root)
+
+
+def _job(i):
+    # finish out of order
+    time.sleep(0.02 * (i % 3))
+    return ("spec-%d" % i, "mel-%d" % i, i, "text %d" % i), {"trimmed_samples": i}
+
+
+class _FakeManifest(object):
+    use_hash = False
+
+    def __init__(self, hits):
+        self.hits = hits
+        self.recorded = []
+
+    def lookup(self, key, sources):
+        if key in self.hits:
+            return ("spec-%d" % key, "mel-%d" % key, key, "old text"), {}
+        return None
+
+    def record(self, key, sources, outputs, row, info):
+        self.recorded.append(key)
+
+
+def test_pipeline():
+    from pipeline import process
+    pulled = []
+
+    def _jobs():
+        for i in range(20):
+            pulled.append(i)
+            yield i, [], ("text %d" % i,), partial(_job, i)
+
+    # hits and misses mixed within chunks
+    manifest = _FakeManifest(hits=set([1, 2, 5, 8, 9, 10, 11, 19]))
+    results = process(_jobs(), num_workers=2, manifest=manifest,
+                      chunksize=3, max_in_flight=2)
+    row, info = next(results)
+    # bounded: at most max_in_flight chunks are pulled ahead
+    assert len(pulled) <= 2 * 3
+    rows = [row] + [row for row, _ in results]
+    assert [row[2] for row in rows] == list(range(20))
+    # tails of hits are replaced
+    assert [row[-1] for row in rows] == ["text %d" % i for i in range(20)]
+    assert sorted(manifest.recorded) == sorted(set(range(20)) - manifest.hits)
+
+    # without manifest
+    rows = [row for row, _ in process(_jobs(), num_workers=2, chunksize=2)]
+    assert [row[2] for row in rows] == list(range(20))
+
+
+def test_trim_silence():
+    values = {name: getattr(hparams, name) for name in
+              ["trim_silence", "trim_top_db", "trim_margin"]}
+    sr = hparams.sample_rate
+    t = np.arange(sr) / sr
+    speech = 0.3 * np.sin(2 * np.pi * 200 * t)
+    silence = 1e-4 * np.random.RandomState(1234).randn(sr // 2)
+    wav = np.concatenate([silence, speech, silence]).astype(np.float32)
+    # trimmed at frame boundaries
+    tolerance = hparams.fft_size
+    try:
+        hparams.trim_silence, hparams.trim_top_db = True, 30
+        for margin in [0.0, 0.05]:
+            hparams.trim_margin = margin
+            trimmed = audio.trim_silence(wav)
+            assert abs(len(trimmed) - (1 + 2 * margin) * sr) < 2 * tolerance
+            # a slice of the input around the speech
+            assert np.shares_memory(wav, trimmed)
+            start = (trimmed.__array_interface__["data"][0] -
+                     wav.__array_interface__["data"][0]) // wav.itemsize
+            assert abs(start - (0.5 - margin) * sr) < tolerance
+
+        # margins don't go past the ends
+        assert len(audio.trim_silence(speech.astype(np.float32))) == len(speech)
+
+        hparams.trim_silence = False
+        assert len(audio.trim_silence(wav)) == len(wav)
+    finally:
+        for name, value in values.items():
+            hparams.set_hparam(name, value)
+
+
+def test_write_metadata_max_frames():
+    import preprocess
+    max_frames = hparams.max_frames
+    out_dir = tempfile.mkdtemp()
+    rows = [(("s1.npy", "m1.npy", 100, "a"), {"trimmed_samples": 10 * hparams.hop_size}),
+            (("s2.npy", "m2.npy", 500, "b"), {"trimmed_samples": 0}),
+            (("s3.npy", "m3.npy", 200, "c"), {})]
+    try:
+        hparams.max_frames = 300
+        stdout = sys.stdout
+        sys.stdout = out = StringIO()
+        try:
+            texts = preprocess.write_metadata(iter(rows), out_dir)
+        finally:
+            sys.stdout = stdout
+        assert texts == ["a", "c"]
+        with open(join(out_dir, "train.txt")) as f:
+            assert [l.split("|")[0] for l in f] == ["s1.npy", "s3.npy"]
+        report = out.getvalue()
+        assert "Wrote 2 utterances, 300 frames" in report
+        assert "Trimmed silence:   10 frames" in report
+        assert "Left out 1 utterances longer than 300 frames: 500 frames" in report
+        # (10 + 500) / (300 + 500 + 10)
+        assert "-63.0%" in report
+    finally:
+        hparams.max_frames = max_frames
+        shutil.rmtree(out_dir)
+
+
+def test_load_wav_cache():
+    import librosa
+    resample_cache_dir = hparams.resample_cache_dir
+    resample = librosa.resample
+    calls = []
+
+    def _resample(*args, **kwargs):
+        calls.append(1)
+        return resample(*args, **kwargs)
+
+    root = tempfile.mkdtemp()
+    try:
+        path = join(root, "a.wav")
+        sr = 2 * hparams.sample_rate
+        _write_wav(path, duration=0.5, sr=sr)
+        hparams.resample_cache_dir = join(root, "cache")
+        librosa.resample = _resample
+
+        wav = audio.load_wav(path)
+        assert wav.dtype == np.float32
+        assert abs(len(wav) - 0.5 * hparams.sample_rate) <= 1
+        assert len(calls) == 1 and len(os.listdir(hparams.resample_cache_dir)) == 1
+
+        # cache hit
+        assert np.array_equal(audio.load_wav(path), wav)
+        assert len(calls) == 1
+
+        # touching the file invalidates it
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        assert np.array_equal(audio.load_wav(path), wav)
+        assert len(calls) == 2 and len(os.listdir(hparams.resample_cache_dir)) == 2
+
+        # no resampling at the target sample rate
+        _write_wav(path, duration=0.5)
+        assert len(audio.load_wav(path)) == int(0.5 * hparams.sample_rate)
+        assert len(calls) == 2
+    finally:
+        librosa.resample = resample
+        hparams.resample_cache_dir = resample_cache_dir
+        shutil.rmtree(root)
@@ -0,0 +1,43 @@
+# coding: utf-8
+from __future__ import with_statement, print_function, absolute_import
+
+import sys
+import os
+from os.path import dirname, join
+
+from nose.tools import raises
+
+sys.path.insert(0, join(dirname(__file__), ".."))
+import runtime
+
+
+def test_partition_cores():
+    cores = list(range(10))
+    for num_replicas in [1, 2, 3, 4, 10]:
+        parts = runtime.partition_cores(num_replicas, cores)
+        assert len(parts) == num_replicas
+        # disjoint, contiguous and covering
+        assert sum(parts, []) == cores
+        # uneven splits differ by at most one core
+        sizes = [len(p) for p in parts]
+        assert max(sizes) - min(sizes) <= 1
+    assert runtime.partition_cores(3, cores) == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert runtime.partition_cores(2, [4, 6, 7]) == [[4, 6], [7]]
+
+
+@raises(AssertionError)
+def test_partition_cores_too_many_replicas():
+    runtime.partition_cores(3, [0, 1])
+
+
+def test_replica_pool():
+    cores = runtime.available_cores()
+    # share a core if there's only one
+    cores = cores[:2] if len(cores) > 1 else cores * 2
+    with runtime.ReplicaPool(2, cores=cores) as pool:
+        assert list(pool.imap(abs, range(-50, 0))) == list(range(50, 0, -1))
+        if hasattr(os, "sched_getaffinity"):
+            # each replica is pinned to a core of its own subset
+            affinities = set(frozenset(a) for a in
+                             pool.imap(os.sched_getaffinity, [0] * 20))
+            assert affinities <= set([frozenset([c]) for c in cores])
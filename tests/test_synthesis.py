@@ -0,0 +1,38 @@
+# coding: utf-8
+from __future__ import with_statement, print_function, absolute_import
+
+import torch
+import numpy as np
+
+from deepvoice3_pytorch import frontend
+
+from hparams import hparams
+import synthesis
+
+
+def test_tts_quantized():
+    if not hasattr(torch, "quantization"):
+        return
+    values = {name: getattr(hparams, name) for name in
+              ["vocoder", "griffin_lim_iters", "quantize_dynamic"]}
+    use_cuda = synthesis.use_cuda
+    hparams.vocoder = "griffin_lim"
+    hparams.griffin_lim_iters = 2
+    hparams.quantize_dynamic = True
+    synthesis._frontend = frontend.en
+    import train
+    train._frontend = frontend.en
+    try:
+        model = synthesis.load_model(None, max_decoder_steps=10)
+        assert model.quantized
+        # quantized layers must stay on CPU, even if a GPU is available;
+        # nothing is moved to it
+        synthesis.use_cuda = True
+        waveform, alignment, spectrogram, mel = synthesis.tts(model, "Hello.")
+        assert next(model.parameters()).device.type == "cpu"
+        assert len(waveform) > 0
+        assert np.isfinite(mel).all()
+    finally:
+        synthesis.use_cuda = use_cuda
+        for name, value in values.items():
+            hparams.set_hparam(name, value)
@@ -0,0 +1,103 @@
+# coding: utf-8
+from __future__ import with_statement, print_function, absolute_import
+
+import sys
+from os.path import dirname, join
+import shutil
+import tempfile
+
+import numpy as np
+from nose.tools import raises
+
+sys.path.insert(0, join(dirname(__file__), ".."))
+from hparams import hparams
+import train
+
+
+def _write_train_txt(data_root, rows):
+    with open(join(data_root, "train.txt"), "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write("|".join([str(x) for x in row]) + "\n")
+
+
+def test_speaker_id_data_source():
+    data_root = tempfile.mkdtemp()
+    try:
+        _write_train_txt(data_root, [("s1.npy", "m1.npy", 10, 1, "a"),
+                                     ("s2.npy", "m2.npy", 12, 0, "c")])
+        source = train.SpeakerIDDataSource(data_root)
+        assert source.collect_files() == [1, 0]
+        assert source.collect_features(1) == 1
+    finally:
+        shutil.rmtree(data_root)
+
+
+@raises(AssertionError)
+def test_speaker_id_data_source_single_speaker():
+    data_root = tempfile.mkdtemp()
+    try:
+        # no speaker ID column
+        _write_train_txt(data_root, [("s1.npy", "m1.npy", 10, "a")])
+        train.SpeakerIDDataSource(data_root).collect_files()
+    finally:
+        shutil.rmtree(data_root)
+
+
+def test_speaker_balanced_sampler():
+    np.random.seed(1234)
+    # 3:1 data of two speakers
+    speaker_ids = np.array([0] * 30 + [1] * 10)
+    sampler = train.SpeakerBalancedSampler(speaker_ids)
+    assert len(sampler) == 40
+    for _ in range(5):
+        indices = list(sampler)
+        assert sorted(indices) == list(range(40))
+        # every batch of 8 mixes speakers in proportion to their data
+        for b in range(0, 40, 8):
+            counts = np.bincount(speaker_ids[indices[b:b + 8]], minlength=2)
+            assert 5 <= counts[0] <= 7 and 1 <= counts[1] <= 3
+
+
+def test_collate_fn_speaker_ids():
+    r = hparams.outputs_per_step
+    batch = [(np.array([1, 2, 3]), np.random.rand(10, 80).astype(np.float32),
+              np.random.rand(10, 513).astype(np.float32), 2),
+             (np.array([4, 5]), np.random.rand(7, 80).astype(np.float32),
+              np.random.rand(7, 513).astype(np.float32), 0)]
+    x, input_lengths, mel, y, positions, done, target_lengths, speaker_ids = \
+        train.collate_fn(batch)
+    assert speaker_ids.tolist() == [2, 0]
+    assert x.size() == (2, 3)
+    assert mel.size(1) % r == 0 and mel.size(1) >= 10 + r
+
+    # single speaker
+    speaker_ids = train.collate_fn([b[:3] for b in batch])[-1]
+    assert speaker_ids is None
+
+
+def test_feature_dtype_round_trip():
+    import torch
+    import audio
+    feature_dtype = hparams.feature_dtype
+    np.random.seed(1234)
+    features = [np.random.rand(T, 80).astype(np.float32) for T in [10, 7]]
+    features[0][0, :2] = [0, 1]
+    # max error: one quantization step
+    steps = {"float32": 0, "float16": 2 ** -11, "uint16": 1 / 65535, "uint8": 1 / 255}
+    try:
+        for dtype, step in steps.items():
+            hparams.feature_dtype = dtype
+            quantized = [audio.quantize(x) for x in features]
+            assert quantized[0].dtype == np.dtype(dtype)
+            for x, q in zip(features, quantized):
+                assert np.abs(audio.dequantize(q) - x).max() <= step
+
+            b = train._pad_features(quantized, 14, b_pad=2)
+            y = train.dequantize(torch.from_numpy(b)).numpy()
+            assert y.dtype == np.float32
+            for x, yi in zip(features, y):
+                assert np.abs(yi[2:2 + len(x)] - x).max() <= step
+                # padding is zero
+                assert (yi[:2] == 0).all() and (yi[2 + len(x):] == 0).all()
+    finally:
+        hparams.feature_dtype = feature_dtype
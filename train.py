@@ -66,6 +66,29 @@ def _pad_2d(x, max_len, b_pad=0):
     return x
 
 
+def _pad_features(features, max_len, b_pad=0):
+    """Padded batch of features in their storage dtype (see audio.quantize),
+    float32 if they are mixed. uint16 is offset to int16, which torch
+    supports; see dequantize."""
+    dtypes = set(x.dtype for x in features)
+    if len(dtypes) > 1:
+        features = [audio.dequantize(x) for x in features]
+    dtype = features[0].dtype
+    b = np.array([_pad_2d(x, max_len, b_pad=b_pad) for x in features], dtype=dtype)
+    if dtype == np.uint16:
+        b = (b ^ 0x8000).view(np.int16)
+    return b
+
+
+def dequantize(x):
+    """Converts a feature batch of collate_fn to float, on its device."""
+    if x.dtype == torch.uint8:
+        return x.float().div_(255)
+    elif x.dtype == torch.int16:
+        return x.float().add_(32768).div_(65535)
+    return x.float()
+
+
 def plot_alignment(alignment, path, info=None):
     fig, ax = plt.subplots()
     im = ax.imshow(
@@ -86,15 +109,28 @@ def plot_alignment(alignment, path, info=None):
 class TextDataSource(FileDataSource):
     def __init__(self, data_root):
         self.data_root = data_root
+        self._sequences = None
 
     def collect_files(self):
         meta = join(self.data_root, "train.txt")
         with open(meta, "rb") as f:
             lines = f.readlines()
         lines = list(map(lambda l: l.decode("utf-8").split("|")[-1], lines))
+        # Use sequences pre-computed by preprocess.py if they are up to date
+        if hparams.replace_pronunciation_prob <= 0:
+            seqs = frontend.load_sequences(
+                join(self.data_root, "sequences.npz"), lines, hparams.frontend)
+            if seqs is not None:
+                self._sequences = dict(zip(lines, seqs))
+                return lines
+        # Fill text processing caches of the frontend before data loader
+        # workers are forked
+        _frontend.texts_to_sequences(lines, p=hparams.replace_pronunciation_prob)
         return lines
 
     def collect_features(self, text):
+        if self._sequences is not None:
+            return self._sequences[text]
         seq = _frontend.text_to_sequence(text, p=hparams.replace_pronunciation_prob)
         return np.asarray(seq, dtype=np.int32)
 
@@ -126,13 +162,56 @@ class LinearSpecDataSource(_NPYDataSource):
         super(LinearSpecDataSource, self).__init__(data_root, 0)
 
 
+class SpeakerIDDataSource(FileDataSource):
+    def __init__(self, data_root):
+        self.data_root = data_root
+
+    def collect_files(self):
+        meta = join(self.data_root, "train.txt")
+        with open(meta, "rb") as f:
+            lines = f.readlines()
+        cols = list(map(lambda l: l.decode("utf-8").split("|"), lines))
+        assert all(len(c) == 5 for c in cols), "train.txt has no speaker ID column"
+        return list(map(lambda c: int(c[-2]), cols))
+
+    def collect_features(self, speaker_id):
+        return speaker_id
+
+
+class SpeakerBalancedSampler(data_utils.sampler.Sampler):
+    """Shuffle, spreading each speaker's utterances evenly over the epoch.
+
+    Utterances of a speaker with n utterances are put at randomly shifted
+    positions (k + u) / n, k = 0, ..., n - 1, so that every batch contains a
+    mix of speakers in proportion to their amounts of data.
+    """
+
+    def __init__(self, speaker_ids):
+        self.speaker_ids = np.asarray(speaker_ids)
+
+    def __iter__(self):
+        positions = np.empty(len(self.speaker_ids))
+        for speaker_id in np.unique(self.speaker_ids):
+            indices = np.random.permutation(
+                np.flatnonzero(self.speaker_ids == speaker_id))
+            n = len(indices)
+            positions[indices] = (np.arange(n) + np.random.rand()) / n
+        return iter(np.argsort(positions, kind="mergesort").tolist())
+
+    def __len__(self):
+        return len(self.speaker_ids)
+
+
 class PyTorchDataset(object):
-    def __init__(self, X, Mel, Y):
+    def __init__(self, X, Mel, Y, speaker_ids=None):
         self.X = X
         self.Mel = Mel
         self.Y = Y
+        self.speaker_ids = speaker_ids
 
     def __getitem__(self, idx):
+        if self.speaker_ids is not None:
+            return self.X[idx], self.Mel[idx], self.Y[idx], self.speaker_ids[idx]
         return self.X[idx], self.Mel[idx], self.Y[idx]
 
     def __len__(self):
@@ -202,13 +281,14 @@ def collate_fn(batch):
     input_lengths = torch.LongTensor(input_lengths)
     target_lengths = torch.LongTensor(target_lengths)
 
-    b = np.array([_pad_2d(x[1], max_target_len, b_pad=b_pad) for x in batch],
-                 dtype=np.float32)
-    mel_batch = torch.FloatTensor(b)
+    b = _pad_features([x[1] for x in batch], max_target_len, b_pad=b_pad)
+    # Downsample mel spectrogram before it's pinned and copied to device
+    if downsample_step > 1:
+        b = np.ascontiguousarray(b[:, 0::downsample_step])
+    mel_batch = torch.from_numpy(b)
 
-    c = np.array([_pad_2d(x[2], max_target_len, b_pad=b_pad) for x in batch],
-                 dtype=np.float32)
-    y_batch = torch.FloatTensor(c)
+    c = _pad_features([x[2] for x in batch], max_target_len, b_pad=b_pad)
+    y_batch = torch.from_numpy(c)
 
     # text positions
     text_positions = np.array([_pad(np.arange(1, len(x[0]) + 1), max_input_len)
@@ -230,8 +310,13 @@ def collate_fn(batch):
                      for x in batch])
     done = torch.FloatTensor(done).unsqueeze(-1)
 
+    if len(batch[0]) > 3:
+        speaker_ids = torch.LongTensor([x[3] for x in batch])
+    else:
+        speaker_ids = None
+
     return x_batch, input_lengths, mel_batch, y_batch, \
-        (text_positions, frame_positions), done, target_lengths
+        (text_positions, frame_positions), done, target_lengths, speaker_ids
 
 
 def save_alignment(path, attn):
@@ -380,8 +465,8 @@ def train(model, data_loader, optimizer, writer,
     global global_step, global_epoch
     while global_epoch < nepochs:
         running_loss = 0.
-        for step, (x, input_lengths, mel, y, positions, done, target_lengths) \
-                in tqdm(enumerate(data_loader)):
+        for step, (x, input_lengths, mel, y, positions, done, target_lengths,
+                   speaker_ids) in tqdm(enumerate(data_loader)):
             # Learning rate schedule
             if hparams.lr_schedule is not None:
                 lr_schedule_f = getattr(lrschedule, hparams.lr_schedule)
@@ -394,10 +479,6 @@ def train(model, data_loader, optimizer, writer,
             # Used for Position encoding
             text_positions, frame_positions = positions
 
-            # Downsample mel spectrogram
-            if downsample_step > 1:
-                mel = mel[:, 0::downsample_step, :]
-
             # Lengths
             input_lengths = input_lengths.long().numpy()
             decoder_lengths = target_lengths.long().numpy() // r // downsample_step
@@ -408,11 +489,14 @@ def train(model, data_loader, optimizer, writer,
             frame_positions = Variable(frame_positions)
             done = Variable(done)
             target_lengths = Variable(target_lengths)
+            speaker_ids = Variable(speaker_ids) if speaker_ids is not None else None
             if use_cuda:
                 x, mel, y = x.cuda(), mel.cuda(), y.cuda()
                 text_positions = text_positions.cuda()
                 frame_positions = frame_positions.cuda()
                 done, target_lengths = done.cuda(), target_lengths.cuda()
+                speaker_ids = speaker_ids.cuda() if speaker_ids is not None else None
+            mel, y = dequantize(mel), dequantize(y)
 
             # decoder output domain mask
             decoder_target_mask = sequence_mask(
@@ -426,7 +510,7 @@ def train(model, data_loader, optimizer, writer,
                 target_mask = decoder_target_mask
 
             mel_outputs, linear_outputs, attn, done_hat = model(
-                x, mel,
+                x, mel, speaker_ids=speaker_ids,
                 text_positions=text_positions, frame_positions=frame_positions,
                 input_lengths=input_lengths)
 
@@ -443,8 +527,11 @@ def train(model, data_loader, optimizer, writer,
 
             # linear:
             n_priority_freq = int(hparams.priority_freq / (fs * 0.5) * linear_dim)
+            # decoder states predict the next r (downsampled) frames
+            shift = r * downsample_step
             linear_l1_loss, linear_binary_div = spec_loss(
-                linear_outputs[:, :-r, :], y[:, r:, :], target_mask[:, r:, :],
+                linear_outputs[:, :-shift, :], y[:, shift:, :],
+                target_mask[:, shift:, :],
                 priority_bin=n_priority_freq,
                 priority_w=hparams.priority_freq_weight)
             linear_loss = (1 - w) * linear_l1_loss + w * linear_binary_div
@@ -519,6 +606,8 @@ def build_model():
                              mel_dim=hparams.num_mels,
                              linear_dim=hparams.fft_size // 2 + 1,
                              r=hparams.outputs_per_step,
+                             n_speakers=hparams.n_speakers,
+                             speaker_embed_dim=hparams.speaker_embed_dim,
                              padding_idx=hparams.padding_idx,
                              dropout=hparams.dropout,
                              kernel_size=hparams.kernel_size,
@@ -526,7 +615,9 @@ def build_model():
                              decoder_channels=hparams.decoder_channels,
                              converter_channels=hparams.converter_channels,
                              use_memory_mask=hparams.use_memory_mask,
-                             trainable_positional_encodings=hparams.trainable_positional_encodings
+                             trainable_positional_encodings=hparams.trainable_positional_encodings,
+                             downsample_step=hparams.downsample_step,
+                             checkpoint_activations=hparams.checkpoint_activations,
                              )
     return model
 
@@ -556,12 +647,22 @@ if __name__ == "__main__":
     Mel = FileSourceDataset(MelSpecDataSource(data_root))
     Y = FileSourceDataset(LinearSpecDataSource(data_root))
 
+    if hparams.n_speakers > 1:
+        speaker_ids = FileSourceDataset(SpeakerIDDataSource(data_root))
+        assert max(speaker_ids.collected_files) < hparams.n_speakers
+    else:
+        speaker_ids = None
+
     # Dataset and Dataloader setup
-    dataset = PyTorchDataset(X, Mel, Y)
+    dataset = PyTorchDataset(X, Mel, Y, speaker_ids)
+    if speaker_ids is not None and hparams.balanced_speaker_batching:
+        sampler = SpeakerBalancedSampler(speaker_ids.collected_files)
+    else:
+        sampler = None
     data_loader = data_utils.DataLoader(
         dataset, batch_size=hparams.batch_size,
-        num_workers=hparams.num_workers, shuffle=True,
-        collate_fn=collate_fn, pin_memory=hparams.pin_memory)
+        num_workers=hparams.num_workers, shuffle=sampler is None,
+        sampler=sampler, collate_fn=collate_fn, pin_memory=hparams.pin_memory)
 
     # Model
     model = build_model()
@@ -0,0 +1,83 @@
+from functools import partial
+import numpy as np
+import os
+from os.path import exists, join, isdir, splitext
+import audio
+from pipeline import process
+
+
+def build_from_path(in_dir, out_dir, num_workers=1, tqdm=lambda x: x, manifest=None,
+                    chunksize=8):
+    '''Preprocesses a multi-speaker dataset from a given input path into a given output directory.
+
+    Either the VCTK layout (wav48/<speaker>/<name>.wav, txt/<speaker>/<name>.txt) or, more
+    generally, a directory per speaker with .wav files and .txt transcriptions next to them.
+    Utterances without transcription are skipped. Speaker IDs are assigned in the sorted order
+    of speaker names, which are written to speakers.txt in out_dir. Outputs are named by speaker
+    and utterance name, so adding speakers or utterances doesn't invalidate the others.
+
+      Args:
+        in_dir: The directory where you have downloaded the dataset
+        out_dir: The directory to write the output into
+        num_workers: Optional number of worker processes to parallelize across
+        tqdm: You can optionally pass tqdm to get a nice progress bar
+        manifest: Optional manifest.Manifest to skip utterances already processed
+        chunksize: Number of utterances sent to a worker process at once
+
+      Returns:
+        An iterator of ((spectrogram_filename, mel_filename, n_frames, speaker_id, text), info)
+        tuples, in order. Rows should be written to train.txt; info are statistics
+        (trimmed_samples)
+    '''
+    if exists(join(in_dir, 'wav48')):
+        wav_root, txt_root = join(in_dir, 'wav48'), join(in_dir, 'txt')
+    else:
+        wav_root, txt_root = in_dir, in_dir
+    speakers = sorted(d for d in os.listdir(wav_root) if isdir(join(wav_root, d)))
+    with open(join(out_dir, 'speakers.txt'), 'w', encoding='utf-8') as f:
+        for speaker in speakers:
+            f.write(speaker + '\n')
+
+    def _jobs():
+        for speaker_id, speaker in enumerate(speakers):
+            for name in sorted(os.listdir(join(wav_root, speaker))):
+                if not name.endswith('.wav'):
+                    continue
+                wav_path = join(wav_root, speaker, name)
+                txt_path = join(txt_root, speaker, splitext(name)[0] + '.txt')
+                if not exists(txt_path):
+                    continue
+                with open(txt_path, encoding='utf-8') as f:
+                    text = ' '.join(f.read().split())
+                # e.g., p225-p225_001
+                utterance = '%s-%s' % (speaker, splitext(name)[0])
+                yield ('vctk-' + utterance, [wav_path, txt_path], (speaker_id, text),
+                       partial(_process_utterance, out_dir, utterance, wav_path, speaker_id,
+                               text))
+    return tqdm(process(_jobs(), num_workers, manifest, chunksize))
+
+
+def _process_utterance(out_dir, utterance, wav_path, speaker_id, text):
+    # Load the audio to a numpy array, trimming leading/trailing silence:
+    wav = audio.load_wav(wav_path)
+    n_samples = len(wav)
+    wav = audio.trim_silence(wav)
+
+    # Compute the linear-scale spectrogram from the wav:
+    spectrogram = audio.spectrogram(wav).astype(np.float32)
+    n_frames = spectrogram.shape[1]
+
+    # Compute a mel-scale spectrogram from the wav:
+    mel_spectrogram = audio.melspectrogram(wav).astype(np.float32)
+
+    # Write the spectrograms to disk:
+    spectrogram_filename = 'vctk-spec-%s.npy' % utterance
+    mel_filename = 'vctk-mel-%s.npy' % utterance
+    np.save(os.path.join(out_dir, spectrogram_filename), audio.quantize(spectrogram.T),
+            allow_pickle=False)
+    np.save(os.path.join(out_dir, mel_filename), audio.quantize(mel_spectrogram.T),
+            allow_pickle=False)
+
+    # Return a tuple describing this training example:
+    return ((spectrogram_filename, mel_filename, n_frames, speaker_id, text),
+            {'trimmed_samples': n_samples - len(wav)})